@@ -0,0 +1,266 @@
+import sys
+from argparse import ArgumentParser
+from collections.abc import Callable, Sequence
+from itertools import pairwise
+from math import atan2, cos, hypot, radians
+from pathlib import Path
+from random import Random
+
+import orjson
+
+from compression import deflate_compress
+from models.element_id import ElementId
+from models.fetch_relation import (
+    FetchRelationBusStop,
+    FetchRelationBusStopCollection,
+    FetchRelationElement,
+    PublicTransport,
+)
+from models.post_calc_bus_route import PostCalcBusRouteModel
+
+FIXTURES_DIR = Path(__file__).parent / 'fixtures'
+
+# local projection around the origin, coordinates are in meters
+_ORIGIN = (52.0, 21.0)
+_METERS_PER_LAT = 111_320
+_METERS_PER_LON = _METERS_PER_LAT * cos(radians(_ORIGIN[0]))
+
+Point = tuple[float, float]
+
+
+def _lat_lng(point: Point) -> tuple[float, float]:
+    return _ORIGIN[0] + point[1] / _METERS_PER_LAT, _ORIGIN[1] + point[0] / _METERS_PER_LON
+
+
+class _Network:
+    def __init__(self, seed: int):
+        self.random = Random(seed)  # noqa: S311
+        self._node_ids: dict[Point, int] = {}
+        self._points: dict[int, Point] = {}
+        self._ways: dict[ElementId, tuple[list[int], bool, bool]] = {}
+        self._stops: list[FetchRelationBusStopCollection] = []
+
+    def node(self, point: Point) -> int:
+        point = (round(point[0], 2), round(point[1], 2))
+
+        if (node := self._node_ids.get(point)) is None:
+            node = self._node_ids[point] = len(self._node_ids) + 1
+            self._points[node] = point
+
+        return node
+
+    def way(self, points: Sequence[Point], *, oneway: bool = False, roundabout: bool = False) -> ElementId:
+        way_id = ElementId(str(len(self._ways) + 1))
+        self._ways[way_id] = ([self.node(p) for p in points], oneway, roundabout)
+        return way_id
+
+    def road(self, a: Point, b: Point, pieces: int = 1, *, oneway: bool = False) -> list[ElementId]:
+        # osm ways are split at arbitrary points, not only at the intersections
+        points = [a]
+        points.extend((a[0] + (b[0] - a[0]) * i / pieces, a[1] + (b[1] - a[1]) * i / pieces) for i in range(1, pieces))
+        points.append(b)
+        return [self.way(pair, oneway=oneway) for pair in pairwise(points)]
+
+    def grid(
+        self,
+        origin: Point,
+        size: tuple[int, int],
+        spacing: float,
+        *,
+        pieces: int = 1,
+        oneway_rate: float = 0,
+    ) -> dict[tuple[int, int, str], list[ElementId]]:
+        # keyed by the (column, row) of the west/south node and the h(orizontal)/v(ertical) direction
+        cols, rows = size
+        result = {}
+
+        def point(i: int, j: int) -> Point:
+            return origin[0] + i * spacing, origin[1] + j * spacing
+
+        for i in range(cols):
+            for j in range(rows):
+                if i + 1 < cols:
+                    oneway = self.random.random() < oneway_rate
+                    result[i, j, 'h'] = self.road(point(i, j), point(i + 1, j), pieces, oneway=oneway)
+                if j + 1 < rows:
+                    oneway = self.random.random() < oneway_rate
+                    result[i, j, 'v'] = self.road(point(i, j), point(i, j + 1), pieces, oneway=oneway)
+
+        return result
+
+    def roundabout(self, center: Point, radius: float, arms: Sequence[Point]) -> list[Point]:
+        # counter-clockwise ring, returns the points where the arms join it
+        joints = []
+        for x, y in arms:
+            distance = hypot(x - center[0], y - center[1])
+            joints.append(
+                (center[0] + (x - center[0]) / distance * radius, center[1] + (y - center[1]) / distance * radius)
+            )
+
+        ring = sorted(joints, key=lambda p: atan2(p[1] - center[1], p[0] - center[0]))
+        for a, b in zip(ring, ring[1:] + ring[:1], strict=True):
+            self.way((a, b), oneway=True, roundabout=True)
+
+        return joints
+
+    def stop(self, way_id: ElementId, *, right: bool = True) -> None:
+        nodes = self._ways[way_id][0]
+        (ax, ay), (bx, by) = self._points[nodes[0]], self._points[nodes[-1]]
+        length = hypot(bx - ax, by - ay)
+        side = 8 if right else -8
+        point = ((ax + bx) / 2 + (by - ay) / length * side, (ay + by) / 2 - (bx - ax) / length * side)
+        name = f'Stop {len(self._stops) + 1}'
+        platform = FetchRelationBusStop(
+            id=ElementId(str(1_000_000 + len(self._stops))),
+            type='node',
+            member=True,
+            latLng=_lat_lng(point),
+            tags={'highway': 'bus_stop', 'public_transport': 'platform', 'name': name},
+            name=name,
+            groupName=name.lower(),
+            highway='bus_stop',
+            public_transport=PublicTransport.PLATFORM,
+        )
+        self._stops.append(FetchRelationBusStopCollection(platform=platform, stop=None))
+
+    def payload(self, start_way: ElementId, stop_way: ElementId, name: str) -> PostCalcBusRouteModel:
+        endpoint_ways: dict[int, list[ElementId]] = {}
+        for way_id, (nodes, _, _) in self._ways.items():
+            for node in {nodes[0], nodes[-1]}:
+                endpoint_ways.setdefault(node, []).append(way_id)
+
+        ways = {
+            way_id: FetchRelationElement(
+                id=way_id,
+                member=True,
+                oneway=oneway,
+                roundabout=roundabout,
+                nodes=nodes,
+                latLngs=[_lat_lng(self._points[node]) for node in nodes],
+                connectedTo=[w for node in (nodes[0], nodes[-1]) for w in endpoint_ways[node] if w != way_id],
+                turn_in_place_start=False,
+                turn_in_place_end=False,
+            )
+            for way_id, (nodes, oneway, roundabout) in self._ways.items()
+        }
+
+        return PostCalcBusRouteModel(
+            relationId=1,
+            startWay=start_way,
+            stopWay=stop_way,
+            ways=ways,
+            busStops=self._stops,
+            tags={'type': 'route', 'route': 'bus', 'name': name},
+        )
+
+
+def small_urban() -> PostCalcBusRouteModel:
+    net = _Network(1)
+    grid = net.grid((0, 0), (3, 3), 150, oneway_rate=0.15)
+
+    for key in ((0, 0, 'h'), (1, 0, 'h'), (2, 0, 'v'), (1, 1, 'v')):
+        net.stop(grid[key][0])
+
+    return net.payload(grid[0, 0, 'h'][0], grid[1, 2, 'h'][0], 'Small urban')
+
+
+def grid_city() -> PostCalcBusRouteModel:
+    net = _Network(2)
+    grid = net.grid((0, 0), (5, 2), 120, pieces=3, oneway_rate=0.1)
+
+    for key in ((0, 0, 'h'), (1, 0, 'v'), (1, 1, 'h'), (2, 0, 'h'), (3, 1, 'h')):
+        net.stop(grid[key][1])
+
+    return net.payload(grid[0, 0, 'h'][0], grid[3, 1, 'h'][-1], 'Grid city')
+
+
+def roundabout_heavy() -> PostCalcBusRouteModel:
+    net = _Network(3)
+    avenue: list[ElementId] = []
+    west = (0.0, 0.0)
+
+    for i in range(1, 7):
+        center = (i * 400.0, 0.0)
+        east = (center[0] + 200, 0.0)
+        north, south = (center[0], 250.0), (center[0], -250.0)
+        joint_west, joint_east, joint_north, joint_south = net.roundabout(center, 25, (west, east, north, south))
+
+        avenue += net.road(west, joint_west, 2)
+        net.road(joint_north, north)
+        net.road(joint_south, south)
+        west = joint_east
+
+        # side streets link the neighbouring roundabouts
+        if i % 2 == 0:
+            net.road((center[0] - 400, 250.0), north)
+            net.road((center[0] - 400, -250.0), south, oneway=True)
+
+    avenue += net.road(west, (west[0] + 200, 0), 2)
+
+    for way_id in avenue[1:-1:2]:
+        net.stop(way_id)
+
+    return net.payload(avenue[0], avenue[-1], 'Roundabout heavy')
+
+
+def long_intercity() -> PostCalcBusRouteModel:
+    net = _Network(4)
+    town_a = net.grid((0, 0), (3, 2), 150, pieces=2, oneway_rate=0.1)
+    town_b = net.grid((15_300, 0), (3, 2), 150, pieces=2, oneway_rate=0.1)
+    road = net.road((300, 0), (15_300, 0), 30)
+
+    net.stop(town_a[0, 1, 'h'][0])
+    net.stop(town_a[1, 0, 'h'][1])
+    for way_id in road[5::6]:
+        net.stop(way_id)
+    net.stop(town_b[0, 0, 'h'][0])
+    net.stop(town_b[1, 1, 'h'][1])
+
+    return net.payload(town_a[0, 0, 'v'][0], town_b[2, 0, 'v'][-1], 'Long intercity')
+
+
+def roundtrip() -> PostCalcBusRouteModel:
+    net = _Network(5)
+    grid = net.grid((0, 0), (3, 3), 200, pieces=2, oneway_rate=0.1)
+
+    # along the perimeter, counter-clockwise
+    for key in ((1, 0, 'h'), (2, 0, 'v'), (1, 2, 'h'), (0, 1, 'v')):
+        net.stop(grid[key][0])
+
+    start_way = grid[0, 0, 'h'][0]
+    return net.payload(start_way, start_way, 'Roundtrip')
+
+
+SCENARIOS: dict[str, Callable[[], PostCalcBusRouteModel]] = {
+    'small_urban': small_urban,
+    'grid_city': grid_city,
+    'roundabout_heavy': roundabout_heavy,
+    'long_intercity': long_intercity,
+    'roundtrip': roundtrip,
+}
+
+
+def encode_payload(model: PostCalcBusRouteModel) -> bytes:
+    # the same format as the /ws/calc_bus_route requests
+    return deflate_compress(orjson.dumps(model))
+
+
+def main() -> None:
+    parser = ArgumentParser(description='Generate the route engine benchmark fixtures.')
+    parser.add_argument('names', nargs='*', help=f'scenarios to generate, default: all of {", ".join(SCENARIOS)}')
+    args = parser.parse_args()
+
+    if unknown := set(args.names).difference(SCENARIOS):
+        parser.error(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+
+    FIXTURES_DIR.mkdir(exist_ok=True)
+
+    for name in args.names or SCENARIOS:
+        model = SCENARIOS[name]()
+        path = FIXTURES_DIR / f'{name}.bin'
+        path.write_bytes(encode_payload(model))
+        print(f'Generated {path} with {len(model.ways)} ways', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+import asyncio
+import inspect
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from collections import defaultdict
+from collections.abc import Callable
+from contextlib import redirect_stdout
+from functools import wraps
+from io import StringIO
+from pathlib import Path
+from types import ModuleType
+
+import orjson
+from httpx import URL, ASGITransport, AsyncClient
+
+QUERY_FIXTURES_DIR = Path(__file__).parent / 'fixtures' / 'query'
+
+# (module, function, stage name) timed as /query stages, in the order they run
+_STAGES = (
+    ('overpass', 'plan_cells_rects', 'plan_cells_rects'),
+    ('overpass', 'offload', 'decode_responses'),
+    ('overpass', 'split_elements_by_cell', 'split_elements_by_cell'),
+    ('overpass', 'merge_elements_splits', 'merge_elements_splits'),
+    ('overpass', 'preprocess_elements', 'preprocess_elements'),
+    ('overpass', 'merge_relations_tags', 'merge_relations_tags'),
+    ('overpass', 'organize_ways', 'organize_ways'),
+    ('overpass', 'lookup_ways_geometry', 'lookup_ways_geometry'),
+    ('overpass', 'build_bus_stop_collections', 'build_bus_stop_collections'),
+    ('overpass', 'get_download_triggers', 'get_download_triggers'),
+    ('main', 'find_start_stop_ways', 'find_start_stop_ways'),
+    ('main', 'assign_none_members', 'assign_none_members'),
+    ('deflate_middleware', '_encode_chunks', 'compress_response'),
+    ('main', 'iter_dataclass_json', 'serialize_response'),
+)
+# run within the previous stage, not counted twice
+_NESTED_STAGES = frozenset(('serialize_response',))
+
+STAGE_TIMES: defaultdict[str, float] = defaultdict(float)
+
+
+def configure_environment(replay_path: Path) -> None:
+    # must run before the app is imported, it reads its configuration on import
+    os.environ['HTTP_REPLAY_PATH'] = str(replay_path)
+    os.environ.pop('HTTP_REPLAY_RECORD', None)
+    os.environ.pop('OSM_EXTRACT_PATH', None)
+    # every run goes through the overpass path, the cell cache would skip it
+    os.environ['OVERPASS_CELL_CACHE_PATH'] = str(Path(tempfile.mkdtemp()) / 'cells.sqlite')
+    os.environ['OVERPASS_CELL_CACHE_TTL'] = '0'
+
+
+def load_app() -> ModuleType:
+    import main
+    from user_session import require_user_details
+
+    main.app.dependency_overrides[require_user_details] = lambda: {'id': 0, 'display_name': 'benchmark'}
+    return main
+
+
+def reset_app(main: ModuleType) -> None:
+    # the clients cache recent results per instance
+    from openstreetmap import OpenStreetMap
+    from overpass import Overpass
+
+    main._OSM = OpenStreetMap()  # noqa: SLF001
+    main._OVERPASS = Overpass()  # noqa: SLF001
+
+
+async def post_query(app, relation_id: int) -> bytes:
+    async with AsyncClient(transport=ASGITransport(app), base_url='http://benchmark') as client:
+        r = await client.post('/query', json={'relationId': relation_id}, headers={'Accept-Encoding': 'zstd'})
+        r.raise_for_status()
+        return r.content
+
+
+def _timed(name: str, func: Callable) -> Callable:
+    if inspect.iscoroutinefunction(func):
+
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                STAGE_TIMES[name] += time.perf_counter() - start
+
+        return async_wrapper
+
+    if inspect.isgeneratorfunction(func):
+
+        @wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            iterator = func(*args, **kwargs)
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    STAGE_TIMES[name] += time.perf_counter() - start
+                yield item
+
+        return generator_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            STAGE_TIMES[name] += time.perf_counter() - start
+
+    return wrapper
+
+
+def instrument_stages() -> None:
+    for module_name, func_name, stage in _STAGES:
+        module = sys.modules[module_name]
+        setattr(module, func_name, _timed(stage, getattr(module, func_name)))
+
+
+def recorded_relation_ids(path: Path) -> list[int]:
+    result = set()
+
+    for meta_path in path.glob('*.json'):
+        url = URL(orjson.loads(meta_path.read_bytes())['url'])
+        if url.path.endswith('/relations.json'):
+            result.add(int(url.params['relations']))
+
+    return sorted(result)
+
+
+async def run_benchmark(main: ModuleType, relation_id: int, repeat: int) -> tuple[dict[str, float], int, int]:
+    best_times: dict[str, float] = {}
+    size = 0
+
+    for _ in range(repeat):
+        reset_app(main)
+        STAGE_TIMES.clear()
+        start = time.perf_counter()
+        size = len(await post_query(main.app, relation_id))
+        STAGE_TIMES['total'] = time.perf_counter() - start
+
+        for stage, elapsed in STAGE_TIMES.items():
+            best_times[stage] = min(best_times.get(stage, elapsed), elapsed)
+
+    # tracing slows everything down, measure the memory in a separate run
+    reset_app(main)
+    tracemalloc.start()
+    try:
+        await post_query(main.app, relation_id)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return best_times, size, peak_memory
+
+
+async def _main() -> None:
+    parser = ArgumentParser(description='Benchmark /query by replaying recorded Overpass and OSM API responses.')
+    parser.add_argument('relations', type=int, nargs='*', help='relation ids, default: all recorded')
+    parser.add_argument('--replay', type=Path, default=QUERY_FIXTURES_DIR, help='directory with the recordings')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per relation, the best time is reported')
+    args = parser.parse_args()
+
+    configure_environment(args.replay)
+
+    # the app reports its own timings, which would interleave with the results
+    with redirect_stdout(StringIO()):
+        main = load_app()
+    instrument_stages()
+
+    for relation_id in args.relations or recorded_relation_ids(args.replay):
+        with redirect_stdout(StringIO()):
+            times, size, peak_memory = await run_benchmark(main, relation_id, args.repeat)
+
+        print(
+            f'relation {relation_id}: {size / 1024:.0f} KiB response, {peak_memory / 1024 / 1024:.1f} MiB peak memory'
+        )
+        accounted = 0.0
+
+        for _, _, stage in _STAGES:
+            if (elapsed := times.get(stage)) is None:
+                continue
+
+            if stage in _NESTED_STAGES:
+                print(f'    {stage:<26} {elapsed * 1000:>9.1f} ms')
+            else:
+                accounted += elapsed
+                print(f'  {stage:<28} {elapsed * 1000:>9.1f} ms')
+
+        # fetching the relation, reading the recordings, the cell cache and the framework
+        print(f'  {"(other)":<28} {max(0, times["total"] - accounted) * 1000:>9.1f} ms')
+        print(f'  {"total":<28} {times["total"] * 1000:>9.1f} ms')
+
+
+def main() -> None:
+    asyncio.run(_main())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+import asyncio
+import re
+import shutil
+import sys
+from argparse import ArgumentParser
+from random import Random
+
+from httpx import AsyncClient, MockTransport, QueryParams, Request, Response
+
+from benchmarks.query import QUERY_FIXTURES_DIR, configure_environment, load_app, post_query, reset_app
+from http_replay import ReplayTransport
+
+_ORIGIN = (52.2, 21.0)
+_STEP = (0.0012, 0.0018)  # degrees, about 130 meters
+
+_CELL_BB_RE = re.compile(r'way\[highway\]\[!footway\]\(([^)]+)\)')
+_EXPANDED_BB_RE = re.compile(r'node\[highway=bus_stop\]\[public_transport=platform\]\[name\]\(([^)]+)\)')
+_COUNT = {'type': 'count', 'id': 0, 'tags': {}}
+
+BBox = tuple[float, float, float, float]
+
+
+def _parse_bbs(pattern: re.Pattern, query: str) -> list[BBox]:
+    return [tuple(map(float, match.split(','))) for match in pattern.findall(query)]
+
+
+def _inside(lat: float, lon: float, bbs: list[BBox]) -> bool:
+    return any(minlat <= lat <= maxlat and minlon <= lon <= maxlon for minlat, minlon, maxlat, maxlon in bbs)
+
+
+class SyntheticWorld:
+    """
+    A grid city served in the Overpass and OSM API formats, used to record the /query fixtures.
+    """
+
+    def __init__(self, relation_id: int, size: int, seed: int):
+        random = Random(seed)  # noqa: S311
+        self.relation_id = relation_id
+        self.nodes: dict[int, tuple[float, float]] = {}
+        self.ways: list[dict] = []
+        self.turning_circles: list[dict] = []
+        self.stops: list[dict] = []
+        self.stop_areas: list[dict] = []
+        base_id = relation_id * 10_000_000
+
+        def node_id(i: int, j: int) -> int:
+            return base_id + i * size + j + 1
+
+        for i in range(size):
+            for j in range(size):
+                jitter = random.uniform(-0.00005, 0.00005)
+                self.nodes[node_id(i, j)] = (_ORIGIN[0] + i * _STEP[0] + jitter, _ORIGIN[1] + j * _STEP[1] + jitter)
+
+        def add_way(nodes: list[int], tags: dict[str, str]) -> int:
+            way_id = base_id + len(self.ways) + 1
+            self.ways.append({'type': 'way', 'id': way_id, 'nodes': nodes, 'tags': tags})
+            return way_id
+
+        # streets span a few blocks, osm ways rarely end at every intersection
+        rows: list[list[int]] = []
+        for i in range(size):
+            row_ways = []
+            j = 0
+            while j < size - 1:
+                length = random.randint(2, 6)
+                tags = {'highway': 'tertiary' if i % 4 == 0 else 'residential', 'name': f'Street {i}'}
+                if random.random() < 0.1:
+                    tags['oneway'] = 'yes'
+                row_ways.append(add_way([node_id(i, k) for k in range(j, min(j + length, size - 1) + 1)], tags))
+                j += length
+            rows.append(row_ways)
+
+        columns: list[int] = [
+            add_way([node_id(i, j) for i in range(size)], {'highway': 'primary', 'name': f'Avenue {j}'})
+            for j in range(0, size, 3)
+        ]
+
+        # footpaths and dead ends, filtered out or kept by the routing rules
+        for j in range(1, size, 3):
+            add_way([node_id(i, j) for i in range(size)], {'highway': 'footway'})
+
+        next_id = base_id + 5_000_000
+        for j in range(2, size, 5):
+            lat, lon = self.nodes[node_id(size - 1, j)]
+            self.nodes[next_id] = (lat + _STEP[0] / 2, lon)
+            add_way([node_id(size - 1, j), next_id], {'highway': 'residential', 'noexit': 'yes'})
+            self.turning_circles.append({'type': 'node', 'id': next_id, 'tags': {'highway': 'turning_circle'}})
+            next_id += 1
+
+        # a platform and a stop position at every other intersection, some grouped in stop areas
+        for i in range(0, size, 2):
+            for j in range(0, size, 2):
+                lat, lon = self.nodes[node_id(i, j)]
+                name = f'Stop {i}-{j}'
+                platform = {
+                    'type': 'node',
+                    'id': next_id,
+                    'lat': lat + 0.0001,
+                    'lon': lon + 0.0002,
+                    'tags': {'highway': 'bus_stop', 'public_transport': 'platform', 'name': name},
+                }
+                stop = {
+                    'type': 'node',
+                    'id': node_id(i, j),
+                    'lat': lat,
+                    'lon': lon,
+                    'tags': {'public_transport': 'stop_position', 'bus': 'yes', 'name': name},
+                }
+                self.stops += (platform, stop)
+                next_id += 1
+
+                if random.random() < 0.3:
+                    self.stop_areas.append(
+                        {
+                            'type': 'relation',
+                            'id': next_id,
+                            'members': [
+                                {'type': 'node', 'ref': platform['id'], 'role': 'platform'},
+                                {'type': 'node', 'ref': stop['id'], 'role': 'stop'},
+                            ],
+                            'tags': {'type': 'public_transport', 'public_transport': 'stop_area', 'name': name},
+                        }
+                    )
+                    next_id += 1
+
+        # the route follows the first tertiary street, then the middle avenue
+        member_ways = [*rows[0][: len(rows[0]) // 2], columns[len(columns) // 2]]
+        member_nodes = {n for way in self.ways if way['id'] in member_ways for n in way['nodes']}
+        member_platforms = [
+            s['id']
+            for s in self.stops
+            if s['tags']['public_transport'] == 'platform'
+            and any(abs(s['lat'] - self.nodes[n][0]) + abs(s['lon'] - self.nodes[n][1]) < 0.0005 for n in member_nodes)
+        ]
+        self.relation = {
+            'type': 'relation',
+            'id': relation_id,
+            'version': 1,
+            'members': [{'type': 'way', 'ref': way_id, 'role': ''} for way_id in member_ways]
+            + [{'type': 'node', 'ref': stop_id, 'role': 'platform'} for stop_id in member_platforms],
+            'tags': {
+                'type': 'route',
+                'route': 'bus',
+                'public_transport:version': '2',
+                'name': f'Bus {relation_id}',
+                'ref': str(relation_id),
+            },
+        }
+
+    def handle(self, request: Request) -> Response:
+        if request.url.path.endswith('/0.6/relations.json'):
+            if request.url.params.get('relations') != str(self.relation_id):
+                return Response(404)
+            return Response(200, json={'version': '0.6', 'elements': [self.relation]})
+
+        if request.method != 'POST' or not request.url.path.endswith('/interpreter'):
+            return Response(404)
+
+        query = QueryParams(request.content.decode())['data']
+
+        if 'out ids bb' in query:
+            member_ids = {m['ref'] for m in self.relation['members'] if m['type'] == 'way'}
+            elements = []
+            for way in self.ways:
+                if way['id'] in member_ids:
+                    lats, lons = zip(*(self.nodes[n] for n in way['nodes']), strict=True)
+                    bounds = {'minlat': min(lats), 'minlon': min(lons), 'maxlat': max(lats), 'maxlon': max(lons)}
+                    elements.append({'type': 'way', 'id': way['id'], 'bounds': bounds})
+            return Response(200, json={'elements': elements})
+
+        cell_bbs = _parse_bbs(_CELL_BB_RE, query)
+        expanded_bbs = _parse_bbs(_EXPANDED_BB_RE, query)
+
+        ways = [w for w in self.ways if any(_inside(*self.nodes[n], cell_bbs) for n in w['nodes'])]
+        node_ids = sorted({n for w in ways for n in w['nodes']})
+        nodes = [{'type': 'node', 'id': n, 'lat': self.nodes[n][0], 'lon': self.nodes[n][1]} for n in node_ids]
+        turning_circles = [e for e in self.turning_circles if _inside(*self.nodes[e['id']], cell_bbs)]
+        stops = [s for s in self.stops if _inside(s['lat'], s['lon'], expanded_bbs)]
+        stop_ids = {s['id'] for s in stops}
+        stop_areas = [r for r in self.stop_areas if any(m['ref'] in stop_ids for m in r['members'])]
+        area_ids = {
+            role: {m['ref'] for r in stop_areas for m in r['members'] if m['role'] == role}
+            for role in ('platform', 'stop')
+        }
+        area_platforms = [s for s in self.stops if s['id'] in area_ids['platform']]
+        area_stops = [s for s in self.stops if s['id'] in area_ids['stop']]
+
+        elements = []
+        for split in (ways, nodes, turning_circles, stops, stop_areas, area_platforms, area_stops):
+            elements += split
+            elements.append(_COUNT)
+
+        return Response(200, json={'elements': elements})
+
+
+# name: (relation id, grid size)
+WORLDS = {
+    'small_town': (101, 16),
+    'city': (102, 48),
+    'metropolis': (103, 96),
+}
+
+
+async def record(name: str) -> None:
+    relation_id, size = WORLDS[name]
+    world = SyntheticWorld(relation_id, size, seed=relation_id)
+    transport = ReplayTransport(QUERY_FIXTURES_DIR, record=True, transport=MockTransport(world.handle))
+
+    main = load_app()
+    reset_app(main)
+
+    # the synthetic world stands in for the network while recording
+    import overpass
+
+    overpass.HTTP = AsyncClient(transport=transport)
+    main._OSM._http = AsyncClient(base_url=main._OSM._http.base_url, transport=transport)  # noqa: SLF001
+
+    await post_query(main.app, relation_id)
+    print(
+        f'Recorded {name} ({len(world.ways)} ways, {len(world.nodes)} nodes) as relation {relation_id}', file=sys.stderr
+    )
+
+
+def main() -> None:
+    parser = ArgumentParser(description='Record the /query benchmark fixtures from synthetic worlds.')
+    parser.add_argument('names', nargs='*', help=f'worlds to record, default: all of {", ".join(WORLDS)}')
+    parser.add_argument('--clean', action='store_true', help='remove all previous recordings first')
+    args = parser.parse_args()
+
+    if unknown := set(args.names).difference(WORLDS):
+        parser.error(f'Unknown worlds: {", ".join(sorted(unknown))}')
+
+    if args.clean:
+        shutil.rmtree(QUERY_FIXTURES_DIR, ignore_errors=True)
+
+    configure_environment(QUERY_FIXTURES_DIR)
+
+    for name in args.names or WORLDS:
+        asyncio.run(record(name))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import asyncio
+import time
+from argparse import ArgumentParser, ArgumentTypeError, Namespace
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import orjson
+
+from benchmarks.route_engine import load_fixture
+from cython_lib import route
+from cython_lib.route import SearchBudget, SearchStats, calc_bus_route, calibrate_iteration_rate
+
+
+def _parse_setting(value: str) -> tuple[str, float]:
+    name, _, number = value.partition('=')
+    if not name.isupper() or not isinstance(getattr(route, name, None), int | float):
+        raise ArgumentTypeError(f'unknown engine setting {name!r}')
+    return name, type(getattr(route, name))(number)
+
+
+def _apply_settings(settings: dict[str, float]) -> None:
+    # runs in the worker processes too, they may not be forked from this one
+    for name, value in settings.items():
+        setattr(route, name, value)
+
+
+async def replay(path: Path, settings: dict[str, float], args: Namespace) -> None:
+    meta = orjson.loads(path.with_suffix('.json').read_bytes())
+    model = load_fixture(path.with_suffix('.bin'))
+    ways_members = {way_id: way for way_id, way in model.ways.items() if way.member}
+
+    n_processes = args.processes or meta['nProcesses']
+    if args.calibrate or args.iteration_rate is not None:
+        iteration_rate = calibrate_iteration_rate() if args.calibrate else args.iteration_rate
+        budget = SearchBudget.create(iteration_rate, meta['budget']['timeout'])
+    else:
+        budget = SearchBudget(**meta['budget'])
+    if args.timeout is not None:
+        budget = budget._replace(timeout=args.timeout)
+
+    print(
+        f'{path.name}: relation {meta["relationId"]}, {len(ways_members)} ways,'
+        f' recorded {meta["elapsed"]:.3f}s{" (timed out)" if meta["timedOut"] else ""}'
+        f' with {meta["stats"]["iterations"]} iterations on {meta["version"]}'
+    )
+
+    stats = SearchStats()
+    start_time = time.perf_counter()
+
+    with ProcessPoolExecutor(n_processes, initializer=_apply_settings, initargs=(settings,)) as executor:
+        try:
+            final_route = await asyncio.wait_for(
+                calc_bus_route(
+                    ways_members,
+                    model.startWay,
+                    model.stopWay,
+                    model.busStops,
+                    model.tags,
+                    executor,
+                    n_processes=n_processes,
+                    budget=budget,
+                    stats=stats,
+                ),
+                timeout=budget.timeout,
+            )
+        except TimeoutError:
+            status = 'timed out'
+        else:
+            status = f'{len(final_route.ways)} ways, {len(final_route.busStops)} bus stops'
+
+    print(
+        f'  replayed {time.perf_counter() - start_time:.3f}s ({status}) with {stats.iterations} iterations,'
+        f' {stats.pushes} pushes, {stats.pruned} pruned, {stats.batches} batches,'
+        f' {stats.pickled_bytes / 1024:.0f} KiB pickled, {stats.worker_time:.3f}s in workers'
+    )
+
+
+async def _main() -> None:
+    parser = ArgumentParser(description='Replay recorded route calculations through the route engine.')
+    parser.add_argument('recordings', type=Path, nargs='+', help='recordings (.bin or .json) or directories of them')
+    parser.add_argument('--processes', type=int, help='worker processes, default: as recorded')
+    parser.add_argument('--timeout', type=float, help='seconds, default: as recorded, inf to search exhaustively')
+    parser.add_argument('--iteration-rate', type=float, help='size the search batches by this rate instead')
+    parser.add_argument('--calibrate', action='store_true', help='size the search batches by the measured rate')
+    parser.add_argument(
+        '--set',
+        dest='settings',
+        type=_parse_setting,
+        action='append',
+        default=[],
+        metavar='NAME=VALUE',
+        help='override an engine constant, e.g. VISITED_LIMIT=3 or MAX_LOOP_LENGTH=500',
+    )
+    args = parser.parse_args()
+
+    paths: list[Path] = []
+    for path in args.recordings:
+        paths.extend(sorted(path.glob('*.json')) if path.is_dir() else (path,))
+
+    settings = dict(args.settings)
+    _apply_settings(settings)
+
+    for path in paths:
+        await replay(path, settings, args)
+
+
+def main() -> None:
+    asyncio.run(_main())
+
+
+if __name__ == '__main__':
+    main()
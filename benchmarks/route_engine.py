@@ -0,0 +1,230 @@
+import asyncio
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+from typing import NamedTuple
+
+import orjson
+
+from benchmarks.fixtures import FIXTURES_DIR
+from compression import deflate_decompress
+from cython_lib.route import (
+    REFERENCE_ITERATION_RATE,
+    SearchBudget,
+    SearchStats,
+    build_graph,
+    calc_bus_route,
+    calibrate_iteration_rate,
+    contract_chains,
+    split_at_bridges,
+)
+from dataclass_decoder import compile_decoder
+from models.element_id import ElementId
+from models.fetch_relation import PublicTransport
+from models.final_route import FinalRoute
+from models.post_calc_bus_route import PostCalcBusRouteModel
+from relation_builder import sort_bus_on_path
+
+EXPECTED_PATH = FIXTURES_DIR / 'expected.json'
+
+_DECODE_POST_CALC_BUS_ROUTE = compile_decoder(PostCalcBusRouteModel, cast=(ElementId, tuple, PublicTransport))
+
+
+class BenchmarkResult(NamedTuple):
+    name: str
+    ways: int
+    search_ways: int
+    segments: int
+    stage_times: dict[str, float]  # seconds, the best of all runs
+    stats: SearchStats
+    route: dict
+
+
+def _silence() -> None:
+    sys.stdout = Path(os.devnull).open('w')  # noqa: SIM115
+
+
+def _route_key(route: FinalRoute) -> dict:
+    return {
+        'ways': [(route_way.way.id, route_way.reversed_latLngs) for route_way in route.ways],
+        'busStops': [collection.best.id for collection in route.busStops],
+    }
+
+
+async def _run_once(
+    model: PostCalcBusRouteModel,
+    executor: ProcessPoolExecutor,
+    n_processes: int,
+    budget: SearchBudget,
+) -> tuple[dict[str, float], SearchStats, FinalRoute, int, int]:
+    ways = {way_id: way for way_id, way in model.ways.items() if way.member}
+    stage_times: dict[str, float] = {}
+
+    def stage(name: str, start: float) -> float:
+        now = time.perf_counter()
+        stage_times[name] = now - start
+        return now
+
+    # the preparation stages are repeated here to time them separately, calc_bus_route runs them again
+    t = time.perf_counter()
+    sorted_buses = sort_bus_on_path(model.busStops, ways.values())
+    t = stage('sort_bus_on_path', t)
+
+    id_sorted_bus_map: dict[ElementId, list] = {}
+    for sorted_bus in sorted_buses:
+        id_sorted_bus_map.setdefault(sorted_bus.neighbor_id, []).append(sorted_bus)
+
+    search_ways, _, _ = contract_chains(ways, model.startWay, model.stopWay, id_sorted_bus_map)
+    t = stage('contract_chains', t)
+    segments = split_at_bridges(search_ways, model.startWay, model.stopWay)
+    t = stage('split_at_bridges', t)
+    for segment in segments:
+        build_graph(segment.ways)
+    t = stage('build_graph', t)
+
+    stats = SearchStats()
+    route = await calc_bus_route(
+        ways,
+        model.startWay,
+        model.stopWay,
+        model.busStops,
+        model.tags,
+        executor,
+        n_processes=n_processes,
+        budget=budget,
+        stats=stats,
+    )
+    stage('calc_bus_route', t)
+    stage_times['modified_dfs'] = stats.search_time
+    return stage_times, stats, route, len(search_ways), len(segments)
+
+
+async def run_benchmark(
+    name: str,
+    model: PostCalcBusRouteModel,
+    executor: ProcessPoolExecutor,
+    n_processes: int,
+    budget: SearchBudget,
+    repeat: int,
+) -> BenchmarkResult:
+    best_times: dict[str, float] = {}
+    stats = route = None
+
+    for _ in range(repeat):
+        stage_times, stats, route, search_ways, segments = await _run_once(model, executor, n_processes, budget)
+        for stage, elapsed in stage_times.items():
+            best_times[stage] = min(best_times.get(stage, elapsed), elapsed)
+
+    return BenchmarkResult(
+        name=name,
+        ways=sum(way.member for way in model.ways.values()),
+        search_ways=search_ways,
+        segments=segments,
+        stage_times=best_times,
+        stats=stats,
+        route=_route_key(route),
+    )
+
+
+def load_fixture(path: Path) -> PostCalcBusRouteModel:
+    return _DECODE_POST_CALC_BUS_ROUTE(orjson.loads(deflate_decompress(path.read_bytes())))
+
+
+def _print_result(result: BenchmarkResult, status: str) -> None:
+    times = result.stage_times
+    stats = result.stats
+    iteration_rate = stats.iterations / times['modified_dfs'] if times['modified_dfs'] else 0
+    print(
+        f'{result.name:<20} {result.ways:>6} {result.search_ways:>6} {result.segments:>4}'
+        f' {times["sort_bus_on_path"]:>8.4f} {times["contract_chains"]:>8.4f}'
+        f' {times["split_at_bridges"]:>8.4f} {times["build_graph"]:>8.4f} {times["modified_dfs"]:>8.3f}'
+        f' {times["calc_bus_route"]:>8.3f} {stats.iterations:>10} {stats.pushes:>10} {stats.pruned:>8}'
+        f' {stats.batches:>7} {stats.pickled_bytes / 1024:>8.0f} {iteration_rate:>9.0f} {status:>6}'
+    )
+
+
+async def _main() -> int:
+    parser = ArgumentParser(description='Benchmark the route engine on the recorded fixtures.')
+    parser.add_argument('fixtures', type=Path, nargs='*', help='fixture files, default: all in benchmarks/fixtures')
+    parser.add_argument('--processes', type=int, default=2, help='worker processes, fixed for comparable results')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per fixture, the best time is reported')
+    parser.add_argument(
+        '--calibrate',
+        action='store_true',
+        help='size the search batches by the measured iteration rate instead of the reference one',
+    )
+    parser.add_argument('--update', action='store_true', help='record the current routes as the expected ones')
+    parser.add_argument('--output', type=Path, help='write the results as json, for comparing runs')
+    args = parser.parse_args()
+
+    paths: list[Path] = args.fixtures or sorted(FIXTURES_DIR.glob('*.bin'))
+    expected: dict[str, dict] = orjson.loads(EXPECTED_PATH.read_bytes()) if EXPECTED_PATH.is_file() else {}
+    iteration_rate = calibrate_iteration_rate() if args.calibrate else REFERENCE_ITERATION_RATE
+    budget = SearchBudget.create(iteration_rate, timeout=float('inf'))
+    results: list[BenchmarkResult] = []
+    failed = False
+
+    print(
+        f'{"fixture":<20} {"ways":>6} {"search":>6} {"segs":>4} {"sort":>8} {"contract":>8} {"split":>8}'
+        f' {"graph":>8} {"dfs":>8} {"total":>8} {"iterations":>10} {"pushes":>10} {"pruned":>8} {"batches":>7}'
+        f' {"KiB pkl":>8} {"iter/s":>9} {"result":>6}'
+    )
+
+    with ProcessPoolExecutor(args.processes, initializer=_silence) as executor:
+        for path in paths:
+            name = path.name.removesuffix('.bin')
+            model = load_fixture(path)
+
+            # the engine reports its own timings, which would interleave with the table
+            with redirect_stdout(StringIO()):
+                result = await run_benchmark(name, model, executor, args.processes, budget, args.repeat)
+
+            if args.update or name not in expected:
+                status = 'new'
+                expected[name] = result.route
+            elif expected[name] == orjson.loads(orjson.dumps(result.route)):
+                status = 'ok'
+            else:
+                status = 'DIFF'
+                failed = True
+
+            _print_result(result, status)
+            results.append(result)
+
+    if args.update:
+        EXPECTED_PATH.write_bytes(orjson.dumps(expected, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS) + b'\n')
+        print(f'Recorded {len(results)} expected routes in {EXPECTED_PATH}', file=sys.stderr)
+
+    if args.output is not None:
+        args.output.write_bytes(
+            orjson.dumps(
+                [
+                    {
+                        'name': result.name,
+                        'ways': result.ways,
+                        'searchWays': result.search_ways,
+                        'segments': result.segments,
+                        'stageTimes': result.stage_times,
+                        'stats': result.stats,
+                        'route': result.route,
+                    }
+                    for result in results
+                ],
+                option=orjson.OPT_INDENT_2,
+            )
+        )
+
+    return 1 if failed else 0
+
+
+def main() -> None:
+    sys.exit(asyncio.run(_main()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import sqlite3
+import time
+from collections.abc import Iterable, Mapping
+from contextlib import closing
+from pathlib import Path
+
+import orjson
+
+from compression import deflate_compress, deflate_decompress
+from models.download_history import Cell
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cell (
+    route_type TEXT NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (route_type, x, y)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS cell_fetched_at_idx ON cell (fetched_at);
+"""
+
+
+# overpass results stored per download grid cell, shared between sessions and processes
+class CellCache:
+    def __init__(self, path: str, ttl: float):
+        self._path = Path(path)
+        self._ttl = ttl
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+
+        with closing(self._connect()) as conn, conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._path, timeout=30)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def get_many(
+        self,
+        route_type: str,
+        cells: Iterable[Cell],
+        max_age: float | None = None,
+    ) -> dict[Cell, list[list[dict]]]:
+        if max_age is None:
+            max_age = self._ttl
+
+        min_fetched_at = time.time() - max_age
+        result: dict[Cell, list[list[dict]]] = {}
+
+        with closing(self._connect()) as conn:
+            for cell in cells:
+                row = conn.execute(
+                    'SELECT data FROM cell WHERE route_type = ? AND x = ? AND y = ? AND fetched_at >= ?',
+                    (route_type, cell.x, cell.y, min_fetched_at),
+                ).fetchone()
+
+                if row is not None:
+                    result[cell] = orjson.loads(deflate_decompress(row[0]))
+
+        return result
+
+    def put_many(self, route_type: str, cells_splits: Mapping[Cell, list[list[dict]]]) -> None:
+        now = time.time()
+        rows = tuple(
+            (route_type, cell.x, cell.y, now, deflate_compress(orjson.dumps(splits)))
+            for cell, splits in cells_splits.items()
+        )
+
+        with closing(self._connect()) as conn, conn:
+            conn.executemany('INSERT OR REPLACE INTO cell VALUES (?, ?, ?, ?, ?)', rows)
+            conn.execute('DELETE FROM cell WHERE fetched_at < ?', (now - self._ttl,))
@@ -1,10 +1,160 @@
+import hashlib
+import sys
 import zlib
+from argparse import ArgumentParser
+from collections.abc import Iterable
+from pathlib import Path
+from typing import NamedTuple, Protocol
 
+import brotli
+import zstandard
 
-def deflate_decompress(data: bytes) -> bytes:
-    return zlib.decompress(data, -zlib.MAX_WBITS)
+# dictionary-compressed zstd stream, see RFC 9842
+_DCZ_MAGIC = b'\x5e\x2a\x4d\x18\x20\x00\x00\x00'
 
+_ZSTD_READ_SIZE = 256 * 1024
 
-def deflate_compress(data: bytes) -> bytes:
-    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+
+class DecompressedSizeError(ValueError):
+    pass
+
+
+class CompressionLevels(NamedTuple):
+    zstd: int = 3
+    br: int = 4
+    deflate: int = 6
+
+
+class CompressionDictionary(NamedTuple):
+    data: bytes
+    digest: bytes  # sha-256
+    zstd: zstandard.ZstdCompressionDict
+
+    @classmethod
+    def load(cls, path: str | Path) -> 'CompressionDictionary':
+        data = Path(path).read_bytes()
+        # browsers use the dictionary as raw content, regardless of how it was made
+        zstd = zstandard.ZstdCompressionDict(data, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+        return cls(data=data, digest=hashlib.sha256(data).digest(), zstd=zstd)
+
+
+class CompressObj(Protocol):
+    def compress(self, data: bytes, /) -> bytes: ...
+    def flush(self) -> bytes: ...
+
+
+def deflate_decompress(data: bytes, *, max_size: int | None = None) -> bytes:
+    if max_size is None:
+        return zlib.decompress(data, -zlib.MAX_WBITS)
+
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    result = decompressor.decompress(data, max_size + 1)
+    if len(result) > max_size:
+        raise DecompressedSizeError(f'Decompressed size exceeds {max_size} bytes')
+    return result + decompressor.flush()
+
+
+def deflate_compress(data: bytes, level: int = -1, *, raw: bool = True) -> bytes:
+    compressor = deflate_compressobj(level, raw=raw)
     return compressor.compress(data) + compressor.flush()
+
+
+def deflate_compress_chunks(chunks: Iterable[bytes], level: int = -1) -> bytes:
+    compressor = deflate_compressobj(level)
+    result = [compressor.compress(chunk) for chunk in chunks]
+    result.append(compressor.flush())
+    return b''.join(result)
+
+
+def deflate_compressobj(level: int = -1, *, raw: bool = True) -> CompressObj:
+    return zlib.compressobj(level, wbits=-zlib.MAX_WBITS if raw else zlib.MAX_WBITS)
+
+
+def brotli_decompress(data: bytes, *, max_size: int | None = None) -> bytes:
+    if max_size is None:
+        return brotli.decompress(data)
+
+    decompressor = brotli.Decompressor()
+    result = decompressor.process(data, output_buffer_limit=max_size + 1)
+    if len(result) > max_size:
+        raise DecompressedSizeError(f'Decompressed size exceeds {max_size} bytes')
+    if not decompressor.is_finished():
+        raise brotli.error('Truncated brotli stream')
+    return result
+
+
+def brotli_compress(data: bytes, level: int = CompressionLevels().br) -> bytes:
+    return brotli.compress(data, quality=level)
+
+
+class _BrotliCompressObj:
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes, /) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+
+def brotli_compressobj(level: int = CompressionLevels().br) -> CompressObj:
+    return _BrotliCompressObj(level)
+
+
+def _zstd_compressor(level: int, dictionary: CompressionDictionary | None) -> zstandard.ZstdCompressor:
+    # compressors are not thread-safe, create one per call, the parsed dictionary is shared
+    return zstandard.ZstdCompressor(level=level, dict_data=dictionary.zstd if dictionary is not None else None)
+
+
+def zstd_decompress(data: bytes, *, max_size: int | None = None) -> bytes:
+    # frames of streaming compressors may not include the content size
+    if max_size is None:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+    # the content size in the frame header can't be trusted either
+    result = bytearray()
+    with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+        while chunk := reader.read(_ZSTD_READ_SIZE):
+            result += chunk
+            if len(result) > max_size:
+                raise DecompressedSizeError(f'Decompressed size exceeds {max_size} bytes')
+    return bytes(result)
+
+
+def zstd_compress(data: bytes, level: int = CompressionLevels().zstd) -> bytes:
+    return _zstd_compressor(level, None).compress(data)
+
+
+def zstd_compressobj(
+    level: int = CompressionLevels().zstd, dictionary: CompressionDictionary | None = None
+) -> CompressObj:
+    return _zstd_compressor(level, dictionary).compressobj()
+
+
+def dcz_header(dictionary: CompressionDictionary) -> bytes:
+    return _DCZ_MAGIC + dictionary.digest
+
+
+def dcz_compress(data: bytes, dictionary: CompressionDictionary, level: int = CompressionLevels().zstd) -> bytes:
+    return dcz_header(dictionary) + _zstd_compressor(level, dictionary).compress(data)
+
+
+def train_dictionary(samples: list[bytes], size: int) -> bytes:
+    return zstandard.train_dictionary(size, samples).as_bytes()
+
+
+def main() -> None:
+    parser = ArgumentParser(description='Train a zstd dictionary from saved responses.')
+    parser.add_argument('output', type=Path)
+    parser.add_argument('samples', type=Path, nargs='+')
+    parser.add_argument('--size', type=int, default=112_640, help='dictionary size in bytes')
+    args = parser.parse_args()
+
+    samples = [path.read_bytes() for path in args.samples]
+    args.output.write_bytes(train_dictionary(samples, args.size))
+    print(f'Trained {args.output} from {len(samples)} samples', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -17,6 +17,54 @@ if TEST_ENV:
 # https://wiki.openstreetmap.org/wiki/Overpass_API#Public_Overpass_API_instances
 OVERPASS_API_INTERPRETER = os.getenv('OVERPASS_API_INTERPRETER', 'https://overpass-api.de/api/interpreter')
 
+# Split relation downloads into this many independent queries, executed concurrently.
+# Only worth enabling with a dedicated instance, public instances enforce per-client rate limits.
+OVERPASS_QUERY_CHUNKS = int(os.getenv('OVERPASS_QUERY_CHUNKS', '1'))
+OVERPASS_MAX_CONCURRENT_QUERIES = int(os.getenv('OVERPASS_MAX_CONCURRENT_QUERIES', '4'))
+
+# Downloaded grid cells are cached on disk and shared between all users.
+# The relation reload button always bypasses the cache.
+OVERPASS_CELL_CACHE_PATH = os.getenv('OVERPASS_CELL_CACHE_PATH', 'data/overpass_cells.sqlite')
+OVERPASS_CELL_CACHE_TTL = int(os.getenv('OVERPASS_CELL_CACHE_TTL', '3600'))  # seconds
+
+# Serve Overpass and OSM API responses from recordings in this directory, e.g. for offline benchmarks.
+# With HTTP_REPLAY_RECORD=1, requests go to the network and the responses are recorded instead.
+# Authenticated requests and the OAuth token exchange always go to the network and are never recorded.
+HTTP_REPLAY_PATH = os.getenv('HTTP_REPLAY_PATH', None)
+HTTP_REPLAY_RECORD = os.getenv('HTTP_REPLAY_RECORD', '0').strip().lower() in ('1', 'true', 'yes')
+
+# Answer queries from a local OSM extract instead of the Overpass API.
+# Import and keep it up-to-date with `osm-extract import/update` (requires pyosmium).
+# The extract may lag behind, uploads re-read the versions of the relations they modify from the OSM API.
+OSM_EXTRACT_PATH = os.getenv('OSM_EXTRACT_PATH', None)
+
+# Responses are compressed with zstd, brotli or deflate, depending on the client support.
+# Optionally, zstd can use a dictionary trained on saved /query responses: `python compression.py dict.bin samples/*`.
+# It is offered to browsers through Compression Dictionary Transport (Content-Encoding: dcz).
+COMPRESSION_MIN_SIZE = 1024  # bytes
+COMPRESSION_DICTIONARY_PATH = os.getenv('COMPRESSION_DICTIONARY_PATH', None)
+# Compressed requests are rejected when they decompress to more than this.
+REQUEST_MAX_SIZE = 64 * 1024 * 1024  # bytes
+
+# CPU-bound work on payloads of at least this size (compression, serialization) runs in a thread pool.
+# The event loop is sampled for stalls, which are reported when they exceed EVENT_LOOP_LAG_WARN.
+OFFLOAD_MIN_SIZE = 64 * 1024  # bytes
+OFFLOAD_MAX_THREADS = 4
+EVENT_LOOP_LAG_INTERVAL = 0.1  # seconds
+EVENT_LOOP_LAG_WARN = 0.25  # seconds
+
+# Request stage durations and route search counters are served at /metrics in the Prometheus format.
+# When set, the endpoint requires an `Authorization: Bearer <METRICS_TOKEN>` header.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', None)
+
+# OSM user ids allowed to use the admin endpoints, comma-separated.
+# POST /admin/profile profiles the next route calculations or queries of a relation into PROFILE_PATH.
+# The event loop is sampled, the offloaded work and the route search processes are traced, which slows them down.
+ADMIN_USER_IDS = frozenset(int(user_id) for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip())
+PROFILE_PATH = os.getenv('PROFILE_PATH', 'data/profiles')
+PROFILE_MAX_COUNT = 5
+PROFILE_SAMPLE_INTERVAL = 0.001  # seconds
+
 TAG_MAX_LENGTH = 255
 
 OSM_CLIENT = os.getenv('OSM_CLIENT', None)
@@ -30,15 +78,42 @@ if not OSM_CLIENT or not OSM_SECRET:
         'You will not be able to authenticate with OpenStreetMap.'
     )
 
+# Element fetches are split into chunks of ids, to stay within the URL length limits.
+# Identical fetches in flight are shared, and the results are cached briefly.
+OSM_ELEMENTS_CHUNK_SIZE = 400
+OSM_MAX_CONCURRENT_REQUESTS = 4
+OSM_ELEMENT_CACHE_TTL = 60  # seconds
+# Route calculations reuse a cached relation while it is fresh. Once stale, the cached relation is still used,
+# while the current version is fetched in the background. Loads and uploads always fetch the current version.
+# The cache is per worker process, an upload invalidates only the cache of the worker that handled it.
+OSM_RELATION_FRESH_TTL = 15  # seconds
+OSM_RELATION_STALE_TTL = 300  # seconds
+
 CALC_ROUTE_MAX_REQUESTS = 3
 CALC_ROUTE_N_PROCESSES = max(1, os.process_cpu_count() // 4)
 CALC_ROUTE_MAX_PROCESSES = CALC_ROUTE_MAX_REQUESTS * CALC_ROUTE_N_PROCESSES
+CALC_ROUTE_MAX_QUEUED = 30
+CALC_ROUTE_MAX_QUEUED_PER_USER = 2
+CALC_ROUTE_QUEUE_COST_DELAY = 0.0005  # seconds per way, small relations overtake large ones queued this much earlier
+# the search budget grows with relation size and shrinks when others are waiting
+CALC_ROUTE_ITER_PER_WAY = 4000
+CALC_ROUTE_MIN_TIMEOUT = 1  # seconds, counted from admission
+CALC_ROUTE_MAX_TIMEOUT = 6  # seconds, counted from admission
+
+# Keep the requests of route calculations slower than the threshold (or timed out) in this directory.
+# Replay them with `python -m benchmarks.replay_route <recording>`.
+ROUTE_RECORD_PATH = os.getenv('ROUTE_RECORD_PATH', None)
+ROUTE_RECORD_THRESHOLD = float(os.getenv('ROUTE_RECORD_THRESHOLD', '3'))  # seconds
+ROUTE_RECORD_MAX_RECORDS = int(os.getenv('ROUTE_RECORD_MAX_RECORDS', '200'))
 
 CHANGESET_ID_PLACEHOLDER = f'__CHANGESET_ID_PLACEHOLDER__{secrets.token_urlsafe(8)}__'
 
 DOWNLOAD_RELATION_WAY_BB_EXPAND = 250  # meters
 DOWNLOAD_RELATION_GRID_SIZE = 0.01  # degrees
 DOWNLOAD_RELATION_GRID_CELL_EXPAND = 0.001  # degrees, only used for internal calculations, not sent to the user
+DOWNLOAD_RELATION_GRID_BOX_COST = 4  # cells, overhead of an extra query bounding box relative to one cell of data
+# The rectangle cover is planned on the event loop, larger areas are covered with the runs of cells in each row.
+DOWNLOAD_RELATION_GRID_PLAN_MAX_CELLS = 1000
 
 print(f'[CONF] {DOWNLOAD_RELATION_GRID_SIZE * 111_111 = :.0f} meters')
 print(f'[CONF] {DOWNLOAD_RELATION_GRID_CELL_EXPAND * 111_111 = :.0f} meters')
@@ -1,19 +1,35 @@
 import asyncio
+import pickle
+import time
 from collections.abc import Sequence
 from concurrent.futures import ProcessPoolExecutor
-from dataclasses import replace
+from dataclasses import dataclass, replace
 from functools import partial
-from itertools import chain
+from itertools import chain, pairwise
+from math import inf
+from statistics import median
 from typing import NamedTuple, Self
 
 import cython
+import networkx as nx
 
 from cython_lib.geoutils import haversine_distance
+from metrics import (
+    ROUTE_SEARCH_BATCHES,
+    ROUTE_SEARCH_ITERATIONS,
+    ROUTE_SEARCH_PICKLED_BYTES,
+    ROUTE_SEARCH_PRUNED,
+    ROUTE_SEARCH_PUSHES,
+    ROUTE_SEARCH_WORKER_BATCHES,
+    ROUTE_SEARCH_WORKER_SECONDS,
+    stage_time,
+)
 from models.element_id import ElementId
 from models.fetch_relation import FetchRelationBusStopCollection, FetchRelationElement
 from models.final_route import FinalRoute, FinalRouteWay
+from offload import offload
+from profiler import current_profile, trace
 from relation_builder import SortedBusEntry, sort_bus_on_path
-from utils import print_run_time
 
 if cython.compiled:
     from cython.cimports.libc.math import acos, pi
@@ -39,6 +55,16 @@ MAX_AFTER_FINISH_LENGTH = 1000
 MAX_EXTRA_DISTANCE_TO_CONVERT = 1000
 MAX_PATH_LENGTH_FACTOR = 2.2
 
+# target wall time of a batch of iterations, the synchronous one gives the search a head start
+SYNC_BATCH_TIME = 0.03
+ASYNC_BATCH_TIME = 0.1
+
+# AMD Ryzen 9 5950X, used until calibrated
+REFERENCE_ITERATION_RATE = 100_000  # iterations per second
+CALIBRATION_GRID_SIZE = 8
+CALIBRATION_ITER = 5000
+CALIBRATION_ROUNDS = 3
+
 
 class GraphKey(NamedTuple):
     way_id: ElementId
@@ -149,6 +175,50 @@ class BestPathCollection(NamedTuple):
             valid=self.valid.select_best(other.valid),
         )
 
+    def best(self) -> BestPath:
+        return self.valid if self.valid.path else self.invalid
+
+
+class SearchBudget(NamedTuple):
+    sync_max_iter: int
+    async_max_iter: int
+    timeout: float  # seconds
+
+    @classmethod
+    def create(cls, iteration_rate: float, timeout: float) -> Self:
+        return cls(
+            sync_max_iter=max(100, int(iteration_rate * SYNC_BATCH_TIME)),
+            async_max_iter=max(100, int(iteration_rate * ASYNC_BATCH_TIME)),
+            timeout=timeout,
+        )
+
+
+@dataclass(kw_only=True, slots=True)
+class SearchStats:
+    iterations: int = 0
+    pushes: int = 0  # states added to the stack
+    pruned: int = 0  # states discarded by the limits
+    batches: int = 0
+    pickled_bytes: int = 0  # exchanged with the worker processes
+    worker_time: float = 0  # seconds, spent in the worker processes
+    search_time: float = 0  # seconds
+
+    def add(self, other: 'SearchStats') -> None:
+        self.iterations += other.iterations
+        self.pushes += other.pushes
+        self.pruned += other.pruned
+        self.batches += other.batches
+        self.pickled_bytes += other.pickled_bytes
+        self.worker_time += other.worker_time
+
+    def record_metrics(self) -> None:
+        ROUTE_SEARCH_ITERATIONS.inc(self.iterations)
+        ROUTE_SEARCH_PUSHES.inc(self.pushes)
+        ROUTE_SEARCH_PRUNED.inc(self.pruned)
+        ROUTE_SEARCH_BATCHES.inc(self.batches)
+        ROUTE_SEARCH_PICKLED_BYTES.inc(self.pickled_bytes)
+        ROUTE_SEARCH_WORKER_SECONDS.inc(self.worker_time)
+
 
 def build_graph(ways: dict[ElementId, FetchRelationElement]) -> dict[GraphKey, GraphValue]:
     convert_graph: dict[GraphKey, list[GraphKey]] = {}
@@ -201,6 +271,375 @@ def build_graph(ways: dict[ElementId, FetchRelationElement]) -> dict[GraphKey, G
     return result
 
 
+def _chain_links(
+    ways: dict[ElementId, FetchRelationElement],
+    start_way: ElementId,
+    end_way: ElementId,
+) -> dict[tuple[ElementId, bool], tuple[ElementId, bool]]:
+    # (way, at start) -> (way, at start), for endpoints shared by exactly two plain ways
+    def is_plain(way: FetchRelationElement) -> bool:
+        return (
+            way.id != start_way
+            and way.id != end_way
+            and not way.roundabout
+            and not way.turn_in_place_start
+            and not way.turn_in_place_end
+            and way.latLngs[0] != way.latLngs[-1]
+        )
+
+    def partners_at(way: FetchRelationElement, latlon: tuple[float, float]) -> list[tuple[ElementId, bool]]:
+        partners: list[tuple[ElementId, bool]] = []
+        for connected_way_id in way.connectedTo:
+            connected_way = ways.get(connected_way_id)
+            if not connected_way or connected_way_id == way.id:
+                continue
+            if latlon == connected_way.latLngs[0]:
+                partners.append((connected_way_id, BOOL_START))
+            elif latlon == connected_way.latLngs[-1]:
+                partners.append((connected_way_id, BOOL_END))
+        return partners
+
+    result: dict[tuple[ElementId, bool], tuple[ElementId, bool]] = {}
+
+    for way_id, way in ways.items():
+        if not is_plain(way):
+            continue
+
+        for at_start in (BOOL_START, BOOL_END):
+            latlon = way.latLngs[0] if at_start else way.latLngs[-1]
+            partners = partners_at(way, latlon)
+            if len(partners) != 1:
+                continue
+
+            partner_id, partner_at_start = partners[0]
+            partner = ways[partner_id]
+
+            if not is_plain(partner) or partner.oneway != way.oneway:
+                continue
+            # oneway chains must flow through the joint
+            if way.oneway and partner_at_start == at_start:
+                continue
+            if partners_at(partner, latlon) != [(way_id, at_start)]:
+                continue
+
+            result[way_id, at_start] = partners[0]
+
+    return result
+
+
+def contract_chains(
+    ways: dict[ElementId, FetchRelationElement],
+    start_way: ElementId,
+    end_way: ElementId,
+    id_sorted_bus_map: dict[ElementId, list[SortedBusEntry]],
+) -> tuple[
+    dict[ElementId, FetchRelationElement],
+    dict[ElementId, tuple[GraphKey, ...]],
+    dict[ElementId, list[SortedBusEntry]],
+]:
+    """
+    Merge non-branching chains of ways into single ways, so that the search steps over them at once.
+
+    Returns the contracted ways, their chains (as traversed forward) and the bus stop map.
+    """
+    links = _chain_links(ways, start_way, end_way)
+    if not links:
+        return ways, {}, id_sorted_bus_map
+
+    chains: list[tuple[GraphKey, ...]] = []
+    chained: set[ElementId] = set()
+
+    for way_id in ways:
+        if way_id in chained or ((way_id, BOOL_START) not in links and (way_id, BOOL_END) not in links):
+            continue
+
+        # walk back to the head of the chain
+        head = GraphKey(way_id, BOOL_START)
+        seen = {way_id}
+        is_cycle = False
+
+        while (link := links.get((head.way_id, head.is_start))) is not None:
+            if link[0] in seen:
+                is_cycle = True
+                break
+            seen.add(link[0])
+            head = GraphKey(link[0], not link[1])
+
+        # isolated rings have no endpoints to contract to
+        if is_cycle:
+            chained.update(seen)
+            continue
+
+        keys = [head]
+        while (link := links.get((keys[-1].way_id, not keys[-1].is_start))) is not None:
+            keys.append(GraphKey(link[0], link[1]))
+
+        if ways[head.way_id].oneway and not head.is_start:
+            keys = [key._replace(is_start=not key.is_start) for key in reversed(keys)]
+
+        chained.update(key.way_id for key in keys)
+        chains.append(tuple(keys))
+
+    way_chain_id: dict[ElementId, ElementId] = {
+        key.way_id: chain_keys[0].way_id for chain_keys in chains for key in chain_keys
+    }
+
+    def connected_to(way_id: ElementId, source_ways: Sequence[FetchRelationElement]) -> list[ElementId]:
+        result = {
+            way_chain_id.get(connected_way_id, connected_way_id): None
+            for w in source_ways
+            for connected_way_id in w.connectedTo
+        }
+        result.pop(way_id, None)
+        return list(result)
+
+    result_ways = {
+        way_id: replace(way, connectedTo=connected_to(way_id, (way,)))
+        if any(connected_way_id in way_chain_id for connected_way_id in way.connectedTo)
+        else way
+        for way_id, way in ways.items()
+        if way_id not in way_chain_id
+    }
+    result_chains: dict[ElementId, tuple[GraphKey, ...]] = {}
+    result_bus_map = {way_id: entries for way_id, entries in id_sorted_bus_map.items() if way_id not in way_chain_id}
+
+    for chain_keys in chains:
+        chain_id = chain_keys[0].way_id
+        chain_ways = tuple(ways[key.way_id] for key in chain_keys)
+        nodes: list[int] = []
+        latlons: list[tuple[float, float]] = []
+        bus_entries: list[SortedBusEntry] = []
+
+        for key, way in zip(chain_keys, chain_ways, strict=True):
+            way_nodes = way.nodes if key.is_start else way.nodes[::-1]
+            way_latlons = way.latLngs if key.is_start else way.latLngs[::-1]
+            nodes.extend(way_nodes if not nodes else way_nodes[1:])
+            latlons.extend(way_latlons if not latlons else way_latlons[1:])
+
+            way_bus_entries = id_sorted_bus_map.get(key.way_id, ())
+            if key.is_start:
+                bus_entries.extend(way_bus_entries)
+            else:
+                bus_entries.extend(
+                    entry._replace(right_hand_side=not entry.right_hand_side)
+                    if entry.right_hand_side is not None
+                    else entry
+                    for entry in reversed(way_bus_entries)
+                )
+
+        result_ways[chain_id] = FetchRelationElement(
+            id=chain_id,
+            member=True,
+            oneway=chain_ways[0].oneway,
+            roundabout=False,
+            nodes=nodes,
+            latLngs=latlons,
+            connectedTo=connected_to(chain_id, chain_ways),
+            turn_in_place_start=False,
+            turn_in_place_end=False,
+            # length and midpoint are calculated from the joined geometry
+        )
+        result_chains[chain_id] = chain_keys
+
+        if bus_entries:
+            result_bus_map[chain_id] = bus_entries
+
+    return result_ways, result_chains, result_bus_map
+
+
+def expand_best_path(
+    best_path: BestPath,
+    chains: dict[ElementId, tuple[GraphKey, ...]],
+    id_sorted_bus_map: dict[ElementId, list[SortedBusEntry]],
+) -> BestPath:
+    """
+    Replace contracted chains in the path with their ways, and renumber the bus stops accordingly.
+    """
+    if not chains:
+        return best_path
+
+    path: list[GraphKey] = []
+
+    for key in best_path.path:
+        if (chain_keys := chains.get(key.way_id)) is None:
+            path.append(key)
+        elif key.is_start:
+            path.extend(chain_keys)
+        else:
+            path.extend(chain_key._replace(is_start=not chain_key.is_start) for chain_key in reversed(chain_keys))
+
+    visited_bus_stops, almost_visited_bus_stops = _path_bus_stops(path, id_sorted_bus_map)
+
+    return best_path._replace(
+        path=tuple(path),
+        visited_bus_stops=visited_bus_stops | almost_visited_bus_stops,
+    )
+
+
+def _path_bus_stops(
+    path: Sequence[GraphKey],
+    id_sorted_bus_map: dict[ElementId, list[SortedBusEntry]],
+) -> tuple[dict[ElementId, int], dict[ElementId, int]]:
+    # bus stops are ordered by the path position they were first seen at
+    visited_bus_stops: dict[ElementId, int] = {}
+    almost_visited_bus_stops: dict[ElementId, int] = {}
+
+    for i, key in enumerate(path, 1):
+        visited, almost_visited = get_bus_stops_at(key, id_sorted_bus_map)
+
+        for b in visited:
+            visited_bus_stops.setdefault(b.bus_stop_collection.best.id, i)
+
+        for b in almost_visited:
+            almost_visited_bus_stops.setdefault(b.bus_stop_collection.best.id, i)
+
+        if visited or almost_visited:
+            almost_visited_bus_stops = {k: v for k, v in almost_visited_bus_stops.items() if k not in visited_bus_stops}
+
+    return visited_bus_stops, almost_visited_bus_stops
+
+
+class RouteSegment(NamedTuple):
+    ways: dict[ElementId, FetchRelationElement]
+    start_way: ElementId
+    end_way: ElementId
+
+
+def split_at_bridges(
+    ways: dict[ElementId, FetchRelationElement],
+    start_way: ElementId,
+    end_way: ElementId,
+) -> list[RouteSegment]:
+    """
+    Split the route search at bridges: ways that every route from the start to the end must cross.
+
+    Each segment runs from one bridge to the next, and includes everything reachable in between.
+    """
+    whole = [RouteSegment(ways, start_way, end_way)]
+    if start_way == end_way:
+        return whole
+
+    G = nx.MultiGraph()  # noqa: N806
+    for way_id, way in ways.items():
+        G.add_edge(tuple(way.latLngs[0]), tuple(way.latLngs[-1]), key=way_id)
+
+    bridges = {(u, v): next(iter(G[u][v])) for u, v in nx.bridges(G)}
+    if not bridges:
+        return whole
+
+    G.remove_edges_from((u, v, way_id) for (u, v), way_id in bridges.items())
+    point_component = {point: i for i, component in enumerate(nx.connected_components(G)) for point in component}
+
+    # bridges connect the 2-edge-connected components into a forest
+    T = nx.Graph()  # noqa: N806
+    T.add_nodes_from(set(point_component.values()))
+    for (u, v), way_id in bridges.items():
+        T.add_edge(point_component[u], point_component[v], way_id=way_id)
+
+    for virtual, way_id in (('start', start_way), ('end', end_way)):
+        way = ways[way_id]
+        T.add_edge(virtual, point_component[tuple(way.latLngs[0])])
+        T.add_edge(virtual, point_component[tuple(way.latLngs[-1])])
+
+    try:
+        tree_path = nx.shortest_path(T, 'start', 'end')
+    except nx.NetworkXNoPath:
+        return whole
+
+    components = tree_path[1:-1]
+    cut_ways: list[ElementId] = [T[u][v]['way_id'] for u, v in pairwise(components)]
+    if not cut_ways:
+        return whole
+
+    T.remove_nodes_from(('start', 'end'))
+    T.remove_edges_from(pairwise(components))
+    component_segment = {
+        tree_node: i
+        for i, component in enumerate(components)
+        for tree_node in nx.node_connected_component(T, component)
+    }
+
+    segment_ways: list[dict[ElementId, FetchRelationElement]] = [{} for _ in components]
+    cut_ways_set = set(cut_ways)
+
+    for way_id, way in ways.items():
+        if (
+            way_id not in cut_ways_set
+            and (i := component_segment.get(point_component[tuple(way.latLngs[0])])) is not None
+        ):
+            segment_ways[i][way_id] = way
+
+    for i, way_id in enumerate(cut_ways):
+        segment_ways[i][way_id] = ways[way_id]
+        segment_ways[i + 1][way_id] = ways[way_id]
+
+    segment_ends = (start_way, *cut_ways, end_way)
+    return [
+        RouteSegment(segment, segment_start, segment_end)
+        for segment, segment_start, segment_end in zip(segment_ways, segment_ends, segment_ends[1:], strict=False)
+    ]
+
+
+def _join_paths(
+    paths: Sequence[BestPath],
+    ways: dict[ElementId, FetchRelationElement],
+    id_sorted_bus_map: dict[ElementId, list[SortedBusEntry]],
+) -> BestPath:
+    # consecutive paths share the bridge way they meet at
+    path = tuple(chain(paths[0].path, *(p.path[1:] for p in paths[1:])))
+    visited_bus_stops, almost_visited_bus_stops = _path_bus_stops(path, id_sorted_bus_map)
+    complete_path = {key.way_id for key in path}
+
+    return BestPath(
+        path=path,
+        visited_bus_stops=visited_bus_stops | almost_visited_bus_stops,
+        bus_stops_count=len(visited_bus_stops),
+        almost_bus_stops_count=len(almost_visited_bus_stops),
+        length=sum(ways[key.way_id].length for key in path),
+        complete_path=complete_path,
+        complete_length=sum(ways[way_id].length for way_id in complete_path),
+        angle_sum=sum(p.angle_sum for p in paths),
+    )
+
+
+def join_best_paths(
+    best_paths: Sequence[BestPathCollection],
+    ways: dict[ElementId, FetchRelationElement],
+    id_sorted_bus_map: dict[ElementId, list[SortedBusEntry]],
+) -> BestPath:
+    """
+    Stitch the valid paths of consecutive segments.
+
+    If the end is not reachable, return the best partial route instead:
+    the completed segments, followed by the best invalid path of the next one.
+    """
+    valid_paths: list[BestPath] = []
+    partial_routes: list[BestPath] = []
+
+    def continues(path: BestPath) -> bool:
+        return bool(path.path) and (not valid_paths or path.path[0] == valid_paths[-1].path[-1])
+
+    for best_path in best_paths:
+        if continues(best_path.invalid):
+            partial_routes.append(_join_paths((*valid_paths, best_path.invalid), ways, id_sorted_bus_map))
+
+        if not continues(best_path.valid):
+            break
+
+        valid_paths.append(best_path.valid)
+
+    else:
+        return _join_paths(valid_paths, ways, id_sorted_bus_map)
+
+    if valid_paths:
+        partial_routes.append(_join_paths(valid_paths, ways, id_sorted_bus_map))
+
+    result = BestPath.zero()
+    for partial_route in partial_routes:
+        result = result.select_best(partial_route)
+    return result
+
+
 def angle_between_ways(
     latlons1: Sequence[tuple[cython.double, cython.double]],
     latlons2: Sequence[tuple[cython.double, cython.double]],
@@ -314,161 +753,258 @@ def modified_dfs_worker(
     best_path: BestPathCollection,
     max_length: cython.double,
     max_iter: cython.int,
-) -> tuple[list[StackElement], BestPathCollection]:
-    message_ref = [f'Worker with {len(stack)} stack size']
-    current_iter = 0
+    max_after_finish_length: cython.double = MAX_AFTER_FINISH_LENGTH,
+) -> tuple[list[StackElement], BestPathCollection, SearchStats]:
+    iterations: cython.int = 0
+    pushes: cython.int = 0
+    pruned: cython.int = 0
+
+    for _ in range(max_iter):
+        if not stack:
+            break
+
+        s = stack.pop()
+        iterations += 1
+
+        current_key = s.path[-1]
+        exit_at_key = current_key._replace(is_start=not current_key.is_start)
+
+        current_best_path = BestPath(
+            s.path,
+            visited_bus_stops=s.visited_bus_stops | s.almost_visited_bus_stops,
+            bus_stops_count=len(s.visited_bus_stops),
+            almost_bus_stops_count=len(s.almost_visited_bus_stops),
+            length=s.length,
+            complete_path=s.complete_path,
+            complete_length=s.complete_length,
+            angle_sum=s.angle_sum,
+        )
 
-    with print_run_time(message_ref):
-        for current_iter in range(1, max_iter + 1):  # noqa: B007
-            if not stack:
-                break
+        if current_key.way_id == end_way:
+            if (replace := best_path.valid.select_best(current_best_path)) == current_best_path:
+                best_path = best_path._replace(valid=replace)
+        else:
+            if (replace := best_path.invalid.select_best(current_best_path)) == current_best_path:
+                best_path = best_path._replace(invalid=replace)
 
-            s = stack.pop()
+        current_way = ways[current_key.way_id]
+        neighbors = graph[exit_at_key].connected_to
+        valid_neighbors = select_neighbors(current_way, neighbors, ways)
 
-            current_key = s.path[-1]
-            exit_at_key = current_key._replace(is_start=not current_key.is_start)
+        intersection_id = graph[exit_at_key].intersection_id
 
-            current_best_path = BestPath(
-                s.path,
-                visited_bus_stops=s.visited_bus_stops | s.almost_visited_bus_stops,
-                bus_stops_count=len(s.visited_bus_stops),
-                almost_bus_stops_count=len(s.almost_visited_bus_stops),
-                length=s.length,
-                complete_path=s.complete_path,
-                complete_length=s.complete_length,
-                angle_sum=s.angle_sum,
+        if (t := s.intersection_bus_stops_snapshot.get(intersection_id, None)) is not None:
+            intersection_bus_stops_count, intersection_visit_count = t
+        else:
+            intersection_bus_stops_count = None
+            intersection_visit_count = 0
+
+        new_intersection_bus_stops_snapshot = s.intersection_bus_stops_snapshot.copy()
+
+        if (intersection_bus_stops_count is None) or (
+            intersection_bus_stops_count < len(s.visited_bus_stops) + len(s.almost_visited_bus_stops)
+        ):
+            new_intersection_visit_count = 1
+            new_intersection_bus_stops_snapshot[intersection_id] = (
+                len(s.visited_bus_stops) + len(s.almost_visited_bus_stops),
+                new_intersection_visit_count,
             )
+        elif intersection_visit_count < VISITED_LIMIT:
+            new_intersection_visit_count = intersection_visit_count + 1
+            new_intersection_bus_stops_snapshot[intersection_id] = (
+                intersection_bus_stops_count,
+                new_intersection_visit_count,
+            )
+        else:
+            pruned += 1
+            continue
 
-            if current_key.way_id == end_way:
-                if (replace := best_path.valid.select_best(current_best_path)) == current_best_path:
-                    best_path = best_path._replace(valid=replace)
-            else:
-                if (replace := best_path.invalid.select_best(current_best_path)) == current_best_path:
-                    best_path = best_path._replace(invalid=replace)
+        for neighbor, neighbor_angle in valid_neighbors:
+            neighbor_way = ways[neighbor.way_id]
 
-            current_way = ways[current_key.way_id]
-            neighbors = graph[exit_at_key].connected_to
-            valid_neighbors = select_neighbors(current_way, neighbors, ways)
+            new_path = (*s.path, neighbor)
 
-            intersection_id = graph[exit_at_key].intersection_id
+            visited_bus_stops, almost_visited_bus_stops = get_bus_stops_at(neighbor, id_sorted_bus_map)
 
-            if (t := s.intersection_bus_stops_snapshot.get(intersection_id, None)) is not None:
-                intersection_bus_stops_count, intersection_visit_count = t
-            else:
-                intersection_bus_stops_count = None
-                intersection_visit_count = 0
-
-            new_intersection_bus_stops_snapshot = s.intersection_bus_stops_snapshot.copy()
-
-            if (intersection_bus_stops_count is None) or (
-                intersection_bus_stops_count < len(s.visited_bus_stops) + len(s.almost_visited_bus_stops)
-            ):
-                new_intersection_visit_count = 1
-                new_intersection_bus_stops_snapshot[intersection_id] = (
-                    len(s.visited_bus_stops) + len(s.almost_visited_bus_stops),
-                    new_intersection_visit_count,
-                )
-            elif intersection_visit_count < VISITED_LIMIT:
-                new_intersection_visit_count = intersection_visit_count + 1
-                new_intersection_bus_stops_snapshot[intersection_id] = (
-                    intersection_bus_stops_count,
-                    new_intersection_visit_count,
-                )
-            else:
-                continue
+            if visited_bus_stops or almost_visited_bus_stops:
+                new_visited_bus_stops = s.visited_bus_stops.copy()
+                new_almost_visited_bus_stops = s.almost_visited_bus_stops.copy()
 
-            for neighbor, neighbor_angle in valid_neighbors:
-                neighbor_way = ways[neighbor.way_id]
+                for b in visited_bus_stops:
+                    new_visited_bus_stops.setdefault(b.bus_stop_collection.best.id, len(new_path))
 
-                new_path = (*s.path, neighbor)
+                for b in almost_visited_bus_stops:
+                    new_almost_visited_bus_stops.setdefault(b.bus_stop_collection.best.id, len(new_path))
 
-                visited_bus_stops, almost_visited_bus_stops = get_bus_stops_at(neighbor, id_sorted_bus_map)
+                new_almost_visited_bus_stops = {
+                    k: v for k, v in new_almost_visited_bus_stops.items() if k not in new_visited_bus_stops
+                }
+            else:
+                new_visited_bus_stops = s.visited_bus_stops
+                new_almost_visited_bus_stops = s.almost_visited_bus_stops
 
-                if visited_bus_stops or almost_visited_bus_stops:
-                    new_visited_bus_stops = s.visited_bus_stops.copy()
-                    new_almost_visited_bus_stops = s.almost_visited_bus_stops.copy()
+            new_length = s.length + neighbor_way.length
 
-                    for b in visited_bus_stops:
-                        new_visited_bus_stops.setdefault(b.bus_stop_collection.best.id, len(new_path))
+            if new_length > max_length:
+                pruned += 1
+                continue
 
-                    for b in almost_visited_bus_stops:
-                        new_almost_visited_bus_stops.setdefault(b.bus_stop_collection.best.id, len(new_path))
+            if neighbor_way.id not in s.complete_path:
+                new_complete_path = s.complete_path.copy()
+                new_complete_path.add(neighbor_way.id)
+                new_complete_length = s.complete_length + neighbor_way.length
+            else:
+                new_complete_path = s.complete_path
+                new_complete_length = s.complete_length
 
-                    new_almost_visited_bus_stops = {
-                        k: v for k, v in new_almost_visited_bus_stops.items() if k not in new_visited_bus_stops
-                    }
-                else:
-                    new_visited_bus_stops = s.visited_bus_stops
-                    new_almost_visited_bus_stops = s.almost_visited_bus_stops
+            # roundabout looping and exits are free
+            if current_way.roundabout:  # noqa: SIM108
+                new_angle_sum = s.angle_sum
+            else:
+                new_angle_sum = s.angle_sum + neighbor_angle
 
-                new_length = s.length + neighbor_way.length
+            if new_intersection_visit_count > 1:  # noqa: SIM108
+                new_loop_length = s.loop_length + neighbor_way.length
+            else:
+                new_loop_length = 0
 
-                if new_length > max_length:
-                    continue
+            # stop path if too long loop
+            if new_loop_length > MAX_LOOP_LENGTH:
+                pruned += 1
+                continue
 
-                if neighbor_way.id not in s.complete_path:
-                    new_complete_path = s.complete_path.copy()
-                    new_complete_path.add(neighbor_way.id)
-                    new_complete_length = s.complete_length + neighbor_way.length
-                else:
-                    new_complete_path = s.complete_path
-                    new_complete_length = s.complete_length
+            if s.after_finish_length > 0 or neighbor.way_id == end_way:
+                new_after_finish_length = s.after_finish_length + neighbor_way.length
+            else:
+                new_after_finish_length = 0
 
-                # roundabout looping and exits are free
-                if current_way.roundabout:  # noqa: SIM108
-                    new_angle_sum = s.angle_sum
-                else:
-                    new_angle_sum = s.angle_sum + neighbor_angle
+            # stop path if too long after finish
+            if new_after_finish_length > max_after_finish_length:
+                pruned += 1
+                continue
 
-                if new_intersection_visit_count > 1:  # noqa: SIM108
-                    new_loop_length = s.loop_length + neighbor_way.length
+            if neighbor_way.roundabout:
+                if s.roundabout_enter:
+                    # stop path if looping in roundabout
+                    if s.roundabout_enter == neighbor:
+                        pruned += 1
+                        continue
+                    else:
+                        new_roundabout_enter = s.roundabout_enter
                 else:
-                    new_loop_length = 0
+                    new_roundabout_enter = neighbor
+            else:
+                new_roundabout_enter = None
+
+            stack.append(
+                StackElement(
+                    path=new_path,
+                    visited_bus_stops=new_visited_bus_stops,
+                    almost_visited_bus_stops=new_almost_visited_bus_stops,
+                    intersection_bus_stops_snapshot=new_intersection_bus_stops_snapshot,
+                    length=new_length,
+                    complete_path=new_complete_path,
+                    complete_length=new_complete_length,
+                    angle_sum=new_angle_sum,
+                    loop_length=new_loop_length,
+                    after_finish_length=new_after_finish_length,
+                    roundabout_enter=new_roundabout_enter,
+                )
+            )
+            pushes += 1
 
-                # stop path if too long loop
-                if new_loop_length > MAX_LOOP_LENGTH:
-                    continue
+    return stack, best_path, SearchStats(iterations=iterations, pushes=pushes, pruned=pruned, batches=1)
 
-                if s.after_finish_length > 0 or neighbor.way_id == end_way:
-                    new_after_finish_length = s.after_finish_length + neighbor_way.length
-                else:
-                    new_after_finish_length = 0
 
-                # stop path if too long after finish
-                if new_after_finish_length > MAX_AFTER_FINISH_LENGTH:
-                    continue
+def _modified_dfs_worker_pickled(payload: bytes, profiled: bool = False) -> bytes:
+    # the state is pickled explicitly to measure how much of it is exchanged
+    start_time = time.perf_counter()
+    args, kwargs = pickle.loads(payload)  # noqa: S301
 
-                if neighbor_way.roundabout:
-                    if s.roundabout_enter:
-                        # stop path if looping in roundabout
-                        if s.roundabout_enter == neighbor:
-                            continue
-                        else:
-                            new_roundabout_enter = s.roundabout_enter
-                    else:
-                        new_roundabout_enter = neighbor
-                else:
-                    new_roundabout_enter = None
-
-                stack.append(
-                    StackElement(
-                        path=new_path,
-                        visited_bus_stops=new_visited_bus_stops,
-                        almost_visited_bus_stops=new_almost_visited_bus_stops,
-                        intersection_bus_stops_snapshot=new_intersection_bus_stops_snapshot,
-                        length=new_length,
-                        complete_path=new_complete_path,
-                        complete_length=new_complete_length,
-                        angle_sum=new_angle_sum,
-                        loop_length=new_loop_length,
-                        after_finish_length=new_after_finish_length,
-                        roundabout_enter=new_roundabout_enter,
-                    )
-                )
+    if profiled:
+        (stack, best_path, stats), samples = trace(modified_dfs_worker, *args, **kwargs)
+    else:
+        stack, best_path, stats = modified_dfs_worker(*args, **kwargs)
+        samples = None
+
+    stats.worker_time = time.perf_counter() - start_time
+    return pickle.dumps((stack, best_path, stats, samples), pickle.HIGHEST_PROTOCOL)
+
+
+def _calibration_ways(size: cython.int) -> dict[ElementId, FetchRelationElement]:
+    # a grid of two-way streets, about 100 meters apart
+    endpoints: dict[ElementId, tuple[int, int]] = {}
+
+    for i in range(size):
+        for j in range(size):
+            node = i * size + j
+            if j + 1 < size:
+                endpoints[ElementId(f'{node}h')] = (node, node + 1)
+            if i + 1 < size:
+                endpoints[ElementId(f'{node}v')] = (node, node + size)
+
+    node_ways: dict[int, list[ElementId]] = {}
+    for way_id, way_nodes in endpoints.items():
+        for node in way_nodes:
+            node_ways.setdefault(node, []).append(way_id)
+
+    return {
+        way_id: FetchRelationElement(
+            id=way_id,
+            member=True,
+            oneway=False,
+            roundabout=False,
+            nodes=list(way_nodes),
+            latLngs=[(52 + (node // size) * 0.001, 21 + (node % size) * 0.001) for node in way_nodes],
+            connectedTo=[w for node in way_nodes for w in node_ways[node] if w != way_id],
+            turn_in_place_start=False,
+            turn_in_place_end=False,
+        )
+        for way_id, way_nodes in endpoints.items()
+    }
+
+
+def calibrate_iteration_rate() -> float:
+    """
+    Measure the route search throughput of this process, in iterations per second.
+    """
+    ways = _calibration_ways(CALIBRATION_GRID_SIZE)
+    graph = build_graph(ways)
+    start_way = next(iter(ways))
+    start_key = GraphKey(start_way, BOOL_START)
+    max_length = MAX_PATH_LENGTH_FACTOR * sum(w.length for w in ways.values())
+    rates: list[float] = []
+
+    for _ in range(CALIBRATION_ROUNDS):
+        stack = [
+            StackElement(
+                path=(start_key,),
+                visited_bus_stops={},
+                almost_visited_bus_stops={},
+                intersection_bus_stops_snapshot={graph[start_key].intersection_id: (0, 1)},
+                length=ways[start_way].length,
+                complete_path={start_way},
+                complete_length=ways[start_way].length,
+            )
+        ]
 
-        message_ref[0] += f' and {current_iter} iterations'
+        start_time = time.perf_counter()
+        stack, _, _ = modified_dfs_worker(
+            graph,
+            ways,
+            ElementId(''),  # unreachable, search the whole grid
+            {},
+            stack,
+            BestPathCollection(valid=BestPath.zero(), invalid=BestPath.zero()),
+            max_length=max_length,
+            max_iter=CALIBRATION_ITER,
+        )
+        elapsed_time = time.perf_counter() - start_time
 
-    return stack, best_path
+        assert stack, 'Calibration grid must not be exhausted'
+        rates.append(CALIBRATION_ITER / elapsed_time)
+
+    return median(rates)
 
 
 async def modified_dfs(
@@ -479,8 +1015,16 @@ async def modified_dfs(
     id_sorted_bus_map: dict[ElementId, list[SortedBusEntry]],
     executor: ProcessPoolExecutor,
     n_processes: cython.int,
-) -> BestPath:
-    max_length = MAX_PATH_LENGTH_FACTOR * sum(w.length for w in ways.values())
+    budget: SearchBudget,
+    max_length: float | None = None,
+    max_after_finish_length: float = MAX_AFTER_FINISH_LENGTH,
+    stats: SearchStats | None = None,
+) -> BestPathCollection:
+    if stats is None:
+        stats = SearchStats()
+
+    if max_length is None:
+        max_length = MAX_PATH_LENGTH_FACTOR * sum(w.length for w in ways.values())
 
     start_start_key = GraphKey(start_way, BOOL_START)
     start_end_key = GraphKey(start_way, BOOL_END)
@@ -508,13 +1052,8 @@ async def modified_dfs(
 
     best_path = BestPathCollection(valid=BestPath.zero(), invalid=BestPath.zero())
 
-    # for reference:
-    # AMD Ryzen 9 5950X: 10,000 iterations in ~ 0.1s
-    sync_max_iter = 3000  # .03s
-    async_max_iter = 10000  # .10s
-
     # run a few iterations synchronously to get a head start
-    stack, best_path = modified_dfs_worker(
+    stack, best_path, worker_stats = modified_dfs_worker(
         graph,
         ways,
         end_way,
@@ -522,31 +1061,43 @@ async def modified_dfs(
         stack,
         best_path,
         max_length=max_length,
-        max_iter=sync_max_iter,
+        max_iter=budget.sync_max_iter,
+        max_after_finish_length=max_after_finish_length,
     )
+    stats.add(worker_stats)
 
     async def worker(
         stack_slice: list[StackElement],
         best_path: BestPathCollection,
         max_iter: cython.int,
-    ) -> tuple[list[StackElement], BestPathCollection]:
+    ) -> tuple[list[StackElement], BestPathCollection, SearchStats]:
         loop = asyncio.get_running_loop()
-
-        return await loop.run_in_executor(
-            executor,
-            partial(
-                modified_dfs_worker,
-                graph,
-                ways,
-                end_way,
-                id_sorted_bus_map,
-                stack_slice,
-                best_path,
-                max_length=max_length,
-                max_iter=max_iter,
+        profile = current_profile()
+        payload = await offload(
+            pickle.dumps,
+            (
+                (graph, ways, end_way, id_sorted_bus_map, stack_slice, best_path),
+                {'max_length': max_length, 'max_iter': max_iter, 'max_after_finish_length': max_after_finish_length},
             ),
+            pickle.HIGHEST_PROTOCOL,
         )
 
+        ROUTE_SEARCH_WORKER_BATCHES.inc()
+        try:
+            result = await loop.run_in_executor(
+                executor, partial(_modified_dfs_worker_pickled, payload, profiled=profile is not None)
+            )
+        finally:
+            ROUTE_SEARCH_WORKER_BATCHES.dec()
+
+        stack_slice, best_path_slice, worker_stats, samples = await offload(pickle.loads, result)
+        worker_stats.pickled_bytes = len(payload) + len(result)
+
+        if profile is not None:
+            profile.add(samples, '[worker process]')
+
+        return stack_slice, best_path_slice, worker_stats
+
     tasks: list[asyncio.Task] = []
     while stack or tasks:
         stack_slices_len_target = n_processes - len(tasks)
@@ -568,7 +1119,7 @@ async def modified_dfs(
                 worker(
                     stack_slice,
                     best_path,
-                    async_max_iter,
+                    budget.async_max_iter,
                 )
             )
             for stack_slice in stack_slices
@@ -577,13 +1128,14 @@ async def modified_dfs(
         done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
 
         for task in done:
-            stack_slice, best_path_slice = task.result()
+            stack_slice, best_path_slice, worker_stats = task.result()
             stack += stack_slice
             best_path = best_path.merge(best_path_slice, ways)
+            stats.add(worker_stats)
 
         tasks = list(pending)
 
-    return best_path.valid if best_path.valid.path else best_path.invalid
+    return best_path
 
 
 def finalize_route(
@@ -641,8 +1193,13 @@ async def calc_bus_route(
     tags: dict[str, str],
     executor: ProcessPoolExecutor,
     n_processes: cython.int,
+    budget: SearchBudget,
+    stats: SearchStats | None = None,
 ) -> FinalRoute:
-    with print_run_time('Sorting bus stops'):
+    if stats is None:
+        stats = SearchStats()
+
+    with stage_time('sort_bus_stops', 'Sorting bus stops'):
         sorted_buses = sort_bus_on_path(bus_stop_collections, ways_members.values())
 
     id_sorted_bus_map: dict[ElementId, list[SortedBusEntry]] = {}
@@ -650,18 +1207,51 @@ async def calc_bus_route(
     for sorted_bus in sorted_buses:
         id_sorted_bus_map.setdefault(sorted_bus.neighbor_id, []).append(sorted_bus)
 
-    with print_run_time('Building graph'):
-        graph = build_graph(ways_members)
-
-    with print_run_time('Calculating route'):
-        best_path = await modified_dfs(
-            graph,
-            ways_members,
-            start_way,
-            end_way,
-            id_sorted_bus_map,
-            executor,
-            n_processes,
-        )
-
-    return finalize_route(best_path, ways_members, bus_stop_collections, tags)
+    with stage_time('graph_build', 'Building graph'):
+        search_ways, chains, search_bus_map = contract_chains(ways_members, start_way, end_way, id_sorted_bus_map)
+        segments = split_at_bridges(search_ways, start_way, end_way)
+        graphs = tuple(build_graph(segment.ways) for segment in segments)
+
+    print(f'[🔗] Contracted {len(ways_members)} ways into {len(search_ways)} in {len(segments)} segments')
+
+    search_start = time.perf_counter()
+    search_stats = SearchStats()
+
+    try:
+        with stage_time('dfs', 'Calculating route'):
+            # segments are independent, share the processes between them
+            segment_n_processes = max(1, n_processes // len(segments))
+            max_length = MAX_PATH_LENGTH_FACTOR * sum(w.length for w in search_ways.values())
+            best_paths = await asyncio.gather(
+                *(
+                    modified_dfs(
+                        graph,
+                        segment.ways,
+                        segment.start_way,
+                        segment.end_way,
+                        search_bus_map,
+                        executor,
+                        segment_n_processes,
+                        budget,
+                        max_length=max_length,
+                        # there is nothing past the bridge that ends a segment
+                        max_after_finish_length=MAX_AFTER_FINISH_LENGTH if i == len(segments) - 1 else inf,
+                        stats=search_stats,
+                    )
+                    for i, (graph, segment) in enumerate(zip(graphs, segments, strict=True))
+                )
+            )
+    finally:
+        # also counts the searches cut short by the timeout
+        search_stats.search_time = time.perf_counter() - search_start
+        search_stats.record_metrics()
+        stats.add(search_stats)
+        stats.search_time += search_stats.search_time
+
+    with stage_time('finalize'):
+        if len(segments) == 1:
+            best_path = best_paths[0].best()
+        else:
+            best_path = join_best_paths(best_paths, search_ways, search_bus_map)
+        best_path = expand_best_path(best_path, chains, id_sorted_bus_map)
+        return finalize_route(best_path, ways_members, bus_stop_collections, tags)
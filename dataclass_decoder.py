@@ -0,0 +1,232 @@
+from collections.abc import Callable, Collection, Mapping, Sequence
+from dataclasses import MISSING, fields, is_dataclass
+from enum import Enum
+from functools import cache
+from types import NoneType, UnionType
+from typing import Any, Union, get_args, get_origin, get_type_hints
+
+type Decoder = Callable[[Any], Any]
+
+# types which decode to the input value after an isinstance check
+# like dacite, float follows the numeric tower: JSON.stringify(1.0) is 1, and bool is an int
+_CHECKED_TYPES = {
+    bool: bool,
+    int: int,
+    float: (int, float),
+}
+
+
+class DecodeError(ValueError):
+    def __init__(self, message: str, path: str = ''):
+        self.message = message
+        self.path = path
+        super().__init__(f'{path}: {message}' if path else message)
+
+    def with_parent(self, name: Any) -> 'DecodeError':
+        return DecodeError(self.message, f'{name}.{self.path}' if self.path else str(name))
+
+
+def compile_decoder(type_: Any, cast: Collection[type] = ()) -> Decoder:
+    """
+    Compile a strict decoder of JSON-like data into the given (dataclass) type.
+
+    Mirrors dacite.from_dict with Config(cast=cast, strict=True), but resolves all type hints upfront.
+    """
+    return _compile(type_, tuple(cast))
+
+
+def _is_cast(type_: Any, cast: tuple[type, ...]) -> bool:
+    return isinstance(type_, type) and issubclass(type_, cast)
+
+
+@cache
+def _compile(type_: Any, cast: tuple[type, ...]) -> Decoder:
+    if type_ is Any:
+        return lambda v: v
+
+    if type_ is NoneType or type_ is None:
+        return _compile_checked(NoneType)
+
+    origin = get_origin(type_)
+
+    if origin is Union or origin is UnionType:
+        return _compile_union(get_args(type_), cast)
+    if origin is not None:
+        if issubclass(origin, Mapping):
+            return _compile_mapping(*get_args(type_), cast)
+        if issubclass(origin, tuple):
+            return _compile_tuple(get_args(type_), cast)
+        if issubclass(origin, Sequence):
+            return _compile_sequence(origin, *get_args(type_), cast)
+        raise TypeError(f'Unsupported type: {type_!r}')
+
+    if is_dataclass(type_):
+        return _compile_dataclass(type_, cast)
+
+    if issubclass(type_, Enum):
+        return _compile_cast(type_) if _is_cast(type_, cast) else _compile_checked(type_)
+
+    if (checked := _CHECKED_TYPES.get(type_)) is not None:
+        return _compile_checked(checked)
+
+    if type_ is tuple and _is_cast(type_, cast):
+        return _compile_cast(tuple, (list, tuple))
+
+    if _is_cast(type_, cast):
+        return _compile_cast(type_)
+
+    return _compile_checked(type_)
+
+
+def _type_name(type_: type | tuple[type, ...]) -> str:
+    return type_[-1].__name__ if isinstance(type_, tuple) else type_.__name__
+
+
+def _compile_checked(type_: type | tuple[type, ...]) -> Decoder:
+    def decode(v):
+        if not isinstance(v, type_):
+            raise DecodeError(f'expected {_type_name(type_)}, got {type(v).__name__}')
+        return v
+
+    return decode
+
+
+def _compile_cast(type_: type, accepts: tuple[type, ...] | None = None) -> Decoder:
+    def decode(v):
+        if type(v) is type_:
+            return v
+        if accepts is not None and not isinstance(v, accepts):
+            raise DecodeError(f'expected {type_.__name__}, got {type(v).__name__}')
+        try:
+            return type_(v)
+        except (TypeError, ValueError) as e:
+            raise DecodeError(f'cannot cast {v!r} to {type_.__name__}') from e
+
+    return decode
+
+
+def _compile_union(args: tuple, cast: tuple[type, ...]) -> Decoder:
+    args = tuple(dict.fromkeys(args))  # ElementId | str is str | str
+
+    if len(args) == 1:
+        return _compile(args[0], cast)
+
+    if len(args) == 2 and NoneType in args:
+        inner = _compile(args[0] if args[1] is NoneType else args[1], cast)
+        return lambda v: None if v is None else inner(v)
+
+    decoders = tuple(_compile(arg, cast) for arg in args)
+
+    def decode(v):
+        for decoder in decoders:
+            try:
+                return decoder(v)
+            except DecodeError:
+                continue
+        raise DecodeError(f'value {v!r} does not match any of {args!r}')
+
+    return decode
+
+
+def _compile_mapping(key_type: Any, value_type: Any, cast: tuple[type, ...]) -> Decoder:
+    decode_key = _compile(key_type, cast)
+    decode_value = _compile(value_type, cast)
+
+    def decode(v):
+        if not isinstance(v, dict):
+            raise DecodeError(f'expected object, got {type(v).__name__}')
+
+        result = {}
+
+        for key, value in v.items():
+            try:
+                result[decode_key(key)] = decode_value(value)
+            except DecodeError as e:
+                raise e.with_parent(key) from None
+
+        return result
+
+    return decode
+
+
+def _compile_sequence(origin: type, item_type: Any, cast: tuple[type, ...]) -> Decoder:
+    accepts = (list, tuple) if _is_cast(origin, cast) else origin
+    return _compile_items(origin, accepts, _compile(item_type, cast))
+
+
+def _compile_tuple(args: tuple, cast: tuple[type, ...]) -> Decoder:
+    # json has no tuples, they are only decodable when casted
+    accepts = (list, tuple) if _is_cast(tuple, cast) else tuple
+
+    if len(args) == 2 and args[1] is Ellipsis:
+        return _compile_items(tuple, accepts, _compile(args[0], cast))
+
+    size = len(args)
+
+    # fast path for coordinate pairs and other plain records
+    if all(arg in _CHECKED_TYPES for arg in args):
+        checks = tuple(_CHECKED_TYPES[arg] for arg in args)
+
+        def decode_checked(v):
+            if not isinstance(v, accepts) or len(v) != size:
+                raise DecodeError(f'expected array of {size} items')
+            for i, (item, check) in enumerate(zip(v, checks)):
+                if not isinstance(item, check):
+                    raise DecodeError(f'expected {_type_name(check)}, got {type(item).__name__}', str(i))
+            return tuple(v)
+
+        return decode_checked
+
+    decoders = tuple(_compile(arg, cast) for arg in args)
+
+    def decode(v):
+        if not isinstance(v, accepts) or len(v) != size:
+            raise DecodeError(f'expected array of {size} items')
+        try:
+            return tuple([decoder(item) for decoder, item in zip(decoders, v)])
+        except DecodeError as e:
+            raise e.with_parent('[]') from None
+
+    return decode
+
+
+def _compile_items(origin: type, accepts: type | tuple[type, ...], decode_item: Decoder) -> Decoder:
+    def decode(v):
+        if not isinstance(v, accepts):
+            raise DecodeError(f'expected array, got {type(v).__name__}')
+        try:
+            items = [decode_item(item) for item in v]
+        except DecodeError as e:
+            raise e.with_parent('[]') from None
+        return items if origin is list else origin(items)
+
+    return decode
+
+
+def _compile_dataclass(type_: type, cast: tuple[type, ...]) -> Decoder:
+    hints = get_type_hints(type_)
+    init_fields = tuple(f for f in fields(type_) if f.init)
+    names = frozenset(f.name for f in init_fields)
+    required = frozenset(f.name for f in init_fields if f.default is MISSING and f.default_factory is MISSING)
+    decoders = tuple((f.name, _compile(hints[f.name], cast)) for f in init_fields)
+
+    def decode(v):
+        if not isinstance(v, dict):
+            raise DecodeError(f'expected {type_.__name__} object, got {type(v).__name__}')
+        if not (keys := v.keys()) <= names:
+            raise DecodeError(f'unexpected {type_.__name__} fields: {sorted(keys - names)}')
+        if not required <= keys:
+            raise DecodeError(f'missing {type_.__name__} fields: {sorted(required - keys)}')
+
+        kwargs = {}
+
+        for name, decoder in decoders:
+            if name in v:
+                try:
+                    kwargs[name] = decoder(v[name])
+                except DecodeError as e:
+                    raise e.with_parent(name) from None
+
+        return type_(**kwargs)
+
+    return decode
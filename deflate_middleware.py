@@ -1,9 +1,168 @@
-from collections.abc import Callable
+from base64 import b64encode
+from collections.abc import Callable, Iterable, Iterator
 
-from fastapi import Request, Response
+from fastapi import HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
 from fastapi.routing import APIRoute
+from starlette.concurrency import iterate_in_threadpool
 
-from compression import deflate_decompress
+from compression import (
+    CompressionDictionary,
+    CompressionLevels,
+    CompressObj,
+    DecompressedSizeError,
+    brotli_compress,
+    brotli_compressobj,
+    brotli_decompress,
+    dcz_compress,
+    dcz_header,
+    deflate_compress,
+    deflate_compressobj,
+    deflate_decompress,
+    zstd_compress,
+    zstd_compressobj,
+    zstd_decompress,
+)
+from config import COMPRESSION_DICTIONARY_PATH, COMPRESSION_MIN_SIZE, REQUEST_MAX_SIZE
+from offload import offload
+
+COMPRESSION_DICTIONARY = (
+    CompressionDictionary.load(COMPRESSION_DICTIONARY_PATH) if COMPRESSION_DICTIONARY_PATH is not None else None
+)
+
+# deflate is raw, as produced by the browsers' CompressionStream('deflate-raw')
+_REQUEST_DECODERS = {
+    'deflate': deflate_decompress,
+    'br': brotli_decompress,
+    'zstd': zstd_decompress,
+}
+
+# in order of preference
+_RESPONSE_ENCODINGS = ('dcz', 'zstd', 'br', 'deflate')
+
+
+def compression_levels(**levels: int) -> Callable:
+    """
+    Override response compression levels of an endpoint, e.g. @compression_levels(zstd=9).
+    """
+
+    def decorator(endpoint: Callable) -> Callable:
+        endpoint.compression_levels = CompressionLevels(**levels)
+        return endpoint
+
+    return decorator
+
+
+def _parse_accept_encoding(header: str) -> dict[str, float]:
+    result = {}
+
+    for part in header.split(','):
+        name, _, params = part.partition(';')
+        name = name.strip().lower()
+        quality = 1.0
+
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        if name:
+            result[name] = quality
+
+    return result
+
+
+def _negotiate_encoding(request: Request) -> str | None:
+    accepted = _parse_accept_encoding(request.headers.get('Accept-Encoding', ''))
+    wildcard = accepted.get('*', 0.0)
+    best, best_quality = None, 0.0
+
+    for encoding in _RESPONSE_ENCODINGS:
+        if encoding == 'dcz' and (
+            COMPRESSION_DICTIONARY is None
+            or request.headers.get('Available-Dictionary') != f':{b64encode(COMPRESSION_DICTIONARY.digest).decode()}:'
+        ):
+            continue
+
+        quality = accepted.get(encoding, wildcard if encoding != 'dcz' else 0.0)
+
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+
+    return best
+
+
+def _encode_body(body: bytes, encoding: str, levels: CompressionLevels) -> bytes:
+    if encoding == 'dcz':
+        return dcz_compress(body, COMPRESSION_DICTIONARY, levels.zstd)
+    if encoding == 'zstd':
+        return zstd_compress(body, levels.zstd)
+    if encoding == 'br':
+        return brotli_compress(body, levels.br)
+    # http deflate is the zlib format
+    return deflate_compress(body, levels.deflate, raw=False)
+
+
+def _encode_chunks(chunks: Iterable[bytes], encoding: str, levels: CompressionLevels) -> Iterator[bytes]:
+    compressor: CompressObj
+
+    if encoding == 'dcz':
+        yield dcz_header(COMPRESSION_DICTIONARY)
+        compressor = zstd_compressobj(levels.zstd, COMPRESSION_DICTIONARY)
+    elif encoding == 'zstd':
+        compressor = zstd_compressobj(levels.zstd)
+    elif encoding == 'br':
+        compressor = brotli_compressobj(levels.br)
+    else:
+        compressor = deflate_compressobj(levels.deflate, raw=False)
+
+    for chunk in chunks:
+        if data := compressor.compress(chunk):
+            yield data
+
+    yield compressor.flush()
+
+
+class ChunkedResponse(StreamingResponse):
+    """
+    Streaming response of uncompressed chunks, compressed on the fly by DeflateRoute.
+
+    Chunks are produced (and compressed) in a worker thread.
+    """
+
+    def __init__(self, chunks: Iterable[bytes], media_type: str = 'application/json'):
+        self.chunks = chunks
+        super().__init__(chunks, media_type=media_type)
+
+
+async def _encode_response(request: Request, response: Response, levels: CompressionLevels) -> Response:
+    if 'Content-Encoding' in response.headers:
+        return response
+
+    if isinstance(response, ChunkedResponse):
+        body = None
+    elif (body := getattr(response, 'body', None)) is None:
+        return response
+
+    response.headers.add_vary_header('Accept-Encoding')
+
+    if COMPRESSION_DICTIONARY is not None:
+        response.headers.add_vary_header('Available-Dictionary')
+
+    if (body is not None and len(body) < COMPRESSION_MIN_SIZE) or (encoding := _negotiate_encoding(request)) is None:
+        return response
+
+    if body is None:
+        response.body_iterator = iterate_in_threadpool(_encode_chunks(response.chunks, encoding, levels))
+    else:
+        response.body = await offload(_encode_body, body, encoding, levels, size=len(body))
+        response.headers['Content-Length'] = str(len(response.body))
+
+    response.headers['Content-Encoding'] = encoding
+    return response
 
 
 class DeflateRequest(Request):
@@ -11,8 +170,16 @@ class DeflateRequest(Request):
         if not hasattr(self, '_body'):
             body = await super().body()
 
-            if self.headers.get('Content-Encoding') == 'deflate':
-                body = deflate_decompress(body)
+            if (encoding := self.headers.get('Content-Encoding')) is not None:
+                decoder = _REQUEST_DECODERS.get(encoding)
+
+                if decoder is None:
+                    raise HTTPException(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, f'Unsupported encoding: {encoding}')
+
+                try:
+                    body = await offload(decoder, body, max_size=REQUEST_MAX_SIZE, size=len(body))
+                except DecompressedSizeError as e:
+                    raise HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, str(e)) from e
 
             self._body = body
 
@@ -22,9 +189,11 @@ class DeflateRequest(Request):
 class DeflateRoute(APIRoute):
     def get_route_handler(self) -> Callable:
         original_route_handler = super().get_route_handler()
+        levels: CompressionLevels = getattr(self.endpoint, 'compression_levels', CompressionLevels())
 
         async def custom_route_handler(request: Request) -> Response:
             request = DeflateRequest(request.scope, request.receive)
-            return await original_route_handler(request)
+            response = await original_route_handler(request)
+            return await _encode_response(request, response, levels)
 
         return custom_route_handler
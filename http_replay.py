@@ -0,0 +1,77 @@
+import hashlib
+from pathlib import Path
+
+import orjson
+from httpx import AsyncBaseTransport, AsyncHTTPTransport, ConnectError, Request, Response
+
+from compression import zstd_compress, zstd_decompress
+
+# headers describing the original encoding, the stored body is already decoded
+_SKIP_HEADERS = frozenset(('content-encoding', 'content-length', 'transfer-encoding', 'connection'))
+
+
+def _is_private(request: Request) -> bool:
+    # user sessions, and the oauth token exchange (client secret in the request, access token in the response)
+    return 'Authorization' in request.headers or request.url.path.endswith('/oauth2/token')
+
+
+def request_key(request: Request) -> str:
+    h = hashlib.sha256()
+    h.update(request.method.encode())
+    h.update(b'\0')
+    h.update(str(request.url).encode())
+    h.update(b'\0')
+    h.update(request.content)
+    return h.hexdigest()[:32]
+
+
+class ReplayTransport(AsyncBaseTransport):
+    """
+    Serve HTTP responses from a directory of recordings, as a stand-in for the Overpass and OSM APIs.
+
+    In record mode, requests are forwarded to the network and the responses are stored first.
+    Private requests always go to the network, their responses are neither served nor recorded.
+    """
+
+    def __init__(self, path: str | Path, *, record: bool = False, transport: AsyncBaseTransport | None = None):
+        self._path = Path(path)
+        self._record = record
+        self._transport = transport if transport is not None else AsyncHTTPTransport()
+
+        if record:
+            self._path.mkdir(parents=True, exist_ok=True)
+
+    async def handle_async_request(self, request: Request) -> Response:
+        # recordings are shared between users
+        if _is_private(request):
+            return await self._transport.handle_async_request(request)
+
+        await request.aread()
+        key = request_key(request)
+        meta_path = self._path / f'{key}.json'
+        body_path = self._path / f'{key}.zst'
+
+        if self._record:
+            response = await self._transport.handle_async_request(request)
+            content = await response.aread()
+            await response.aclose()
+            headers = [(k, v) for k, v in response.headers.multi_items() if k.lower() not in _SKIP_HEADERS]
+            meta = {
+                'method': request.method,
+                'url': str(request.url),
+                'status': response.status_code,
+                'headers': headers,
+            }
+            body_path.write_bytes(zstd_compress(content))
+            meta_path.write_bytes(orjson.dumps(meta, option=orjson.OPT_INDENT_2))
+        elif meta_path.is_file():
+            meta = orjson.loads(meta_path.read_bytes())
+            content = zstd_decompress(body_path.read_bytes())
+            headers = meta['headers']
+        else:
+            raise ConnectError(f'No recorded response for {request.method} {request.url}', request=request)
+
+        return Response(meta['status'], headers=headers, content=content, request=request)
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
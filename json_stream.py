@@ -0,0 +1,28 @@
+from collections.abc import Iterator
+from dataclasses import fields
+from itertools import batched
+
+import orjson
+
+
+def iter_dataclass_json(obj: object, field: str, *, chunk_size: int = 500, option: int = 0) -> Iterator[bytes]:
+    """
+    Serialize a dataclass like orjson.dumps, but emit the given large collection field
+    (dict or sequence) last and in chunks, so that the whole document is never held in memory.
+    """
+    rest = {f.name: getattr(obj, f.name) for f in fields(obj) if f.name != field}
+    value = getattr(obj, field)
+    is_dict = isinstance(value, dict)
+    head = orjson.dumps(rest, option=option)
+
+    yield head[:-1] + (b',' if rest else b'') + orjson.dumps(field) + (b':{' if is_dict else b':[')
+
+    first = True
+
+    for chunk in batched(value.items() if is_dict else value, chunk_size, strict=False):
+        # strip the brackets of each serialized chunk
+        data = orjson.dumps(dict(chunk) if is_dict else chunk, option=option)[1:-1]
+        yield data if first else b',' + data
+        first = False
+
+    yield b'}}' if is_dict else b']}'
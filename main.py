@@ -1,66 +1,130 @@
 import asyncio
 import os
+import time
 from concurrent.futures import ProcessPoolExecutor
 from contextlib import asynccontextmanager
-from dataclasses import dataclass, replace
+from dataclasses import replace
+from hmac import compare_digest
 from itertools import chain
 from typing import Annotated
 from urllib.parse import urlencode
 
 import orjson
-from dacite import Config, from_dict
-from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi import (
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
 from fastapi.responses import ORJSONResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from httpx import HTTPStatusError
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from sentry_sdk import start_transaction
 from starlette.websockets import WebSocketState
 
-from compression import deflate_compress, deflate_decompress
+from compression import deflate_compress_chunks, deflate_decompress
 from config import (
     CALC_ROUTE_MAX_PROCESSES,
     CALC_ROUTE_N_PROCESSES,
     CREATED_BY,
+    METRICS_TOKEN,
     OSM_CLIENT,
+    OSM_EXTRACT_PATH,
     OSM_SCOPES,
     OSM_SECRET,
+    PROFILE_MAX_COUNT,
+    REQUEST_MAX_SIZE,
+    ROUTE_RECORD_MAX_RECORDS,
+    ROUTE_RECORD_PATH,
+    ROUTE_RECORD_THRESHOLD,
     TEST_ENV,
     WEBSITE,
 )
-from cython_lib.route import calc_bus_route
-from deflate_middleware import DeflateRoute
+from cython_lib.route import SearchStats, calc_bus_route
+from dataclass_decoder import compile_decoder
+from deflate_middleware import COMPRESSION_DICTIONARY, ChunkedResponse, DeflateRoute, compression_levels
+from json_stream import iter_dataclass_json
+from metrics import METRICS_MEDIA_TYPE, Counter, Gauge, render, stage_time
 from models.download_history import Cell, DownloadHistory
 from models.element_id import ElementId
 from models.fetch_relation import (
     FetchRelation,
-    FetchRelationBusStopCollection,
     FetchRelationElement,
     PublicTransport,
     assign_none_members,
+    diff_ways,
     find_start_stop_ways,
 )
 from models.final_route import FinalRoute, WarningSeverity
+from models.post_calc_bus_route import PostCalcBusRouteModel
+from offload import EVENT_LOOP_LAG_STATS, OFFLOAD_STATS, monitor_event_loop_lag, offload
 from openstreetmap import OpenStreetMap
+from osm_extract import LocalOverpass
 from overpass import Overpass
+from packed_format import PACKED_MEDIA_TYPE, pack_fetch_relation, pack_final_route
+from profiler import ProfileTarget, arm, armed, profile_relation
 from relation_builder import build_osm_change, get_relation_members, sort_and_upgrade_members
+from route_recorder import RouteRecorder
+from route_scheduler import RouteScheduler
 from route_warnings import check_for_issues
-from user_session import fetch_user_details, require_user_access_token, require_user_details
-from utils import HTTP, print_run_time
+from user_session import fetch_user_details, require_admin_user, require_user_access_token, require_user_details
+from utils import HTTP
 
 _SESSION_MAX_AGE = 31536000  # 1 year
 _TEMPLATES = Jinja2Templates(directory='templates', auto_reload=TEST_ENV)
 
 _PROCESS_EXECUTOR = ProcessPoolExecutor(CALC_ROUTE_MAX_PROCESSES)
+_ROUTE_SCHEDULER = RouteScheduler()
 _OSM = OpenStreetMap()
-_OVERPASS = Overpass()
+_OVERPASS = LocalOverpass(OSM_EXTRACT_PATH) if OSM_EXTRACT_PATH else Overpass()
+_ROUTE_RECORDER = (
+    RouteRecorder(ROUTE_RECORD_PATH, ROUTE_RECORD_THRESHOLD, ROUTE_RECORD_MAX_RECORDS) if ROUTE_RECORD_PATH else None
+)
+
+Gauge('relatify_route_running', 'Route calculations holding a slot.', callback=lambda: _ROUTE_SCHEDULER.running)
+Gauge('relatify_route_queued', 'Route calculations waiting for a slot.', callback=lambda: _ROUTE_SCHEDULER.queued)
+# pool utilization is rate(relatify_route_search_worker_seconds_total) / relatify_route_pool_processes
+Gauge('relatify_route_pool_processes', 'Route search worker processes.', callback=lambda: CALC_ROUTE_MAX_PROCESSES)
+Counter(
+    'relatify_offload_inline_total', 'CPU-bound calls run on the event loop.', callback=lambda: OFFLOAD_STATS.inline
+)
+Counter(
+    'relatify_offload_offloaded_total',
+    'CPU-bound calls run in the thread pool.',
+    callback=lambda: OFFLOAD_STATS.offloaded,
+)
+Counter(
+    'relatify_event_loop_stalls_total',
+    'Event loop stalls above the warning threshold.',
+    callback=lambda: EVENT_LOOP_LAG_STATS.stalls,
+)
+Counter(
+    'relatify_event_loop_blocked_seconds_total',
+    'Time the event loop was blocked.',
+    callback=lambda: EVENT_LOOP_LAG_STATS.blocked_time,
+)
+
+_DECODE_DOWNLOAD_HISTORY = compile_decoder(DownloadHistory, cast=(tuple,))
+_DECODE_CELL = compile_decoder(Cell)
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
-    async with _OSM:
-        yield
+    lag_monitor_task = asyncio.create_task(monitor_event_loop_lag())
+    try:
+        await _ROUTE_SCHEDULER.calibrate(_PROCESS_EXECUTOR)
+        async with _OSM:
+            yield
+    finally:
+        lag_monitor_task.cancel()
 
 
 app = FastAPI(
@@ -77,11 +141,29 @@ app.mount('/static', StaticFiles(directory='static', html=True), name='static')
 @app.get('/')
 async def index(request: Request, user=Depends(fetch_user_details)):
     if user is not None:
-        return _TEMPLATES.TemplateResponse('authorized.jinja2', {'request': request, 'user': user})
+        return _TEMPLATES.TemplateResponse(
+            'authorized.jinja2',
+            {'request': request, 'user': user, 'compression_dictionary': COMPRESSION_DICTIONARY is not None},
+        )
     else:
         return _TEMPLATES.TemplateResponse('index.jinja2', {'request': request})
 
 
+@app.get('/compression_dictionary')
+async def get_compression_dictionary():
+    if COMPRESSION_DICTIONARY is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND)
+
+    return Response(
+        content=COMPRESSION_DICTIONARY.data,
+        media_type='application/octet-stream',
+        headers={
+            'Use-As-Dictionary': 'match="/query"',
+            'Cache-Control': 'public, max-age=86400',
+        },
+    )
+
+
 @app.post('/login')
 async def login(request: Request):
     state = os.urandom(32).hex()
@@ -149,89 +231,180 @@ class PostQueryModel(BaseModel):
     reload: bool = False
 
 
+class PostAdminProfileModel(BaseModel):
+    relationId: int
+    target: ProfileTarget
+    count: Annotated[int, Field(ge=0, le=PROFILE_MAX_COUNT)] = 1
+
+
+def accepts_packed(request: Request | WebSocket) -> bool:
+    return request.query_params.get('format') == 'packed' or PACKED_MEDIA_TYPE in request.headers.get('Accept', '')
+
+
 @app.post('/query')
-async def post_query(model: PostQueryModel, _=Depends(require_user_details)):
+@compression_levels(zstd=6, br=5)
+async def post_query(request: Request, model: PostQueryModel, _=Depends(require_user_details)):
     print(f'🔍 Querying relation ({model.relationId})')
 
-    if model.downloadHistory is not None:
-        assert model.downloadTargets is not None
-        download_hist = from_dict(DownloadHistory, model.downloadHistory, Config(cast=[tuple], strict=True))
-        download_targets = tuple(from_dict(Cell, t, Config(cast=[], strict=True)) for t in model.downloadTargets)
-
-        if model.reload:
-            download_hist = replace(
+    async with profile_relation('query', model.relationId):
+        if model.downloadHistory is not None:
+            assert model.downloadTargets is not None
+            download_hist = _DECODE_DOWNLOAD_HISTORY(model.downloadHistory)
+            download_targets = tuple(map(_DECODE_CELL, model.downloadTargets))
+
+            if model.reload:
+                download_hist = replace(
+                    download_hist,
+                    session=DownloadHistory.make_session(),
+                    history=(tuple(chain.from_iterable(download_hist.history)),),
+                )
+        else:
+            download_hist = None
+            download_targets = None
+
+        with stage_time('query_relation', 'Querying relation data'):
+            try:
+                # loads and reloads show the current version, the cache may be stale or from before an upload
+                relation = await _OSM.get_relation(model.relationId, fresh=True)
+            except HTTPStatusError as e:
+                if e.response.status_code == status.HTTP_404_NOT_FOUND:
+                    raise HTTPException(status.HTTP_404_NOT_FOUND, 'Relation not found') from e
+                raise
+
+            relation_tags = relation.get('tags', {})
+            route_type = get_route_type(relation_tags)
+            if route_type is None:
+                raise HTTPException(status.HTTP_400_BAD_REQUEST, 'Relation must be a PTv2 bus/tram/trolleybus route')
+
+            (
+                bounds,
                 download_hist,
-                session=DownloadHistory.make_session(),
-                history=(tuple(chain.from_iterable(download_hist.history)),),
+                download_triggers,
+                ways,
+                prev_ways,
+                id_map,
+                bus_stop_collections,
+            ) = await _OVERPASS.query_relation(
+                relation_id=model.relationId,
+                download_hist=download_hist,
+                download_targets=download_targets,
+                route_type=route_type,
+                max_age=0 if model.reload else None,
             )
-    else:
-        download_hist = None
-        download_targets = None
 
-    with print_run_time('Querying relation data'):
-        try:
-            relation = await _OSM.get_relation(model.relationId)
-        except HTTPStatusError as e:
-            if e.response.status_code == status.HTTP_404_NOT_FOUND:
-                raise HTTPException(status.HTTP_404_NOT_FOUND, 'Relation not found') from e
-            raise
+        with stage_time('find_start_stop_ways', 'Finding start/stop ways'):
+            start_way, stop_way = find_start_stop_ways(ways, id_map, relation)
 
-        relation_tags = relation.get('tags', {})
-        route_type = get_route_type(relation_tags)
-        if route_type is None:
-            raise HTTPException(status.HTTP_400_BAD_REQUEST, 'Relation must be a PTv2 bus/tram/trolleybus route')
+        with stage_time('assign_members', 'Assigning members for stops'):
+            bus_stop_collections = assign_none_members(bus_stop_collections, relation)
 
-        bounds, download_hist, download_triggers, ways, id_map, bus_stop_collections = await _OVERPASS.query_relation(
-            relation_id=model.relationId,
-            download_hist=download_hist,
-            download_targets=download_targets,
-            route_type=route_type,
+        # on merge, only send what the client doesn't have yet
+        if prev_ways is not None:
+            response_ways, removed_way_ids = diff_ways(prev_ways, ways)
+        else:
+            response_ways, removed_way_ids = ways, []
+
+        fetch_relation = FetchRelation(
+            fetchMerge=len(download_hist.history) > 1 or model.reload,
+            fetchDiff=prev_ways is not None,
+            nameOrRef=relation_tags.get('name', relation_tags.get('ref', '')).strip(),
+            bounds=bounds,
+            downloadHistory=download_hist,
+            downloadTriggers=download_triggers,
+            tags=relation['tags'],
+            startWay=start_way,
+            stopWay=stop_way,
+            ways=response_ways,
+            removedWays=removed_way_ids,
+            busStops=bus_stop_collections,
         )
 
-    with print_run_time('Finding start/stop ways'):
-        start_way, stop_way = find_start_stop_ways(ways, id_map, relation)
-
-    with print_run_time('Assigning members for stops'):
-        bus_stop_collections = assign_none_members(bus_stop_collections, relation)
-
-    return FetchRelation(
-        fetchMerge=len(download_hist.history) > 1 or model.reload,
-        nameOrRef=relation_tags.get('name', relation_tags.get('ref', '')).strip(),
-        bounds=bounds,
-        downloadHistory=download_hist,
-        downloadTriggers=download_triggers,
-        tags=relation['tags'],
-        startWay=start_way,
-        stopWay=stop_way,
-        ways=ways,
-        busStops=bus_stop_collections,
-    )
+        if accepts_packed(request):
+            return Response(content=await offload(pack_fetch_relation, fetch_relation), media_type=PACKED_MEDIA_TYPE)
 
+        return ChunkedResponse(iter_dataclass_json(fetch_relation, 'ways'))
 
-@dataclass(frozen=True, kw_only=True, slots=True)
-class PostCalcBusRouteModel:
-    relationId: int
-    startWay: ElementId
-    stopWay: ElementId
-    ways: dict[ElementId | str, FetchRelationElement]
-    busStops: list[FetchRelationBusStopCollection]
-    tags: dict[str, str]
+
+_DECODE_POST_CALC_BUS_ROUTE = compile_decoder(PostCalcBusRouteModel, cast=(ElementId, tuple, PublicTransport))
+_DECODE_FINAL_ROUTE = compile_decoder(FinalRoute, cast=(ElementId, tuple, PublicTransport, WarningSeverity))
+
+
+def _decode_calc_bus_route(request: bytes) -> PostCalcBusRouteModel:
+    return _DECODE_POST_CALC_BUS_ROUTE(orjson.loads(deflate_decompress(request, max_size=REQUEST_MAX_SIZE)))
+
+
+def _encode_final_route(final_route: FinalRoute, packed: bool) -> bytes:
+    if packed:
+        chunks = (pack_final_route(final_route),)
+    else:
+        chunks = iter_dataclass_json(final_route, 'ways', option=orjson.OPT_STRICT_INTEGER)
+
+    return deflate_compress_chunks(chunks)
+
+
+async def _scheduled_calc_bus_route(
+    ws: WebSocket,
+    user_id: int,
+    request: bytes,
+    model: PostCalcBusRouteModel,
+    ways_members: dict[ElementId, FetchRelationElement],
+) -> FinalRoute:
+    async def send_queue_position(position: int) -> None:
+        # text frames are status updates, binary frames are routes
+        await ws.send_text(orjson.dumps({'queuePosition': position}).decode())
+
+    async with (
+        _ROUTE_SCHEDULER.slot(user_id, len(ways_members), send_queue_position),
+        profile_relation('route', model.relationId),
+    ):
+        budget = _ROUTE_SCHEDULER.budget(len(ways_members))
+        stats = SearchStats()
+        start_time = time.perf_counter()
+        timed_out = False
+
+        try:
+            return await asyncio.wait_for(
+                calc_bus_route(
+                    ways_members,
+                    model.startWay,
+                    model.stopWay,
+                    model.busStops,
+                    model.tags,
+                    _PROCESS_EXECUTOR,
+                    n_processes=CALC_ROUTE_N_PROCESSES,
+                    budget=budget,
+                    stats=stats,
+                ),
+                timeout=budget.timeout,
+            )
+        except TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            if _ROUTE_RECORDER is not None:
+                await _ROUTE_RECORDER.maybe_record(
+                    request,
+                    model.relationId,
+                    budget=budget,
+                    iteration_rate=_ROUTE_SCHEDULER.iteration_rate,
+                    n_processes=CALC_ROUTE_N_PROCESSES,
+                    stats=stats,
+                    elapsed=time.perf_counter() - start_time,
+                    timed_out=timed_out,
+                )
 
 
 @app.websocket('/ws/calc_bus_route')
-async def post_calc_bus_route(ws: WebSocket, _=Depends(require_user_details)):
+async def post_calc_bus_route(ws: WebSocket, user=Depends(require_user_details)):
     await ws.accept()
+    packed = accepts_packed(ws)
 
     try:
         while True:
             request = await ws.receive_bytes()
 
             with start_transaction(op='websocket.server', name='/ws/calc_bus_route'):
-                model = from_dict(
-                    PostCalcBusRouteModel,
-                    orjson.loads(deflate_decompress(request)),
-                    Config(cast=[ElementId, tuple, PublicTransport], strict=True),
-                )
+                model = await offload(_decode_calc_bus_route, request, size=len(request))
 
                 print(f'🛣️ Calculating bus route ({model.relationId})')
                 assert model.startWay in model.ways, 'Start way not in ways'
@@ -250,26 +423,24 @@ async def post_calc_bus_route(ws: WebSocket, _=Depends(require_user_details)):
                     'All bus stops must be members of the relation'
                 )
 
+                error = None
                 try:
                     async with asyncio.TaskGroup() as tg:
                         get_task = tg.create_task(_OSM.get_relation(model.relationId))
                         route_task = tg.create_task(
-                            asyncio.wait_for(
-                                calc_bus_route(
-                                    ways_members,
-                                    model.startWay,
-                                    model.stopWay,
-                                    model.busStops,
-                                    model.tags,
-                                    _PROCESS_EXECUTOR,
-                                    n_processes=CALC_ROUTE_N_PROCESSES,
-                                ),
-                                timeout=3,
-                            )
+                            _scheduled_calc_bus_route(ws, user['id'], request, model, ways_members)
                         )
 
-                except TimeoutError as e:
-                    raise HTTPException(status.HTTP_408_REQUEST_TIMEOUT, 'Route calculation timed out') from e
+                except* TimeoutError:
+                    error = 'Route calculation timed out'
+                except* HTTPException as e:
+                    # the queue is full or the user has too many queued calculations
+                    error = e.exceptions[0].detail
+
+                if error is not None:
+                    # text frames are status updates, the connection stays usable
+                    await ws.send_text(orjson.dumps({'error': error}).decode())
+                    continue
 
                 relation = get_task.result()
                 relation_members = get_relation_members(relation)
@@ -278,16 +449,18 @@ async def post_calc_bus_route(ws: WebSocket, _=Depends(require_user_details)):
                 route = replace(route, extraWaysToUpdate=tuple(ways_non_members.values()))
                 route = sort_and_upgrade_members(route, relation_members)
 
-                final_route = check_for_issues(
-                    route=route,
-                    ways=ways_members,
-                    start_way=model.startWay,
-                    end_way=model.stopWay,
-                    bus_stop_collections=model.busStops,
-                    relation_members=relation_members,
-                )
-
-                response = deflate_compress(orjson.dumps(final_route, option=orjson.OPT_STRICT_INTEGER))
+                with stage_time('warnings'):
+                    final_route = check_for_issues(
+                        route=route,
+                        ways=ways_members,
+                        start_way=model.startWay,
+                        end_way=model.stopWay,
+                        bus_stop_collections=model.busStops,
+                        relation_members=relation_members,
+                    )
+
+                # the response covers the same ways as the request
+                response = await offload(_encode_final_route, final_route, packed, size=len(request))
                 await ws.send_bytes(response)
 
     except WebSocketDisconnect:
@@ -324,13 +497,9 @@ class PostDownloadOsmChangeModel(BaseModel):
 async def post_download_osm_change(model: PostDownloadOsmChangeModel, _=Depends(require_user_details)):
     print(f'💾 Downloading OSM change ({model.relationId})')
 
-    route = from_dict(
-        FinalRoute,
-        model.route,
-        Config(cast=[ElementId, tuple, PublicTransport, WarningSeverity], strict=True),
-    )
+    route = _DECODE_FINAL_ROUTE(model.route)
 
-    with print_run_time('Building OSM change'):
+    with stage_time('osm_change_build', 'Building OSM change'):
         osm_change = await build_osm_change(
             model.relationId,
             route,
@@ -346,37 +515,52 @@ async def post_download_osm_change(model: PostDownloadOsmChangeModel, _=Depends(
 async def post_upload_osm(model: PostDownloadOsmChangeModel, access_token: str = Depends(require_user_access_token)):
     print(f'🌐 Uploading OSM change ({model.relationId})')
 
-    route = from_dict(
-        FinalRoute,
-        model.route,
-        Config(cast=[ElementId, tuple, PublicTransport, WarningSeverity], strict=True),
-    )
+    route = _DECODE_FINAL_ROUTE(model.route)
 
-    with print_run_time('Building OSM change'):
+    with stage_time('osm_change_build', 'Building OSM change'):
         osm_change = await build_osm_change(
             model.relationId,
             route,
             include_changeset_id=True,
             overpass=_OVERPASS,
             osm=_OSM,
+            # the change must apply to the current versions, not the cached ones
+            fresh=True,
         )
 
     async with OpenStreetMap(access_token=access_token) as osm:
         osm_user = await osm.get_authorized_user()
         user_edits = osm_user['changesets']['count']
-        upload_result = await osm.upload_osm_change(
-            osm_change,
-            {
-                'changesets_count': user_edits + 1,
-                'comment': model.make_comment(),
-                'created_by': CREATED_BY,
-                'host': WEBSITE,
-            },
-        )
+
+        with stage_time('upload', 'Uploading OSM change'):
+            upload_result = await osm.upload_osm_change(
+                osm_change,
+                {
+                    'changesets_count': user_edits + 1,
+                    'comment': model.make_comment(),
+                    'created_by': CREATED_BY,
+                    'host': WEBSITE,
+                },
+            )
 
     if upload_result.ok:
         print(f'✅ Changeset upload success: #{upload_result.changeset_id}')
+        _OSM.invalidate('relations', (model.relationId,))
     else:
         print(f'🚩 Changeset upload failure: {upload_result}')
 
     return upload_result
+
+
+@app.post('/admin/profile')
+async def post_admin_profile(model: PostAdminProfileModel, _=Depends(require_admin_user)):
+    arm(model.target, model.relationId, model.count)
+    return {'armed': armed()}
+
+
+@app.get('/metrics')
+async def get_metrics(authorization: Annotated[str | None, Header()] = None):
+    if METRICS_TOKEN is not None and not compare_digest(authorization or '', f'Bearer {METRICS_TOKEN}'):
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED)
+
+    return Response(content=render(), media_type=METRICS_MEDIA_TYPE)
@@ -0,0 +1,162 @@
+import time
+from bisect import bisect_left
+from collections.abc import Callable, Iterator, Sequence
+from contextlib import contextmanager
+
+METRICS_MEDIA_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# seconds, from the quick request stages to the slowest route searches
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_REGISTRY: list['_Metric'] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values, strict=True)) + '}'
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        _REGISTRY.append(self)
+
+    def collect(self) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class _Value(_Metric):
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        *,
+        callback: Callable[[], float] | None = None,
+    ):
+        super().__init__(name, documentation, labels)
+        assert callback is None or not labels, 'Callback metrics must not have labels'
+        self._callback = callback
+        # unlabeled values are exported from the start
+        self._values: dict[tuple[str, ...], float] = {} if labels else {(): 0}
+
+    def inc(self, amount: float = 1, *labels: str) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self) -> Iterator[str]:
+        values = {(): self._callback()} if self._callback is not None else self._values
+        for labels, value in values.items():
+            yield f'{self.name}{_format_labels(self.labels, labels)} {value}'
+
+
+class Counter(_Value):
+    """
+    A monotonically increasing value, or a callback reading one maintained elsewhere.
+    """
+
+    kind = 'counter'
+
+
+class Gauge(_Value):
+    """
+    A value that can go up and down, or a callback reading the current one.
+    """
+
+    kind = 'gauge'
+
+    def dec(self, amount: float = 1, *labels: str) -> None:
+        self.inc(-amount, *labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        *,
+        buckets: Sequence[float] = STAGE_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self._buckets = tuple(buckets)
+        # per labels: non-cumulative bucket counts (the last one is +Inf) and the sum
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        if (entry := self._values.get(labels)) is None:
+            entry = self._values[labels] = ([0] * (len(self._buckets) + 1), [0.0])
+
+        counts, total = entry
+        counts[bisect_left(self._buckets, value)] += 1
+        total[0] += value
+
+    def collect(self) -> Iterator[str]:
+        for labels, (counts, total) in self._values.items():
+            label_names = (*self.labels, 'le')
+            cumulative = 0
+
+            for bucket, count in zip((*self._buckets, '+Inf'), counts, strict=True):
+                cumulative += count
+                yield f'{self.name}_bucket{_format_labels(label_names, (*labels, str(bucket)))} {cumulative}'
+
+            yield f'{self.name}_sum{_format_labels(self.labels, labels)} {total[0]}'
+            yield f'{self.name}_count{_format_labels(self.labels, labels)} {cumulative}'
+
+
+def render() -> str:
+    """
+    Render all metrics in the Prometheus text exposition format.
+    """
+    lines = []
+
+    for metric in _REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.collect())
+
+    lines.append('')
+    return '\n'.join(lines)
+
+
+STAGE_SECONDS = Histogram('relatify_stage_seconds', 'Duration of the request processing stages.', ('stage',))
+
+ROUTE_SEARCH_ITERATIONS = Counter('relatify_route_search_iterations_total', 'Route search states expanded.')
+ROUTE_SEARCH_PUSHES = Counter('relatify_route_search_pushes_total', 'Route search states added to the stack.')
+ROUTE_SEARCH_PRUNED = Counter('relatify_route_search_pruned_total', 'Route search states discarded by the limits.')
+ROUTE_SEARCH_BATCHES = Counter('relatify_route_search_batches_total', 'Route search batches of iterations.')
+ROUTE_SEARCH_PICKLED_BYTES = Counter(
+    'relatify_route_search_pickled_bytes_total', 'Route search state exchanged with the worker processes.'
+)
+ROUTE_SEARCH_WORKER_SECONDS = Counter(
+    'relatify_route_search_worker_seconds_total', 'Time the worker processes spent searching routes.'
+)
+ROUTE_SEARCH_WORKER_BATCHES = Gauge(
+    'relatify_route_search_worker_batches', 'Route search batches submitted to the worker processes.'
+)
+
+
+@contextmanager
+def stage_time(stage: str, message: str | None = None):
+    """
+    Record the duration of a stage, and print it along with message, if given.
+    """
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_time = time.perf_counter() - start_time
+        STAGE_SECONDS.observe(elapsed_time, stage)
+
+        if message is not None:
+            print(f'[⏱️] {message} took {elapsed_time:.3f}s')
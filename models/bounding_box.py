@@ -51,6 +51,6 @@ class BoundingBox:
         return BoundingBox(
             minlat=y * DOWNLOAD_RELATION_GRID_SIZE,
             minlon=x * DOWNLOAD_RELATION_GRID_SIZE,
-            maxlat=((y_max or y) + 1) * DOWNLOAD_RELATION_GRID_SIZE,
-            maxlon=((x_max or x) + 1) * DOWNLOAD_RELATION_GRID_SIZE,
+            maxlat=((y if y_max is None else y_max) + 1) * DOWNLOAD_RELATION_GRID_SIZE,
+            maxlon=((x if x_max is None else x_max) + 1) * DOWNLOAD_RELATION_GRID_SIZE,
         )
@@ -2,8 +2,11 @@ from collections import defaultdict
 from dataclasses import dataclass, replace
 from enum import Enum
 from itertools import pairwise
+from math import isfinite
 from typing import Self
 
+import numpy as np
+
 from cython_lib.geoutils import haversine_distance
 from models.bounding_box import BoundingBox
 from models.download_history import Cell, DownloadHistory
@@ -29,18 +32,59 @@ def _calculate_length_and_midpoint(latLngs: list[tuple[float, float]]) -> tuple[
     total_distance = sum(segment_distances)
     half_distance = total_distance / 2
     accumulated_distance = 0.0
+    midpoint = latLngs[0]  # zero-length ways
 
     for (latLng1, latLng2), segment_distance in zip(pairwise(latLngs), segment_distances, strict=True):
         accumulated_distance += segment_distance
 
         if accumulated_distance >= half_distance:
-            segment_ratio = 1 - (accumulated_distance - half_distance) / segment_distance
+            # same as the vectorized version, zero-length segments end at their second node
+            segment_ratio = 1 - (accumulated_distance - half_distance) / segment_distance if segment_distance else 1
             midpoint = _interpolate_coords(latLng1, latLng2, segment_ratio)
             break
 
     return total_distance, midpoint
 
 
+def _haversine_distances(latLngs1: np.ndarray, latLngs2: np.ndarray) -> np.ndarray:
+    lat1, lon1 = np.radians(latLngs1).T
+    lat2, lon2 = np.radians(latLngs2).T
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return c * 6_371_000  # earth radius
+
+
+def calculate_ways_length_and_midpoint(
+    latLngs: np.ndarray,
+    lengths: np.ndarray,
+) -> tuple[list[float], list[tuple[float, float]]]:
+    # vectorized _calculate_length_and_midpoint over ways stored back-to-back in latLngs
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+
+    segment_distances = _haversine_distances(latLngs[:-1], latLngs[1:])
+    segment_distances[ends[:-1] - 1] = 0  # segments joining consecutive ways
+    accumulated = np.concatenate(((0.0,), np.cumsum(segment_distances)))
+
+    total_distances = accumulated[ends - 1] - accumulated[starts]
+    half_accumulated = accumulated[starts] + total_distances / 2
+
+    # index of the first node reaching half distance, the midpoint lies on the segment ending there
+    i2 = np.clip(np.searchsorted(accumulated, half_accumulated), starts + 1, ends - 1)
+    i1 = i2 - 1
+    segment_distance = accumulated[i2] - accumulated[i1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        segment_ratio = np.where(
+            segment_distance > 0,
+            1 - (accumulated[i2] - half_accumulated) / segment_distance,
+            1,
+        )
+
+    midpoints = latLngs[i1] + (latLngs[i2] - latLngs[i1]) * segment_ratio[:, None]
+    return total_distances.tolist(), list(zip(midpoints[:, 0].tolist(), midpoints[:, 1].tolist(), strict=True))
+
+
 @dataclass(kw_only=True, slots=True)
 class FetchRelationElement:  # more like FetchRelationWay
     id: ElementId
@@ -53,7 +97,7 @@ class FetchRelationElement:  # more like FetchRelationWay
     turn_in_place_start: bool
     turn_in_place_end: bool
 
-    # automatically calculated
+    # calculated in batch by query_relation, otherwise automatically
     length: float = None
     midpoint: tuple[float, float] = None
 
@@ -61,6 +105,10 @@ class FetchRelationElement:  # more like FetchRelationWay
         if self.length is None or self.midpoint is None:
             self.length, self.midpoint = _calculate_length_and_midpoint(self.latLngs)
 
+        # trust client-provided geometry, but keep the route search sane
+        elif not (isfinite(self.length) and self.length >= 0 and len(self.midpoint) == 2):
+            raise ValueError(f'Invalid geometry for way {self.id}')
+
 
 class PublicTransport(str, Enum):
     PLATFORM = 'platform'
@@ -129,6 +177,7 @@ class FetchRelationBusStopCollection:
 @dataclass(frozen=True, kw_only=True, slots=True)
 class FetchRelation:
     fetchMerge: bool
+    fetchDiff: bool  # ways only contain new/changed ways
     nameOrRef: str
     bounds: BoundingBox
     downloadHistory: DownloadHistory
@@ -137,9 +186,24 @@ class FetchRelation:
     startWay: FetchRelationElement
     stopWay: FetchRelationElement
     ways: dict[ElementId, FetchRelationElement]
+    removedWays: list[ElementId]
     busStops: list[FetchRelationBusStopCollection]
 
 
+def diff_ways(
+    prev_ways: dict[ElementId, FetchRelationElement],
+    ways: dict[ElementId, FetchRelationElement],
+) -> tuple[dict[ElementId, FetchRelationElement], list[ElementId]]:
+    # membership is managed by the client during merges
+    changed_ways = {
+        way_id: way
+        for way_id, way in ways.items()
+        if (prev_way := prev_ways.get(way_id)) is None or replace(prev_way, member=way.member) != way
+    }
+    removed_way_ids = [way_id for way_id in prev_ways if way_id not in ways]
+    return changed_ways, removed_way_ids
+
+
 def find_start_stop_ways(
     ways: dict[ElementId, FetchRelationElement],
     id_map: dict[int, list[ElementId]],
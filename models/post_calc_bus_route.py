@@ -0,0 +1,14 @@
+from dataclasses import dataclass
+
+from models.element_id import ElementId
+from models.fetch_relation import FetchRelationBusStopCollection, FetchRelationElement
+
+
+@dataclass(frozen=True, kw_only=True, slots=True)
+class PostCalcBusRouteModel:
+    relationId: int
+    startWay: ElementId
+    stopWay: ElementId
+    ways: dict[ElementId | str, FetchRelationElement]
+    busStops: list[FetchRelationBusStopCollection]
+    tags: dict[str, str]
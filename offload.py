@@ -0,0 +1,63 @@
+import asyncio
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+
+from config import EVENT_LOOP_LAG_INTERVAL, EVENT_LOOP_LAG_WARN, OFFLOAD_MAX_THREADS, OFFLOAD_MIN_SIZE
+from profiler import current_profile
+
+# compression and json release the gil (or hold it briefly enough) for the event loop to keep running
+_EXECUTOR = ThreadPoolExecutor(OFFLOAD_MAX_THREADS, thread_name_prefix='offload')
+
+
+@dataclass(kw_only=True, slots=True)
+class OffloadStats:
+    inline: int = 0
+    offloaded: int = 0
+
+
+@dataclass(kw_only=True, slots=True)
+class EventLoopLagStats:
+    samples: int = 0
+    stalls: int = 0
+    blocked_time: float = 0  # seconds
+    max_lag: float = 0  # seconds
+
+
+OFFLOAD_STATS = OffloadStats()
+EVENT_LOOP_LAG_STATS = EventLoopLagStats()
+
+
+async def offload[T](func: Callable[..., T], /, *args, size: int | None = None, **kwargs) -> T:
+    """
+    Run CPU-bound func in the thread pool, unless the payload size is below OFFLOAD_MIN_SIZE.
+
+    Without a size, func is always offloaded.
+    """
+    if size is not None and size < OFFLOAD_MIN_SIZE:
+        OFFLOAD_STATS.inline += 1
+        return func(*args, **kwargs)
+
+    OFFLOAD_STATS.offloaded += 1
+    if (profile := current_profile()) is not None:
+        func = partial(profile.trace_thread, func)
+    return await asyncio.get_running_loop().run_in_executor(_EXECUTOR, partial(func, *args, **kwargs))
+
+
+async def monitor_event_loop_lag() -> None:
+    loop = asyncio.get_running_loop()
+
+    while True:
+        start = loop.time()
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        lag = max(0, loop.time() - start - EVENT_LOOP_LAG_INTERVAL)
+
+        stats = EVENT_LOOP_LAG_STATS
+        stats.samples += 1
+        stats.blocked_time += lag
+        stats.max_lag = max(stats.max_lag, lag)
+
+        if lag >= EVENT_LOOP_LAG_WARN:
+            stats.stalls += 1
+            print(f'🐢 Event loop was blocked for {lag:.3f}s')
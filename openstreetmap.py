@@ -1,13 +1,34 @@
-from collections.abc import Iterable
+import asyncio
+import time
+from collections.abc import Iterable, Sequence
+from copy import deepcopy
 from dataclasses import dataclass
+from itertools import batched
 from typing import Literal
 
+import orjson
 import xmltodict
-from asyncache import cached
 from cachetools import TTLCache
 
-from config import CHANGESET_ID_PLACEHOLDER, TAG_MAX_LENGTH
-from utils import ensure_list, get_http_client
+from config import (
+    CHANGESET_ID_PLACEHOLDER,
+    OSM_ELEMENT_CACHE_TTL,
+    OSM_ELEMENTS_CHUNK_SIZE,
+    OSM_MAX_CONCURRENT_REQUESTS,
+    OSM_RELATION_FRESH_TTL,
+    OSM_RELATION_STALE_TTL,
+    TAG_MAX_LENGTH,
+)
+from offload import offload
+from osm_xml import OsmRelation, OsmWay, parse_osm_xml
+from utils import get_http_client
+
+ElementsType = Literal['nodes', 'ways', 'relations']
+# the json and xml representations are cached separately
+_ElementsKind = tuple[ElementsType, bool]
+_Element = dict | OsmWay | OsmRelation
+
+_CACHE_TTL = max(OSM_ELEMENT_CACHE_TTL, OSM_RELATION_STALE_TTL)
 
 
 @dataclass(frozen=True, kw_only=True, slots=True)
@@ -24,6 +45,13 @@ class OpenStreetMap:
             'https://api.openstreetmap.org/api',
             headers={'Authorization': f'Bearer {access_token}'} if access_token else None,
         )
+        self._semaphore = asyncio.Semaphore(OSM_MAX_CONCURRENT_REQUESTS)
+        self._in_flight: dict[tuple[_ElementsKind, int], asyncio.Future[_Element]] = {}
+        self._fetches: set[asyncio.Task] = set()
+        self._revalidations: set[asyncio.Task] = set()
+        # the latest version and when it was fetched, a response that arrives late never replaces a newer version
+        self._versions: TTLCache[tuple[_ElementsKind, int], tuple[int, float]] = TTLCache(maxsize=16384, ttl=_CACHE_TTL)
+        self._elements: TTLCache[tuple[_ElementsKind, int, int], _Element] = TTLCache(maxsize=16384, ttl=_CACHE_TTL)
 
     async def __aenter__(self) -> 'OpenStreetMap':
         await self._http.__aenter__()
@@ -38,40 +66,195 @@ class OpenStreetMap:
         caps = xmltodict.parse(r.text)
         return int(caps['osm']['api']['changesets']['@maximum_elements'])
 
-    async def get_relation(self, relation_id: str | int, *, json: bool = True) -> dict:
-        return (await self._get_elements('relations', (relation_id,), json=json))[0]
+    async def get_relation(self, relation_id: str | int, *, fresh: bool = False) -> dict:
+        return await self._get_relation(relation_id, json=True, fresh=fresh)
+
+    async def get_relation_xml(self, relation_id: str | int, *, fresh: bool = False) -> OsmRelation:
+        return await self._get_relation(relation_id, json=False, fresh=fresh)
+
+    async def get_way(self, way_id: str | int, *, fresh: bool = False) -> dict:
+        return (await self._get_elements('ways', (way_id,), json=True, fresh=fresh))[0]
+
+    async def get_node(self, node_id: str | int, *, fresh: bool = False) -> dict:
+        return (await self._get_elements('nodes', (node_id,), json=True, fresh=fresh))[0]
+
+    async def get_relations(self, relation_ids: Iterable[str | int], *, fresh: bool = False) -> list[dict]:
+        return await self._get_elements('relations', relation_ids, json=True, fresh=fresh)
+
+    async def get_relations_xml(self, relation_ids: Iterable[str | int], *, fresh: bool = False) -> list[OsmRelation]:
+        return await self._get_elements('relations', relation_ids, json=False, fresh=fresh)
+
+    async def get_ways(self, way_ids: Iterable[str | int], *, fresh: bool = False) -> list[dict]:
+        return await self._get_elements('ways', way_ids, json=True, fresh=fresh)
+
+    async def get_ways_xml(self, way_ids: Iterable[str | int], *, fresh: bool = False) -> list[OsmWay]:
+        return await self._get_elements('ways', way_ids, json=False, fresh=fresh)
+
+    async def get_nodes(self, node_ids: Iterable[str | int], *, fresh: bool = False) -> list[dict]:
+        return await self._get_elements('nodes', node_ids, json=True, fresh=fresh)
 
-    async def get_way(self, way_id: str | int, *, json: bool = True) -> dict:
-        return (await self._get_elements('ways', (way_id,), json=json))[0]
+    async def _get_relation(self, relation_id: str | int, *, json: bool, fresh: bool) -> _Element:
+        """
+        Get the relation, from the cache if fetched in the last OSM_RELATION_FRESH_TTL seconds.
 
-    async def get_node(self, node_id: str | int, *, json: bool = True) -> dict:
-        return (await self._get_elements('nodes', (node_id,), json=json))[0]
+        An older cached relation is still returned, while a newer version is fetched in the background.
+        With fresh, the current version is always fetched.
 
-    async def get_relations(self, relation_ids: Iterable[str | int], *, json: bool = True) -> list[dict]:
-        return await self._get_elements('relations', relation_ids, json=json)
+        The cache is per process, other workers keep their versions until revalidated,
+        so only interactive reads should accept stale relations.
+        """
+        if not fresh:
+            kind: _ElementsKind = ('relations', json)
+            cached = self._cache_get(kind, int(relation_id))
 
-    async def get_ways(self, way_ids: Iterable[str | int], *, json: bool = True) -> list[dict]:
-        return await self._get_elements('ways', way_ids, json=json)
+            if cached is not None and cached[1] <= OSM_RELATION_STALE_TTL:
+                element, age = cached
+                if age > OSM_RELATION_FRESH_TTL:
+                    self._revalidate(kind, int(relation_id))
+                return deepcopy(element) if json else element
 
-    async def get_nodes(self, node_ids: Iterable[str | int], *, json: bool = True) -> list[dict]:
-        return await self._get_elements('nodes', node_ids, json=json)
+        return (await self._get_elements('relations', (relation_id,), json=json, fresh=fresh))[0]
+
+    def invalidate(self, elements_type: ElementsType, element_ids: Iterable[str | int]) -> None:
+        """
+        Forget the cached elements, e.g. after uploading their new versions.
+
+        Only the cache of this process is cleared.
+        """
+        for element_id in map(int, element_ids):
+            for json in (True, False):
+                self._versions.pop(((elements_type, json), element_id), None)
+
+    def _cache_get(self, kind: _ElementsKind, element_id: int) -> tuple[_Element, float] | None:
+        # the element and its age in seconds
+        if (entry := self._versions.get((kind, element_id))) is None:
+            return None
+
+        version, fetched_at = entry
+        if (element := self._elements.get((kind, element_id, version))) is None:
+            return None
+
+        return element, time.monotonic() - fetched_at
+
+    def _revalidate(self, kind: _ElementsKind, element_id: int) -> None:
+        if (kind, element_id) in self._in_flight:
+            return
+
+        elements_type, json = kind
+        task = asyncio.create_task(self._get_elements(elements_type, (element_id,), json=json, fresh=True))
+        self._revalidations.add(task)
+        task.add_done_callback(self._revalidation_done)
+
+    def _revalidation_done(self, task: asyncio.Task) -> None:
+        self._revalidations.discard(task)
+        if not task.cancelled() and (e := task.exception()) is not None:
+            print(f'🚧 Warning: Failed to revalidate a cached element: {e!r}')
 
-    @cached(TTLCache(maxsize=1024, ttl=60))
     async def _get_elements(
         self,
-        elements_type: Literal['nodes', 'ways', 'relations'],
+        elements_type: ElementsType,
         element_ids: Iterable[str | int],
         json: bool,
-    ) -> list[dict]:
-        r = await self._http.get(
-            f'/0.6/{elements_type}{".json" if json else ""}',
-            params={elements_type: ','.join(map(str, element_ids))},
-        )
-        r.raise_for_status()
-        if json:
-            return r.json()['elements']
-        else:
-            return ensure_list(xmltodict.parse(r.text)['osm'][elements_type[:-1]])
+        fresh: bool = False,
+    ) -> list:
+        """
+        Get the elements in the given order, from the cache, the requests in flight, or the API in chunks.
+
+        The API is fetched in a background task, so cancelling one caller never affects the others.
+        The json results are copies, safe to modify, the xml results are immutable.
+        """
+        kind: _ElementsKind = (elements_type, json)
+        ids = tuple(dict.fromkeys(map(int, element_ids)))
+        result: dict[int, _Element] = {}
+        waiting: dict[int, asyncio.Future[_Element]] = {}
+        missing: list[int] = []
+
+        for element_id in ids:
+            if (
+                not fresh
+                and (cached := self._cache_get(kind, element_id)) is not None
+                and (cached[1] <= OSM_ELEMENT_CACHE_TTL)
+            ):
+                result[element_id] = cached[0]
+            elif (future := self._in_flight.get((kind, element_id))) is not None:
+                waiting[element_id] = future
+            else:
+                missing.append(element_id)
+
+        if missing:
+            loop = asyncio.get_running_loop()
+            futures = {element_id: loop.create_future() for element_id in missing}
+            self._in_flight.update(((kind, element_id), future) for element_id, future in futures.items())
+            waiting.update(futures)
+
+            task = asyncio.create_task(self._fetch_elements(kind, futures))
+            self._fetches.add(task)
+            task.add_done_callback(self._fetches.discard)
+
+        for element_id, future in waiting.items():
+            result[element_id] = await asyncio.shield(future)
+
+        if not json:
+            return [result[element_id] for element_id in ids]
+        return [deepcopy(result[element_id]) for element_id in ids]
+
+    async def _fetch_elements(self, kind: _ElementsKind, futures: dict[int, asyncio.Future[_Element]]) -> None:
+        # settles every future, with the element or the error of its chunk
+        try:
+            await asyncio.gather(
+                *(
+                    self._fetch_elements_chunk(kind, chunk, futures)
+                    for chunk in batched(futures, OSM_ELEMENTS_CHUNK_SIZE, strict=False)
+                )
+            )
+        finally:
+            for element_id, future in futures.items():
+                del self._in_flight[kind, element_id]
+                if not future.done():
+                    future.cancel()
+                elif not future.cancelled():
+                    future.exception()  # mark as retrieved, all callers may be gone
+
+    async def _fetch_elements_chunk(
+        self,
+        kind: _ElementsKind,
+        element_ids: Sequence[int],
+        futures: dict[int, asyncio.Future[_Element]],
+    ) -> None:
+        elements_type, json = kind
+
+        try:
+            async with self._semaphore:
+                r = await self._http.get(
+                    f'/0.6/{elements_type}{".json" if json else ""}',
+                    params={elements_type: ','.join(map(str, element_ids))},
+                )
+            r.raise_for_status()
+
+            if json:
+                elements = (await offload(orjson.loads, r.content, size=len(r.content)))['elements']
+            else:
+                parsed = await offload(parse_osm_xml, r.content, size=len(r.content))
+                elements = parsed.relations if elements_type == 'relations' else parsed.ways
+
+            for element in elements:
+                element_id = element['id'] if json else element.id
+                version = element['version'] if json else element.version
+
+                if version >= self._versions.get((kind, element_id), (version,))[0]:
+                    self._versions[kind, element_id] = (version, time.monotonic())
+                    self._elements[kind, element_id, version] = element
+
+                futures[element_id].set_result(element)
+
+            for element_id in element_ids:
+                if not futures[element_id].done():
+                    futures[element_id].set_exception(KeyError(f'{elements_type[:-1]} {element_id} not returned'))
+
+        except Exception as e:
+            for element_id in element_ids:
+                if not futures[element_id].done():
+                    futures[element_id].set_exception(e)
 
     async def get_authorized_user(self) -> dict:
         r = await self._http.get('/0.6/user/details.json')
@@ -0,0 +1,746 @@
+import argparse
+import asyncio
+import sqlite3
+from collections.abc import Collection, Iterable, Sequence
+from contextlib import closing
+from dataclasses import asdict
+from itertools import chain, pairwise
+from pathlib import Path
+from typing import NamedTuple
+
+import orjson
+
+from config import OSM_EXTRACT_PATH
+from models.bounding_box import BoundingBox
+from models.download_history import Cell
+from osm_xml import OsmMember, OsmRelation, OsmWay
+from overpass import Overpass, optimize_cells_and_get_bbs
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS node (
+    id INTEGER PRIMARY KEY,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    tags TEXT
+);
+CREATE TABLE IF NOT EXISTS way (
+    id INTEGER PRIMARY KEY,
+    nodes TEXT NOT NULL,
+    tags TEXT,
+    minlat REAL,
+    maxlat REAL,
+    minlon REAL,
+    maxlon REAL
+);
+CREATE TABLE IF NOT EXISTS way_node (
+    node_id INTEGER NOT NULL,
+    way_id INTEGER NOT NULL,
+    PRIMARY KEY (node_id, way_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS relation (
+    id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    changeset INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    user TEXT NOT NULL,
+    members TEXT NOT NULL,
+    tags TEXT,
+    minlat REAL,
+    maxlat REAL,
+    minlon REAL,
+    maxlon REAL
+);
+CREATE TABLE IF NOT EXISTS relation_member (
+    type TEXT NOT NULL,
+    ref INTEGER NOT NULL,
+    relation_id INTEGER NOT NULL,
+    PRIMARY KEY (type, ref, relation_id)
+) WITHOUT ROWID;
+CREATE VIRTUAL TABLE IF NOT EXISTS node_bb USING rtree(id, minlat, maxlat, minlon, maxlon);
+CREATE VIRTUAL TABLE IF NOT EXISTS way_bb USING rtree(id, minlat, maxlat, minlon, maxlon);
+CREATE VIRTUAL TABLE IF NOT EXISTS relation_bb USING rtree(id, minlat, maxlat, minlon, maxlon);
+"""
+
+_WAYS_BOUNDS_SQL = """
+UPDATE way SET (minlat, maxlat, minlon, maxlon) = (
+    SELECT min(n.lat), max(n.lat), min(n.lon), max(n.lon)
+    FROM json_each(way.nodes) j JOIN node n ON n.id = j.value
+)
+WHERE {where};
+DELETE FROM way_bb WHERE {where};
+INSERT INTO way_bb SELECT id, minlat, maxlat, minlon, maxlon FROM way WHERE minlat IS NOT NULL AND {where};
+"""
+
+_RELATIONS_BOUNDS_SQL = """
+UPDATE relation SET (minlat, maxlat, minlon, maxlon) = (
+    SELECT min(minlat), max(maxlat), min(minlon), max(maxlon) FROM (
+        SELECT n.lat AS minlat, n.lat AS maxlat, n.lon AS minlon, n.lon AS maxlon
+        FROM json_each(relation.members) j JOIN node n ON j.value ->> 0 = 'node' AND n.id = j.value ->> 1
+        UNION ALL
+        SELECT w.minlat, w.maxlat, w.minlon, w.maxlon
+        FROM json_each(relation.members) j JOIN way w ON j.value ->> 0 = 'way' AND w.id = j.value ->> 1
+        UNION ALL
+        SELECT r.minlat, r.maxlat, r.minlon, r.maxlon
+        FROM json_each(relation.members) j JOIN relation r ON j.value ->> 0 = 'relation' AND r.id = j.value ->> 1
+    )
+)
+WHERE {where};
+"""
+
+_RELATIONS_BB_SQL = """
+DELETE FROM relation_bb WHERE {where};
+INSERT INTO relation_bb SELECT id, minlat, maxlat, minlon, maxlon FROM relation WHERE minlat IS NOT NULL AND {where};
+"""
+
+# super-relations (e.g. route masters) take the bounds of their member relations, one nesting level per pass
+_SUPER_RELATIONS_WHERE = "id IN (SELECT relation_id FROM relation_member WHERE type = 'relation')"
+_RELATION_NESTING_DEPTH = 4
+
+_BB_WHERE = 'b.maxlat >= :minlat AND b.minlat <= :maxlat AND b.maxlon >= :minlon AND b.minlon <= :maxlon'
+
+_MEMBER_TYPES = {'n': 'node', 'w': 'way', 'r': 'relation'}
+
+# tag conditions, True: key must exist, False: key must not exist, str: key must have this value
+TagFilter = tuple[tuple[str, str | bool], ...]
+
+
+class _RouteTypeFilters(NamedTuple):
+    ways: TagFilter
+    features: tuple[tuple[str, TagFilter], ...]  # element types ('n', 'nw', 'nwr'...), tags
+
+
+# keep in sync with overpass.build_query
+_ROUTE_TYPE_FILTERS = {
+    'bus': _RouteTypeFilters(
+        ways=(('highway', True), ('footway', False)),
+        features=(
+            ('n', (('highway', 'bus_stop'), ('public_transport', 'platform'), ('name', True))),
+            ('nwr', (('highway', 'platform'), ('public_transport', 'platform'), ('name', True))),
+            ('nwr', (('highway', 'platform'), ('public_transport', 'platform'), ('ref', True))),
+            ('n', (('public_transport', 'stop_position'), ('name', True))),
+        ),
+    ),
+    'tram': _RouteTypeFilters(
+        ways=(('railway', 'tram'),),
+        features=(
+            ('n', (('railway', 'tram_stop'), ('public_transport', 'stop_position'), ('name', True))),
+            ('nwr', (('railway', 'platform'), ('public_transport', 'platform'), ('name', True))),
+            ('nwr', (('railway', 'platform'), ('public_transport', 'platform'), ('ref', True))),
+            ('nwr', (('tram', True), ('public_transport', 'platform'), ('name', True))),
+        ),
+    ),
+}
+
+
+def _match_tags(tags: dict[str, str], tag_filter: TagFilter) -> bool:
+    for key, value in tag_filter:
+        if value is True:
+            if key not in tags:
+                return False
+        elif value is False:
+            if key in tags:
+                return False
+        elif tags.get(key) != value:
+            return False
+    return True
+
+
+def _segment_intersects_bb(p1: tuple[float, float], p2: tuple[float, float], bb: BoundingBox) -> bool:
+    # Liang-Barsky clipping
+    t0, t1 = 0.0, 1.0
+    dlat = p2[0] - p1[0]
+    dlon = p2[1] - p1[1]
+
+    for p, q in (
+        (-dlat, p1[0] - bb.minlat),
+        (dlat, bb.maxlat - p1[0]),
+        (-dlon, p1[1] - bb.minlon),
+        (dlon, bb.maxlon - p1[1]),
+    ):
+        if p == 0:
+            if q < 0:
+                return False
+        elif p < 0:
+            t0 = max(t0, q / p)
+        else:
+            t1 = min(t1, q / p)
+
+        if t0 > t1:
+            return False
+
+    return True
+
+
+def _line_intersects_bb(latLngs: Sequence[tuple[float, float]], bb: BoundingBox) -> bool:
+    if any(bb.minlat <= lat <= bb.maxlat and bb.minlon <= lon <= bb.maxlon for lat, lon in latLngs):
+        return True
+    return any(_segment_intersects_bb(p1, p2, bb) for p1, p2 in pairwise(latLngs))
+
+
+def _center(minlat: float, maxlat: float, minlon: float, maxlon: float) -> dict[str, float]:
+    return {'lat': (minlat + maxlat) / 2, 'lon': (minlon + maxlon) / 2}
+
+
+def _tags_json(tags) -> str | None:
+    return orjson.dumps({t.k: t.v for t in tags}).decode() if len(tags) else None
+
+
+def _tags_dict(tags: str | None) -> dict[str, str]:
+    return orjson.loads(tags) if tags is not None else {}
+
+
+def _json_ids(ids: Iterable[int]) -> str:
+    return orjson.dumps(list(ids)).decode()
+
+
+# local, spatially indexed OSM extract, see the command line interface below
+class OsmExtract:
+    def __init__(self, path: str):
+        self._path = Path(path)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(f'{self._path.absolute().as_uri()}?mode=ro', uri=True)
+
+    def _node_coords(self, conn: sqlite3.Connection, node_ids: Iterable[int]) -> dict[int, tuple[float, float]]:
+        rows = conn.execute(
+            'SELECT id, lat, lon FROM node WHERE id IN (SELECT value FROM json_each(?))', (_json_ids(node_ids),)
+        )
+        return {node_id: (lat, lon) for node_id, lat, lon in rows}
+
+    def _find_nodes(
+        self,
+        conn: sqlite3.Connection,
+        bbs: Iterable[BoundingBox],
+        tag_filter: TagFilter,
+    ) -> dict[int, dict]:
+        result = {}
+
+        for bb in bbs:
+            for node_id, lat, lon, tags in conn.execute(
+                f'SELECT n.id, n.lat, n.lon, n.tags FROM node_bb b JOIN node n ON n.id = b.id WHERE {_BB_WHERE} '  # noqa: S608
+                'AND n.lat BETWEEN :minlat AND :maxlat AND n.lon BETWEEN :minlon AND :maxlon',
+                asdict(bb),
+            ):
+                tags = _tags_dict(tags)
+                if _match_tags(tags, tag_filter):
+                    result[node_id] = {'type': 'node', 'id': node_id, 'lat': lat, 'lon': lon, 'tags': tags}
+
+        return result
+
+    def _find_ways(
+        self,
+        conn: sqlite3.Connection,
+        bbs: Iterable[BoundingBox],
+        tag_filter: TagFilter,
+    ) -> tuple[dict[int, dict], dict[int, tuple[float, float]]]:
+        candidates: dict[int, tuple[dict, tuple[float, float, float, float]]] = {}
+        candidates_bbs: dict[int, list[BoundingBox]] = {}
+
+        for bb in bbs:
+            for way_id, nodes, tags, *bounds in conn.execute(
+                'SELECT w.id, w.nodes, w.tags, w.minlat, w.maxlat, w.minlon, w.maxlon '  # noqa: S608
+                f'FROM way_bb b JOIN way w ON w.id = b.id WHERE {_BB_WHERE}',
+                asdict(bb),
+            ):
+                if way_id not in candidates:
+                    tags = _tags_dict(tags)
+                    if not _match_tags(tags, tag_filter):
+                        continue
+                    way = {'type': 'way', 'id': way_id, 'nodes': orjson.loads(nodes), 'tags': tags}
+                    candidates[way_id] = (way, tuple(bounds))
+                candidates_bbs.setdefault(way_id, []).append(bb)
+
+        node_coords = self._node_coords(conn, {n for way, _ in candidates.values() for n in way['nodes']})
+        result = {}
+
+        for way_id, (way, (minlat, maxlat, minlon, maxlon)) in candidates.items():
+            # skip ways cut by the extract boundary
+            if any(n not in node_coords for n in way['nodes']):
+                continue
+
+            for bb in candidates_bbs[way_id]:
+                # fully contained, or actually crossing the bounding box
+                if (bb.minlat <= minlat and maxlat <= bb.maxlat and bb.minlon <= minlon and maxlon <= bb.maxlon) or (
+                    _line_intersects_bb(tuple(node_coords[n] for n in way['nodes']), bb)
+                ):
+                    result[way_id] = way
+                    break
+
+        return result, node_coords
+
+    def _find_relations(
+        self,
+        conn: sqlite3.Connection,
+        bbs: Iterable[BoundingBox],
+        tag_filter: TagFilter,
+    ) -> dict[int, tuple[dict, tuple[float, float, float, float]]]:
+        result = {}
+
+        for bb in bbs:
+            for relation_id, members, tags, *bounds in conn.execute(
+                'SELECT r.id, r.members, r.tags, r.minlat, r.maxlat, r.minlon, r.maxlon '  # noqa: S608
+                f'FROM relation_bb b JOIN relation r ON r.id = b.id WHERE {_BB_WHERE}',
+                asdict(bb),
+            ):
+                if relation_id in result:
+                    continue
+
+                tags = _tags_dict(tags)
+                if not _match_tags(tags, tag_filter):
+                    continue
+
+                members = [{'type': t, 'ref': ref, 'role': role} for t, ref, role in orjson.loads(members)]
+                if not self._members_intersect_bb(conn, members, bb):
+                    continue
+
+                relation = {'type': 'relation', 'id': relation_id, 'members': members, 'tags': tags}
+                result[relation_id] = (relation, tuple(bounds))
+
+        return result
+
+    def _members_intersect_bb(self, conn: sqlite3.Connection, members: Iterable[dict], bb: BoundingBox) -> bool:
+        node_ids = [m['ref'] for m in members if m['type'] == 'node']
+        if self._any_node_in_bb(conn, node_ids, bb):
+            return True
+
+        way_ids = [m['ref'] for m in members if m['type'] == 'way']
+        ways = conn.execute('SELECT nodes FROM way WHERE id IN (SELECT value FROM json_each(?))', (_json_ids(way_ids),))
+        ways_nodes = [orjson.loads(nodes) for (nodes,) in ways]
+        node_coords = self._node_coords(conn, chain.from_iterable(ways_nodes))
+        return any(
+            _line_intersects_bb(tuple(node_coords[n] for n in nodes if n in node_coords), bb) for nodes in ways_nodes
+        )
+
+    def _any_node_in_bb(self, conn: sqlite3.Connection, node_ids: Collection[int], bb: BoundingBox) -> bool:
+        if not node_ids:
+            return False
+        return any(
+            bb.minlat <= lat <= bb.maxlat and bb.minlon <= lon <= bb.maxlon
+            for lat, lon in self._node_coords(conn, node_ids).values()
+        )
+
+    def _get_features(self, conn: sqlite3.Connection, typed_ids: Iterable[tuple[str, int]]) -> list[dict]:
+        ids_by_type: dict[str, list[int]] = {'node': [], 'way': [], 'relation': []}
+        for type, ref in typed_ids:
+            ids_by_type[type].append(ref)
+
+        result = [
+            {'type': 'node', 'id': node_id, 'lat': lat, 'lon': lon, 'tags': _tags_dict(tags)}
+            for node_id, lat, lon, tags in conn.execute(
+                'SELECT id, lat, lon, tags FROM node WHERE id IN (SELECT value FROM json_each(?))',
+                (_json_ids(ids_by_type['node']),),
+            )
+        ]
+
+        for type in ('way', 'relation'):
+            result.extend(
+                {'type': type, 'id': element_id, 'center': _center(*bounds), 'tags': _tags_dict(tags)}
+                for element_id, tags, *bounds in conn.execute(
+                    f'SELECT id, tags, minlat, maxlat, minlon, maxlon FROM {type} '  # noqa: S608
+                    'WHERE minlat IS NOT NULL AND id IN (SELECT value FROM json_each(?))',
+                    (_json_ids(ids_by_type[type]),),
+                )
+            )
+
+        return result
+
+    def relation_ways_bounds(self, relation_id: int) -> list[dict]:
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT members FROM relation WHERE id = ?', (relation_id,)).fetchone()
+            if row is None:
+                return []
+
+            way_ids = [ref for type, ref, _ in orjson.loads(row[0]) if type == 'way']
+            rows = conn.execute(
+                'SELECT id, minlat, minlon, maxlat, maxlon FROM way '
+                'WHERE minlat IS NOT NULL AND id IN (SELECT value FROM json_each(?))',
+                (_json_ids(way_ids),),
+            ).fetchall()
+
+        return [
+            {
+                'type': 'way',
+                'id': way_id,
+                'bounds': {'minlat': minlat, 'minlon': minlon, 'maxlat': maxlat, 'maxlon': maxlon},
+            }
+            for way_id, minlat, minlon, maxlat, maxlon in rows
+        ]
+
+    def query_bbs(
+        self,
+        cell_bbs: Sequence[BoundingBox],
+        cell_bbs_expanded: Sequence[BoundingBox],
+        route_type: str,
+    ) -> list[list[dict]]:
+        filters = _ROUTE_TYPE_FILTERS.get(route_type)
+        if filters is None:
+            raise NotImplementedError(f'Unsupported route type {route_type!r}')
+
+        with closing(self._connect()) as conn:
+            ways, node_coords = self._find_ways(conn, cell_bbs, filters.ways)
+            way_nodes = dict.fromkeys(chain.from_iterable(way['nodes'] for way in ways.values()))
+            nodes = [{'type': 'node', 'id': n, 'lat': node_coords[n][0], 'lon': node_coords[n][1]} for n in way_nodes]
+
+            turning_circles = [
+                {'type': 'node', 'id': node['id'], 'tags': node['tags']}
+                for node in self._find_nodes(conn, cell_bbs, (('highway', 'turning_circle'),)).values()
+            ]
+
+            features: dict[tuple[str, int], dict] = {}
+            for types, tag_filter in filters.features:
+                if 'n' in types:
+                    for node in self._find_nodes(conn, cell_bbs_expanded, tag_filter).values():
+                        features['node', node['id']] = node
+                if 'w' in types:
+                    for way_id, way in self._find_ways(conn, cell_bbs_expanded, tag_filter)[0].items():
+                        features['way', way_id] = way
+                if 'r' in types:
+                    for relation_id, (relation, _) in self._find_relations(conn, cell_bbs_expanded, tag_filter).items():
+                        features['relation', relation_id] = relation
+
+            stop_areas = self._find_relations(conn, cell_bbs_expanded, (('public_transport', 'stop_area'),))
+            stop_area_relations = [relation for relation, _ in stop_areas.values()]
+            members = tuple(chain.from_iterable(relation['members'] for relation in stop_area_relations))
+
+            platforms = self._get_features(
+                conn, dict.fromkeys((m['type'], m['ref']) for m in members if m['role'] == 'platform')
+            )
+            stops = self._get_features(
+                conn,
+                dict.fromkeys((m['type'], m['ref']) for m in members if m['role'] == 'stop' and m['type'] == 'node'),
+            )
+
+            bus_elements = self._get_features(conn, features)
+
+        return [list(ways.values()), nodes, turning_circles, bus_elements, stop_area_relations, platforms, stops]
+
+    def query_parents_elements(self, way_ids: Iterable[int]) -> tuple[list[OsmRelation], list[OsmWay]]:
+        # same elements as the parsed overpass response
+        with closing(self._connect()) as conn:
+            relation_rows = conn.execute(
+                'SELECT id, version, members, tags FROM relation WHERE id IN ('
+                "SELECT relation_id FROM relation_member WHERE type = 'way' AND ref IN (SELECT value FROM json_each(?)))",
+                (_json_ids(way_ids),),
+            ).fetchall()
+
+            relations = []
+            member_way_ids = set()
+
+            for relation_id, version, members, tags in relation_rows:
+                members = orjson.loads(members)
+                member_way_ids.update(ref for t, ref, _ in members if t == 'way')
+                relations.append(
+                    OsmRelation(
+                        id=relation_id,
+                        version=version,
+                        members=tuple(OsmMember(type=t, ref=ref, role=role) for t, ref, role in members),
+                        tags=tuple(_tags_dict(tags).items()),
+                    )
+                )
+
+            ways = [
+                OsmWay(id=way_id, nodes=tuple(orjson.loads(nodes)))
+                for way_id, nodes in conn.execute(
+                    'SELECT id, nodes FROM way WHERE id IN (SELECT value FROM json_each(?))',
+                    (_json_ids(member_way_ids),),
+                )
+            ]
+
+        return relations, ways
+
+
+# drop-in replacement for the Overpass backend
+class LocalOverpass(Overpass):
+    def __init__(self, path: str):
+        super().__init__()
+        self._extract = OsmExtract(path)
+
+    async def _query_relation_ways_bounds(self, relation_id: int) -> list[dict]:
+        return await asyncio.to_thread(self._extract.relation_ways_bounds, relation_id)
+
+    async def _query_bbs(
+        self,
+        cell_bbs: Sequence[BoundingBox],
+        cell_bbs_expanded: Sequence[BoundingBox],
+        route_type: str,
+    ) -> list[list[dict]]:
+        return await asyncio.to_thread(self._extract.query_bbs, cell_bbs, cell_bbs_expanded, route_type)
+
+    async def _query_cells_cached(
+        self,
+        relation_id: int,  # noqa: ARG002
+        cells: Sequence[Cell],
+        route_type: str,
+        max_age: float | None,  # noqa: ARG002
+    ) -> list[list[dict]]:
+        # local queries are cheaper than the cell cache
+        cell_bbs, cell_bbs_expanded = optimize_cells_and_get_bbs(cells)
+        return await self._query_bbs(cell_bbs, cell_bbs_expanded, route_type)
+
+    async def _query_parents_elements(
+        self, way_ids_set: frozenset[int]
+    ) -> tuple[Sequence[OsmRelation], Sequence[OsmWay]]:
+        return await asyncio.to_thread(self._extract.query_parents_elements, way_ids_set)
+
+
+# osmium handler, writes elements into the extract database
+class _ExtractWriter:
+    def __init__(self, conn: sqlite3.Connection, *, update: bool):
+        self._conn = conn
+        self._update = update
+        self._dirty_nodes: set[int] = set()
+        self._dirty_ways: set[int] = set()
+        self._dirty_relations: set[int] = set()
+
+    def node(self, n) -> None:
+        if self._update:
+            row = self._conn.execute('SELECT lat, lon FROM node WHERE id = ?', (n.id,)).fetchone()
+            self._conn.execute('DELETE FROM node_bb WHERE id = ?', (n.id,))
+
+            if n.deleted:
+                self._conn.execute('DELETE FROM node WHERE id = ?', (n.id,))
+                self._dirty_nodes.add(n.id)
+                return
+
+            if row is not None and row != (n.location.lat, n.location.lon):
+                self._dirty_nodes.add(n.id)
+
+        lat, lon = n.location.lat, n.location.lon
+        tags = _tags_json(n.tags)
+        self._conn.execute('INSERT OR REPLACE INTO node VALUES (?, ?, ?, ?)', (n.id, lat, lon, tags))
+
+        # only tagged nodes are searched for
+        if tags is not None:
+            self._conn.execute('INSERT INTO node_bb VALUES (?, ?, ?, ?, ?)', (n.id, lat, lat, lon, lon))
+
+    def way(self, w) -> None:
+        if self._update:
+            row = self._conn.execute('SELECT nodes FROM way WHERE id = ?', (w.id,)).fetchone()
+            if row is not None:
+                self._conn.executemany(
+                    'DELETE FROM way_node WHERE node_id = ? AND way_id = ?',
+                    ((n, w.id) for n in orjson.loads(row[0])),
+                )
+                self._conn.execute('DELETE FROM way WHERE id = ?', (w.id,))
+                self._conn.execute('DELETE FROM way_bb WHERE id = ?', (w.id,))
+
+            self._dirty_ways.add(w.id)
+            if w.deleted:
+                return
+
+        nodes = [n.ref for n in w.nodes]
+        self._conn.execute(
+            'INSERT INTO way (id, nodes, tags) VALUES (?, ?, ?)', (w.id, _json_ids(nodes), _tags_json(w.tags))
+        )
+        self._conn.executemany('INSERT OR IGNORE INTO way_node VALUES (?, ?)', ((n, w.id) for n in nodes))
+
+    def relation(self, r) -> None:
+        if self._update:
+            row = self._conn.execute('SELECT members FROM relation WHERE id = ?', (r.id,)).fetchone()
+            if row is not None:
+                self._conn.executemany(
+                    'DELETE FROM relation_member WHERE type = ? AND ref = ? AND relation_id = ?',
+                    ((type, ref, r.id) for type, ref, _ in orjson.loads(row[0])),
+                )
+                self._conn.execute('DELETE FROM relation WHERE id = ?', (r.id,))
+                self._conn.execute('DELETE FROM relation_bb WHERE id = ?', (r.id,))
+
+            self._dirty_relations.add(r.id)
+            if r.deleted:
+                return
+
+        members = [(_MEMBER_TYPES[m.type], m.ref, m.role) for m in r.members]
+        self._conn.execute(
+            'INSERT INTO relation (id, version, timestamp, changeset, uid, user, members, tags) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                r.id,
+                r.version,
+                r.timestamp.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                r.changeset,
+                r.uid,
+                r.user,
+                orjson.dumps(members).decode(),
+                _tags_json(r.tags),
+            ),
+        )
+        self._conn.executemany(
+            'INSERT OR IGNORE INTO relation_member VALUES (?, ?, ?)',
+            ((type, ref, r.id) for type, ref, _ in members),
+        )
+
+    def _update_bounds(self, ways_where: str, relations_where: str, params: dict) -> None:
+        super_relations_where = f'{relations_where} AND {_SUPER_RELATIONS_WHERE}'
+        sqls = (
+            (_WAYS_BOUNDS_SQL, ways_where),
+            (_RELATIONS_BOUNDS_SQL, relations_where),
+            *((_RELATIONS_BOUNDS_SQL, super_relations_where) for _ in range(_RELATION_NESTING_DEPTH - 1)),
+            (_RELATIONS_BB_SQL, relations_where),
+        )
+
+        # executescript would commit the transaction
+        for sql, where in sqls:
+            for statement in sql.format(where=where).split(';'):
+                if statement.strip():
+                    self._conn.execute(statement, params)
+
+    def _parent_relations(self, type: str, ids: Iterable[int]) -> set[int]:
+        return {
+            relation_id
+            for (relation_id,) in self._conn.execute(
+                'SELECT relation_id FROM relation_member WHERE type = ? AND ref IN (SELECT value FROM json_each(?))',
+                (type, _json_ids(ids)),
+            )
+        }
+
+    def finish(self) -> None:
+        if not self._update:
+            self._update_bounds('TRUE', 'TRUE', {})
+            return
+
+        # moved nodes change bounds of their ways, and both change bounds of their relations
+        dirty_ways = self._dirty_ways.union(
+            way_id
+            for (way_id,) in self._conn.execute(
+                'SELECT way_id FROM way_node WHERE node_id IN (SELECT value FROM json_each(?))',
+                (_json_ids(self._dirty_nodes),),
+            )
+        )
+        dirty_relations = self._dirty_relations.union(
+            self._parent_relations('node', self._dirty_nodes), self._parent_relations('way', dirty_ways)
+        )
+
+        # and relations change bounds of their super-relations
+        new_relations = dirty_relations
+        for _ in range(_RELATION_NESTING_DEPTH - 1):
+            new_relations = self._parent_relations('relation', new_relations) - dirty_relations
+            if not new_relations:
+                break
+            dirty_relations |= new_relations
+
+        self._update_bounds(
+            'id IN (SELECT value FROM json_each(:ways))',
+            'id IN (SELECT value FROM json_each(:relations))',
+            {'ways': _json_ids(dirty_ways), 'relations': _json_ids(dirty_relations)},
+        )
+
+        print(
+            f'[EXTRACT] Updated {len(self._dirty_nodes)} moved nodes, '
+            f'{len(dirty_ways)} ways, {len(dirty_relations)} relations'
+        )
+
+
+def _get_meta(conn: sqlite3.Connection, key: str):
+    row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return row[0] if row is not None else None
+
+
+def _set_meta(conn: sqlite3.Connection, key: str, value) -> None:
+    conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+
+def import_extract(path: Path, input_path: str, replication_url: str | None) -> None:
+    import osmium  # only needed for maintaining the extract
+    from osmium.replication import ReplicationServer, get_replication_header
+
+    # build next to the current extract, then swap atomically
+    tmp_path = path.with_name(f'{path.name}.tmp')
+    tmp_path.unlink(missing_ok=True)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with closing(sqlite3.connect(tmp_path)) as conn:
+        conn.executescript('PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF;' + _SCHEMA)
+
+        with conn:
+            writer = _ExtractWriter(conn, update=False)
+            osmium.apply(input_path, writer)
+            writer.finish()
+
+            header = get_replication_header(input_path)
+            replication_url = replication_url or header.url
+            sequence = header.sequence
+
+            if replication_url and sequence is None and header.timestamp is not None:
+                with ReplicationServer(replication_url) as server:
+                    sequence = server.timestamp_to_sequence(header.timestamp)
+
+            _set_meta(conn, 'replication_url', replication_url)
+            _set_meta(conn, 'replication_sequence', sequence)
+
+        conn.execute('PRAGMA journal_mode=WAL')
+
+    tmp_path.replace(path)
+    print(f'[EXTRACT] Imported {input_path} (replication sequence {sequence})')
+
+
+def apply_changes(path: Path, input_path: str) -> None:
+    import osmium  # only needed for maintaining the extract
+
+    with closing(sqlite3.connect(path, timeout=30)) as conn, conn:
+        writer = _ExtractWriter(conn, update=True)
+        osmium.apply(input_path, writer)
+        writer.finish()
+
+
+def update_extract(path: Path, max_size: int) -> bool:
+    from osmium.replication import ReplicationServer  # only needed for maintaining the extract
+
+    with closing(sqlite3.connect(path, timeout=30)) as conn, conn:
+        replication_url = _get_meta(conn, 'replication_url')
+        sequence = _get_meta(conn, 'replication_sequence')
+        if replication_url is None or sequence is None:
+            raise SystemExit('Extract has no replication information, re-import with --replication-url')
+
+        writer = _ExtractWriter(conn, update=True)
+
+        with ReplicationServer(replication_url) as server:
+            new_sequence = server.apply_diffs(writer, sequence + 1, max_size=max_size)
+
+        if new_sequence is None:
+            print('[EXTRACT] Already up-to-date')
+            return False
+
+        writer.finish()
+        _set_meta(conn, 'replication_sequence', new_sequence)
+
+    print(f'[EXTRACT] Updated to replication sequence {new_sequence}')
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Maintain the local OSM extract (requires pyosmium)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_import = subparsers.add_parser('import', help='import an OSM file (.osm.pbf), replacing the extract')
+    parser_import.add_argument('input')
+    parser_import.add_argument('--replication-url', help='e.g. https://planet.openstreetmap.org/replication/minute')
+
+    parser_apply = subparsers.add_parser('apply', help='apply an OSM change file (.osc.gz)')
+    parser_apply.add_argument('input')
+
+    parser_update = subparsers.add_parser('update', help='apply pending replication diffs')
+    parser_update.add_argument('--max-size', type=int, default=50 * 1024, help='maximum download size in KB')
+
+    args = parser.parse_args()
+
+    if not OSM_EXTRACT_PATH:
+        raise SystemExit('OSM_EXTRACT_PATH is not set')
+
+    path = Path(OSM_EXTRACT_PATH)
+
+    if args.command == 'import':
+        import_extract(path, args.input, args.replication_url)
+    elif args.command == 'apply':
+        apply_changes(path, args.input)
+    elif args.command == 'update':
+        while update_extract(path, args.max_size):
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from typing import NamedTuple
+from xml.parsers.expat import ParserCreate
+from xml.sax.saxutils import quoteattr
+
+from config import CREATED_BY
+
+
+# a named tuple, relations can have thousands of members
+class OsmMember(NamedTuple):
+    type: str
+    ref: int
+    role: str
+
+
+@dataclass(frozen=True, kw_only=True, slots=True)
+class OsmWay:
+    id: int
+    version: int | None = None  # not included in the skeleton output
+    nodes: tuple[int, ...] = ()
+    tags: tuple[tuple[str, str], ...] = ()
+
+
+@dataclass(frozen=True, kw_only=True, slots=True)
+class OsmRelation:
+    id: int
+    version: int | None = None
+    members: tuple[OsmMember, ...] = ()
+    tags: tuple[tuple[str, str], ...] = ()
+
+
+class OsmXmlParser:
+    """
+    Incremental parser of OSM XML, keeping only the ways and relations with their ids, versions, nodes, members and tags.
+
+    The data can be fed in chunks as it arrives.
+    """
+
+    __slots__ = ('_attrs', '_members', '_nodes', '_parser', '_tags', 'relations', 'ways')
+
+    def __init__(self):
+        self.ways: list[OsmWay] = []
+        self.relations: list[OsmRelation] = []
+        self._attrs: dict[str, str] = {}
+        self._nodes: list[int] = []
+        self._members: list[OsmMember] = []
+        self._tags: list[tuple[str, str]] = []
+
+        self._parser = ParserCreate()
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+
+    def _start(self, name: str, attrs: dict[str, str]) -> None:
+        if name == 'nd':
+            self._nodes.append(int(attrs['ref']))
+        elif name == 'member':
+            self._members.append(OsmMember(attrs['type'], int(attrs['ref']), attrs['role']))
+        elif name == 'tag':
+            self._tags.append((attrs['k'], attrs['v']))
+        else:
+            # also skips over the tags of nodes
+            self._attrs = attrs
+            self._nodes = []
+            self._members = []
+            self._tags = []
+
+    def _end(self, name: str) -> None:
+        if name == 'way':
+            self.ways.append(
+                OsmWay(
+                    id=int(self._attrs['id']),
+                    version=int(version) if (version := self._attrs.get('version')) is not None else None,
+                    nodes=tuple(self._nodes),
+                    tags=tuple(self._tags),
+                )
+            )
+        elif name == 'relation':
+            self.relations.append(
+                OsmRelation(
+                    id=int(self._attrs['id']),
+                    version=int(version) if (version := self._attrs.get('version')) is not None else None,
+                    members=tuple(self._members),
+                    tags=tuple(self._tags),
+                )
+            )
+
+    def feed(self, data: bytes) -> None:
+        self._parser.Parse(data, False)
+
+    def close(self) -> None:
+        self._parser.Parse(b'', True)
+
+
+def parse_osm_xml(data: bytes) -> OsmXmlParser:
+    parser = OsmXmlParser()
+    parser.feed(data)
+    parser.close()
+    return parser
+
+
+def _iter_element(element: OsmWay | OsmRelation, changeset: str | None, indent: str, newline: str) -> Iterator[str]:
+    yield f'{indent}<way id="{element.id}"' if isinstance(element, OsmWay) else f'{indent}<relation id="{element.id}"'
+
+    if element.version is not None:
+        yield f' version="{element.version}"'
+    if changeset is not None:
+        yield f' changeset={quoteattr(changeset)}'
+    yield f'>{newline}'
+
+    child_indent = indent + '\t' if newline else ''
+
+    if isinstance(element, OsmWay):
+        for node_id in element.nodes:
+            yield f'{child_indent}<nd ref="{node_id}"/>{newline}'
+    else:
+        for member in element.members:
+            yield (
+                f'{child_indent}<member type={quoteattr(member.type)} ref="{member.ref}"'
+                f' role={quoteattr(member.role)}/>{newline}'
+            )
+
+    for key, value in element.tags:
+        yield f'{child_indent}<tag k={quoteattr(key)} v={quoteattr(value)}/>{newline}'
+
+    yield f'{indent}</way>{newline}' if isinstance(element, OsmWay) else f'{indent}</relation>{newline}'
+
+
+def iter_osm_change(
+    create: Iterable[OsmWay | OsmRelation],
+    modify: Iterable[OsmWay | OsmRelation],
+    *,
+    changeset: str | None,
+    pretty: bool,
+) -> Iterator[str]:
+    """
+    Generate the osmChange document in pieces, without building an intermediate tree.
+
+    Elements to create must have negative ids and no version.
+    """
+    newline = '\n' if pretty else ''
+    indent = '\t' if pretty else ''
+
+    yield f'<?xml version="1.0" encoding="utf-8"?>\n<osmChange version="0.6" generator={quoteattr(CREATED_BY)}>'
+    yield newline
+
+    for action, elements in (('create', create), ('modify', modify)):
+        yield f'{indent}<{action}>{newline}'
+        for element in elements:
+            yield from _iter_element(element, changeset, indent * 2, newline)
+        yield f'{indent}</{action}>{newline}'
+
+    yield '</osmChange>'
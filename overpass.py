@@ -1,31 +1,105 @@
-from collections import Counter, defaultdict
-from collections.abc import Iterable, Mapping, Sequence
+import asyncio
+from collections import defaultdict
+from collections.abc import Collection, Iterable, Sequence
 from dataclasses import replace
-from itertools import chain
-from typing import NamedTuple
+from functools import cached_property
+from itertools import chain, compress, count
+from typing import NamedTuple, Self
 
-import xmltodict
+import numpy as np
+import orjson
 from asyncache import cached
 from cachetools import TTLCache
 from fastapi import HTTPException
+from httpx import HTTPStatusError
 from starlette import status
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 
 from bus_collection_builder import build_bus_stop_collections
-from config import DOWNLOAD_RELATION_GRID_CELL_EXPAND, DOWNLOAD_RELATION_WAY_BB_EXPAND, OVERPASS_API_INTERPRETER
+from cell_cache import CellCache
+from config import (
+    DOWNLOAD_RELATION_GRID_BOX_COST,
+    DOWNLOAD_RELATION_GRID_CELL_EXPAND,
+    DOWNLOAD_RELATION_GRID_PLAN_MAX_CELLS,
+    DOWNLOAD_RELATION_GRID_SIZE,
+    DOWNLOAD_RELATION_WAY_BB_EXPAND,
+    OVERPASS_API_INTERPRETER,
+    OVERPASS_CELL_CACHE_PATH,
+    OVERPASS_CELL_CACHE_TTL,
+    OVERPASS_MAX_CONCURRENT_QUERIES,
+    OVERPASS_QUERY_CHUNKS,
+)
+from metrics import stage_time
 from models.bounding_box import BoundingBox
 from models.bounding_box_collection import BoundingBoxCollection
 from models.download_history import Cell, DownloadHistory
 from models.element_id import ElementId, element_id
-from models.fetch_relation import FetchRelationBusStop, FetchRelationBusStopCollection, FetchRelationElement
+from models.fetch_relation import (
+    FetchRelationBusStop,
+    FetchRelationBusStopCollection,
+    FetchRelationElement,
+    calculate_ways_length_and_midpoint,
+)
+from offload import offload
+from osm_xml import OsmRelation, OsmWay, OsmXmlParser
 from utils import HTTP
-from xmltodict_postprocessor import postprocessor
 
 # TODO: right hand side detection by querying roundabouts, and first/last bus stop
 
 
 class QueryParentsResult(NamedTuple):
-    id_relations_map: dict[int, list[dict]]
-    ways_map: dict[int, dict]
+    id_relations_map: dict[int, list[OsmRelation]]
+    ways_map: dict[int, OsmWay]
+
+
+class NodeCoords(NamedTuple):
+    ids: np.ndarray  # sorted node ids
+    latLngs: np.ndarray  # (n, 2) coordinates, aligned with ids
+    order: np.ndarray  # source element indices, aligned with ids
+
+    @classmethod
+    def from_elements(cls, node_elements: Sequence[dict]) -> Self:
+        count = len(node_elements)
+        ids = np.fromiter((e['id'] for e in node_elements), np.int64, count)
+        latLngs = np.fromiter(((e['lat'], e['lon']) for e in node_elements), np.dtype((np.float64, 2)), count)
+        order = np.argsort(ids, kind='stable')
+        return cls(ids[order], latLngs[order], order)
+
+    def find(self, node_ids: np.ndarray) -> np.ndarray:
+        # positions of the node ids, -1 if not found
+        if not self.ids.size:
+            return np.full(node_ids.shape, -1, np.intp)
+
+        idx = np.searchsorted(self.ids, node_ids)
+        np.minimum(idx, self.ids.size - 1, out=idx)
+        idx[self.ids[idx] != node_ids] = -1
+        return idx
+
+    def index(self, node_ids: np.ndarray) -> np.ndarray:
+        idx = self.find(node_ids)
+        missing = idx < 0
+
+        if missing.any():
+            raise KeyError(f'Node {node_ids[missing][0]} not found in map')
+
+        return idx
+
+    def lookup(self, node_ids: np.ndarray) -> np.ndarray:
+        return self.latLngs[self.index(node_ids)]
+
+
+def lookup_ways_geometry(
+    ways_nodes: Sequence[Sequence[int]],
+    node_coords: NodeCoords,
+) -> tuple[list[list[tuple[float, float]]], list[float], list[tuple[float, float]]]:
+    lengths = np.fromiter(map(len, ways_nodes), np.intp, len(ways_nodes))
+    all_nodes = np.fromiter(chain.from_iterable(ways_nodes), np.int64, lengths.sum())
+    all_latLngs = node_coords.lookup(all_nodes)
+    flat = list(zip(all_latLngs[:, 0].tolist(), all_latLngs[:, 1].tolist(), strict=True))
+    ends = np.cumsum(lengths).tolist()
+    ways_latLngs = [flat[end - length : end] for end, length in zip(ends, lengths.tolist(), strict=True)]
+    ways_length, ways_midpoint = calculate_ways_length_and_midpoint(all_latLngs, lengths)
+    return ways_latLngs, ways_length, ways_midpoint
 
 
 def split_by_count(elements: Iterable[dict]) -> list[list[dict]]:
@@ -278,62 +352,113 @@ def merge_relations_tags(relations: Iterable[dict], elements: Iterable[dict], ro
             _merge_relation_tags(platform, relation, {'public_transport': public_transport})
 
 
-def _create_node_counts(ways: list[dict]) -> Counter[int]:
-    node_counts: Counter[int] = Counter()
-    for way in ways:
-        node_counts.update(way['nodes'])
-    return node_counts
-
-
-def _split_way_on_intersection(way: dict, node_counts: Mapping[int, int]) -> list[list[int]]:
-    segments: list[list[int]] = []
-    current_segment: list[int] = []
-
-    for node in way['nodes']:
-        current_segment.append(node)
-
-        if node_counts[node] > 1 and len(current_segment) > 1:
-            segments.append(current_segment)
-            current_segment = [node]
+class SplitWay(NamedTuple):
+    id: ElementId
+    way: dict  # source element
+    nodes: list[int]
+    turn_in_place_start: bool
+    turn_in_place_end: bool
+
+
+def organize_ways(
+    ways: Sequence[dict],
+    turn_in_place_nodes: Collection[int],
+) -> tuple[list[SplitWay], dict[ElementId, set[ElementId]], dict[int, list[ElementId]]]:
+    lengths = np.fromiter((len(way['nodes']) for way in ways), np.intp, len(ways))
+    all_nodes = np.fromiter(chain.from_iterable(way['nodes'] for way in ways), np.int64, lengths.sum())
+    _, node_idx, node_counts = np.unique(all_nodes, return_inverse=True, return_counts=True)
+    shared = node_counts[node_idx] > 1
+
+    # split on shared nodes, segments span between consecutive cut points of the same way
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    non_empty = lengths > 0
+    is_cut = shared.copy()
+    is_cut[starts[non_empty]] = True
+    is_cut[ends[non_empty] - 1] = True
+
+    cut_pos = np.flatnonzero(is_cut)
+    cut_way = np.repeat(np.arange(len(ways)), lengths)[cut_pos]
+    same_way = cut_way[:-1] == cut_way[1:]
+    seg_start = cut_pos[:-1][same_way]
+    seg_end = cut_pos[1:][same_way]
+    seg_way = cut_way[:-1][same_way]
+    seg_count = np.bincount(seg_way, minlength=len(ways))
+
+    turn_in_place = np.fromiter(turn_in_place_nodes, np.int64, len(turn_in_place_nodes))
+    seg_tip_start = np.isin(all_nodes[seg_start], turn_in_place).tolist()
+    seg_tip_end = np.isin(all_nodes[seg_end], turn_in_place).tolist()
+
+    seg_num = np.arange(seg_way.size) - (np.cumsum(seg_count) - seg_count)[seg_way] + 1
+    seg_count_list: list[int] = seg_count.tolist()
+    all_nodes_list: list[int] = all_nodes.tolist()
+    split_ways: list[SplitWay] = []
+    id_map: dict[int, list[ElementId]] = defaultdict(list)
+
+    for i, start, end, num, tip_start, tip_end in zip(
+        seg_way.tolist(),
+        seg_start.tolist(),
+        seg_end.tolist(),
+        seg_num.tolist(),
+        seg_tip_start,
+        seg_tip_end,
+        strict=True,
+    ):
+        way = ways[i]
+        max_num = seg_count_list[i]
+        split_way_id = element_id(way['id'], extra_num=num, max_num=max_num) if max_num > 1 else element_id(way['id'])
+
+        split_ways.append(SplitWay(split_way_id, way, all_nodes_list[start : end + 1], tip_start, tip_end))
+        id_map[way['id']].append(split_way_id)
+
+    # node -> segment incidence at shared nodes, boundary nodes belong to both of their segments
+    seg_lengths = seg_end - seg_start + 1
+    inc_seg = np.repeat(np.arange(seg_start.size), seg_lengths)
+    inc_pos = (
+        np.arange(inc_seg.size) - np.repeat(np.cumsum(seg_lengths) - seg_lengths, seg_lengths) + seg_start[inc_seg]
+    )
+    inc_mask = shared[inc_pos]
+    inc_node = node_idx[inc_pos[inc_mask]]
+    inc_seg = inc_seg[inc_mask]
 
-    if len(current_segment) > 1:
-        segments.append(current_segment)
+    order = np.argsort(inc_node, kind='stable')
+    inc_node = inc_node[order]
+    inc_seg = inc_seg[order]
 
-    return segments
+    # connect every pair of incidences at the same node, a segment passing a node twice connects to itself
+    pairs_src: list[np.ndarray] = []
+    pairs_dst: list[np.ndarray] = []
 
+    for offset in count(1):
+        pair_mask = inc_node[:-offset] == inc_node[offset:]
+        if not pair_mask.any():
+            break
 
-def organize_ways(ways: list[dict], turn_in_place_nodes: set[int]) -> tuple[list[dict], dict[ElementId, set[ElementId]], dict[int, list[ElementId]]]:
-    node_counts = _create_node_counts(ways)
-    node_to_way_map = defaultdict(set)
+        a = inc_seg[:-offset][pair_mask]
+        b = inc_seg[offset:][pair_mask]
+        pairs_src.extend((a, b))
+        pairs_dst.extend((b, a))
 
-    split_ways: list[dict] = []
     connected_ways_map: dict[ElementId, set[ElementId]] = defaultdict(set)
-    id_map = defaultdict(list)
-
-    for way in ways:
-        split_segments = _split_way_on_intersection(way, node_counts)
 
-        for extra_num, segment in enumerate(split_segments, 1):
-            extra_num = extra_num if len(split_segments) > 1 else None
-            max_num = len(split_segments) if extra_num is not None else None
-
-            split_way = {
-                **way,
-                'id': element_id(way['id'], extra_num=extra_num, max_num=max_num),
-                'nodes': segment,
-                '_turn_in_place_start': segment[0] in turn_in_place_nodes,
-                '_turn_in_place_end': segment[-1] in turn_in_place_nodes,
-            }
-
-            split_ways.append(split_way)
-            id_map[way['id']].append(split_way['id'])
-
-            for node in segment:
-                if node_counts[node] > 1:
-                    for other_way_id in node_to_way_map[node]:
-                        connected_ways_map[split_way['id']].add(other_way_id)
-                        connected_ways_map[other_way_id].add(split_way['id'])
-                    node_to_way_map[node].add(split_way['id'])
+    if pairs_src:
+        src = np.concatenate(pairs_src)
+        dst = np.concatenate(pairs_dst)
+        order = np.argsort(src, kind='stable')
+        src = src[order]
+        group_starts = np.flatnonzero(np.r_[True, src[1:] != src[:-1]])
+        group_ends = np.r_[group_starts[1:], src.size]
+
+        split_way_ids = np.array([w.id for w in split_ways], dtype=object)
+        dst_ids: list[ElementId] = split_way_ids[dst[order]].tolist()
+
+        for seg_id, start, end in zip(
+            split_way_ids[src[group_starts]].tolist(),
+            group_starts.tolist(),
+            group_ends.tolist(),
+            strict=True,
+        ):
+            connected_ways_map[seg_id] = set(dst_ids[start:end])
 
     return split_ways, connected_ways_map, id_map
 
@@ -349,55 +474,302 @@ def preprocess_elements(elements: Iterable[dict]) -> tuple[dict, ...]:
     return result
 
 
-def optimize_cells_and_get_bbs(
-    cells: Sequence[Cell],
-    *,
-    start_horizontal: bool,
-) -> tuple[Sequence[BoundingBox], Sequence[BoundingBox]]:
-    def merge(sorted: list[tuple[int, int, int, int]]) -> list[tuple[int, int, int, int]]:
-        result = []
-        current = sorted[0]
+def merge_elements_splits(elements_splits: Iterable[list[list[dict]]]) -> list[list[dict]]:
+    result: list[dict[tuple[str, int], dict]] | None = None
+
+    for elements_split in elements_splits:
+        if result is None:
+            result = [{} for _ in elements_split]
+
+        for split_map, elements in zip(result, elements_split, strict=True):
+            for e in elements:
+                split_map[e['type'], e['id']] = e
 
-        for next in sorted[1:]:
-            # merge horizontally
-            if current[2] + 1 == next[0] and current[1] == next[1] and current[3] == next[3]:
-                current = (current[0], current[1], next[2], current[3])
+    assert result is not None, 'No element splits to merge'
+    return [list(split_map.values()) for split_map in result]
 
-            # merge vertically
-            elif current[3] + 1 == next[1] and current[0] == next[0] and current[2] == next[2]:
-                current = (current[0], current[1], current[2], next[3])
 
-            # add to merged cells if cells can't be merged
+def _point_cells(lat: float, lon: float, expand: float) -> set[Cell]:
+    return BoundingBox(minlat=lat, minlon=lon, maxlat=lat, maxlon=lon).extend(unit_degrees=expand).get_grid_cells()
+
+
+def split_elements_by_cell(elements_split: list[list[dict]], cells: Iterable[Cell]) -> dict[Cell, list[list[dict]]]:
+    (
+        road_elements,
+        node_elements,
+        turn_in_place_elements,
+        bus_elements,
+        stop_area_relations,
+        stop_area_platform_elements,
+        stop_area_stop_position_elements,
+    ) = elements_split
+
+    cells_set = frozenset(cells)
+    result = {cell: [[] for _ in elements_split] for cell in cells_set}
+
+    node_coords = NodeCoords.from_elements(node_elements)
+    cell_way_slices: dict[Cell, list[slice]] = defaultdict(list)
+
+    # ways belong to every cell they pass through, including cells crossed without any node inside
+    lengths = tuple(len(e['nodes']) for e in road_elements)
+    all_nodes = np.fromiter(chain.from_iterable(e['nodes'] for e in road_elements), np.int64, sum(lengths))
+    all_idx = node_coords.index(all_nodes)
+    grid = np.floor_divide(node_coords.latLngs[all_idx], DOWNLOAD_RELATION_GRID_SIZE).astype(np.int64)
+    grid_ys = grid[:, 0].tolist()
+    grid_xs = grid[:, 1].tolist()
+    end = 0
+
+    for way, length in zip(road_elements, lengths, strict=True):
+        start, end = end, end + length
+        way_cells: set[Cell] = set()
+        prev_x = prev_y = None
+
+        for x, y in zip(grid_xs[start:end], grid_ys[start:end], strict=True):
+            if prev_x is None or (prev_x == x and prev_y == y):
+                way_cells.add(Cell(x, y))
             else:
-                result.append(current)
-                current = next
+                way_cells.update(
+                    Cell(cx, cy)
+                    for cx in range(min(prev_x, x), max(prev_x, x) + 1)
+                    for cy in range(min(prev_y, y), max(prev_y, y) + 1)
+                )
+            prev_x, prev_y = x, y
+
+        for cell in way_cells.intersection(cells_set):
+            result[cell][0].append(way)
+            cell_way_slices[cell].append(slice(start, end))
+
+    for cell, way_slices in cell_way_slices.items():
+        cell_idx = np.unique(np.concatenate([all_idx[way_slice] for way_slice in way_slices]))
+        result[cell][1].extend(node_elements[i] for i in node_coords.order[cell_idx].tolist())
+
+    # turning circles are only relevant on downloaded ways
+    turn_ids = np.fromiter((e['id'] for e in turn_in_place_elements), np.int64, len(turn_in_place_elements))
+    turn_idx = node_coords.find(turn_ids)
+    turn_found = turn_idx >= 0
+    turn_latLngs = node_coords.latLngs[turn_idx[turn_found]].tolist()
+
+    for e, (lat, lon) in zip(compress(turn_in_place_elements, turn_found.tolist()), turn_latLngs, strict=True):
+        for cell in _point_cells(lat, lon, 0).intersection(cells_set):
+            result[cell][2].append(e)
+
+    for e in bus_elements:
+        center = e.get('center', e)
+        bus_cells = _point_cells(center['lat'], center['lon'], DOWNLOAD_RELATION_GRID_CELL_EXPAND)
+        for cell in bus_cells.intersection(cells_set):
+            result[cell][3].append(e)
+
+    # stop areas belong to all cells of their members, members belong to all cells of their stop areas
+    members_map: dict[tuple[str, int], list[tuple[int, dict]]] = defaultdict(list)
+
+    for split_index, elements in ((5, stop_area_platform_elements), (6, stop_area_stop_position_elements)):
+        for e in elements:
+            members_map[e['type'], e['id']].append((split_index, e))
+
+    for relation in stop_area_relations:
+        relation_members = tuple(
+            chain.from_iterable(members_map.get((m['type'], m['ref']), ()) for m in relation['members'])
+        )
+        relation_cells: set[Cell] = set()
+
+        for _, e in relation_members:
+            center = e.get('center', e)
+            relation_cells.update(_point_cells(center['lat'], center['lon'], DOWNLOAD_RELATION_GRID_CELL_EXPAND))
+
+        for cell in relation_cells.intersection(cells_set):
+            result[cell][4].append(relation)
+            for split_index, e in relation_members:
+                result[cell][split_index].append(e)
 
-        # add the last cell
-        result.append(current)
+    return result
+
+
+class _PrefixSum:
+    """
+    Sums of rectangles in a region of the grid, whose bottom-left corner is (ox, oy).
+    """
+
+    __slots__ = ('_ox', '_oy', '_prefix')
+
+    def __init__(self, grid: np.ndarray, ox: int = 0, oy: int = 0, x1: int = -1, y1: int = -1):
+        region = grid[oy : y1 + 1 if y1 >= 0 else None, ox : x1 + 1 if x1 >= 0 else None]
+        prefix = np.zeros((region.shape[0] + 1, region.shape[1] + 1), dtype=np.int64)
+        prefix[1:, 1:] = region.cumsum(0).cumsum(1)
+        self._prefix: list[list[int]] = prefix.tolist()
+        self._ox = ox
+        self._oy = oy
+
+    def rect_sum(self, x0: int, y0: int, x1: int, y1: int) -> int:
+        prefix = self._prefix
+        x0 -= self._ox
+        x1 -= self._ox
+        y0 -= self._oy
+        y1 -= self._oy
+        return prefix[y1 + 1][x1 + 1] - prefix[y0][x1 + 1] - prefix[y1 + 1][x0] + prefix[y0][x0]
+
+
+def _best_anchor_rect(
+    prefix: _PrefixSum,
+    allowed_row: list[bool],
+    up_row: list[int],
+    x0: int,
+    y0: int,
+    max_h: int,
+) -> tuple[float, tuple[int, int, int, int]] | None:
+    best = None
+    best_score = 0.0
+
+    # consider the tallest rectangle for each width
+    for x1 in range(x0, len(allowed_row)):
+        if not allowed_row[x1]:
+            break
 
-        return result
+        max_h = min(max_h, up_row[x1])
+        y1 = y0 + max_h - 1
 
-    cells_bounds = ((c.x, c.y, c.x, c.y) for c in cells)
+        # skip the top rows which don't contribute
+        while y1 >= y0 and not prefix.rect_sum(x0, y1, x1, y1):
+            y1 -= 1
 
-    if start_horizontal:
-        cells_bounds = sorted(cells_bounds, key=lambda c: (c[1], c[0]))
-    else:
-        cells_bounds = sorted(cells_bounds, key=lambda c: (c[0], c[1]))
+        if y1 < y0:
+            continue
+
+        area = (x1 - x0 + 1) * (y1 - y0 + 1)
+        score = prefix.rect_sum(x0, y0, x1, y1) / (area + DOWNLOAD_RELATION_GRID_BOX_COST)
+
+        if score > best_score:
+            best = (x0, y0, x1, y1)
+            best_score = score
+
+    return (best_score, best) if best is not None else None
+
+
+def _row_runs_rects(cells: Collection[Cell]) -> list[tuple[int, int, int, int]]:
+    result = []
+
+    for y, x in sorted((c.y, c.x) for c in cells):
+        if result and result[-1][1] == y and result[-1][2] == x - 1:
+            result[-1] = (result[-1][0], y, x, y)
+        else:
+            result.append((x, y, x, y))
 
-    cells_bounds = merge(cells_bounds)
+    return result
+
+
+# cover the cells with rectangles (x, y, x_max, y_max), each costing its area + DOWNLOAD_RELATION_GRID_BOX_COST;
+# rectangles may also span optional cells (e.g. already cached) when that's cheaper than splitting them
+def plan_cells_rects(
+    cells: Collection[Cell],
+    optional_cells: Collection[Cell] = (),
+) -> list[tuple[int, int, int, int]]:
+    required = frozenset(cells)
+    if not required:
+        return []
+
+    allowed = required.union(optional_cells)
+    if len(allowed) > DOWNLOAD_RELATION_GRID_PLAN_MAX_CELLS:
+        return _row_runs_rects(required)
+
+    min_x = min(c.x for c in allowed)
+    min_y = min(c.y for c in allowed)
+    width = max(c.x for c in allowed) - min_x + 1
+    height = max(c.y for c in allowed) - min_y + 1
+
+    allowed_grid = np.zeros((height, width), dtype=bool)
+    remaining_grid = np.zeros((height, width), dtype=bool)
+
+    for c in allowed:
+        allowed_grid[c.y - min_y, c.x - min_x] = True
+    for c in required:
+        remaining_grid[c.y - min_y, c.x - min_x] = True
+
+    # number of consecutive allowed cells upwards, including self
+    up = np.zeros((height + 1, width), dtype=np.int64)
+    for y in range(height - 1, -1, -1):
+        up[y] = (up[y + 1] + 1) * allowed_grid[y]
+
+    up_list: list[list[int]] = up.tolist()
+    allowed_list: list[list[bool]] = allowed_grid.tolist()
+    prefix = _PrefixSum(remaining_grid)
+
+    # best rectangle and reachable area for each bottom-left corner
+    candidates: dict[tuple[int, int], tuple[float, tuple[int, int, int, int], tuple[int, int]]] = {}
+
+    for y0, x0 in np.argwhere(allowed_grid).tolist():
+        x_end = x0
+        while x_end + 1 < width and allowed_list[y0][x_end + 1]:
+            x_end += 1
+
+        y_top = y0 + max(up_list[y0][x0 : x_end + 1]) - 1
+
+        if best := _best_anchor_rect(prefix, allowed_list[y0], up_list[y0], x0, y0, height):
+            candidates[x0, y0] = (*best, (x_end, y_top))
+
+    result = []
+    remaining = len(required)
+
+    # greedy weighted set cover, only candidates reaching the picked rectangle need to be re-evaluated
+    while remaining:
+        _, (x0, y0, x1, y1), _ = max(candidates.values(), key=lambda c: c[0])
+        remaining -= int(remaining_grid[y0 : y1 + 1, x0 : x1 + 1].sum())
+        remaining_grid[y0 : y1 + 1, x0 : x1 + 1] = False
+        result.append((x0 + min_x, y0 + min_y, x1 + min_x, y1 + min_y))
+
+        affected = [
+            (anchor, reach)
+            for anchor, (_, _, reach) in candidates.items()
+            if not (anchor[0] > x1 or anchor[1] > y1 or reach[0] < x0 or reach[1] < y0)
+        ]
+
+        # the sums are only needed within the reach of the affected candidates, not the whole grid
+        prefix = _PrefixSum(
+            remaining_grid,
+            min(ax for (ax, _), _ in affected),
+            min(ay for (_, ay), _ in affected),
+            max(x_end for _, (x_end, _) in affected),
+            max(y_top for _, (_, y_top) in affected),
+        )
 
-    if start_horizontal:
-        cells_bounds = sorted(cells_bounds, key=lambda c: (c[0], c[1]))
-    else:
-        cells_bounds = sorted(cells_bounds, key=lambda c: (c[1], c[0]))
+        for (ax, ay), (x_end, y_top) in affected:
+            if best := _best_anchor_rect(prefix, allowed_list[ay], up_list[ay], ax, ay, height):
+                candidates[ax, ay] = (*best, (x_end, y_top))
+            else:
+                del candidates[ax, ay]
 
-    cells_bounds = merge(cells_bounds)
+    return result
 
-    bbs = tuple(BoundingBox.from_grid_cell(*c) for c in cells_bounds)
 
+def optimize_cells_and_get_bbs(
+    cells: Collection[Cell],
+    optional_cells: Collection[Cell] = (),
+) -> tuple[Sequence[BoundingBox], Sequence[BoundingBox]]:
+    bbs = tuple(BoundingBox.from_grid_cell(*r) for r in plan_cells_rects(cells, optional_cells))
     return bbs, tuple(bb.extend(unit_degrees=DOWNLOAD_RELATION_GRID_CELL_EXPAND) for bb in bbs)
 
 
+def split_bbs_into_chunks(
+    cell_bbs: Sequence[BoundingBox],
+    cell_bbs_expanded: Sequence[BoundingBox],
+    n_chunks: int,
+) -> list[tuple[list[BoundingBox], list[BoundingBox]]]:
+    chunks: list[tuple[list[BoundingBox], list[BoundingBox]]] = [([], []) for _ in range(min(n_chunks, len(cell_bbs)))]
+    chunks_area = [0.0] * len(chunks)
+
+    def area(bb: BoundingBox) -> float:
+        return (bb.maxlat - bb.minlat) * (bb.maxlon - bb.minlon)
+
+    # balance by area, largest boxes first
+    pairs = sorted(zip(cell_bbs, cell_bbs_expanded, strict=True), key=lambda t: area(t[0]), reverse=True)
+
+    for bb, bb_expanded in pairs:
+        i = chunks_area.index(min(chunks_area))
+        chunks[i][0].append(bb)
+        chunks[i][1].append(bb_expanded)
+        chunks_area[i] += area(bb)
+
+    return chunks
+
+
 def get_download_triggers(
     bbc: BoundingBoxCollection,
     cells: Sequence[Cell],
@@ -428,59 +800,128 @@ def get_download_triggers(
     return dict(result)
 
 
+# elements of the previous query, for merging further downloads of the same session
+class _MergeState(NamedTuple):
+    key: tuple[int, str, tuple[tuple[Cell, ...], ...]]  # relation_id, route_type, history
+    elements_split: bytes  # serialized before any processing, elements are modified in-place later on
+    ways: dict[ElementId, FetchRelationElement]
+
+
 # TODO: check data freshness
+def _is_retryable(e: BaseException) -> bool:
+    # rate limit and server errors, don't retry timeouts and bad queries
+    return isinstance(e, HTTPStatusError) and (
+        e.response.status_code == status.HTTP_429_TOO_MANY_REQUESTS or e.response.is_server_error
+    )
+
+
 class Overpass:
     def __init__(self):
-        pass
+        self._query_semaphore = asyncio.Semaphore(OVERPASS_MAX_CONCURRENT_QUERIES)
+        self._merge_states: TTLCache[str, _MergeState] = TTLCache(maxsize=32, ttl=1800)
 
-    @cached(TTLCache(maxsize=1024, ttl=7200))  # 2 hours
-    async def _query_relation_history_post(
+    @cached_property
+    def _cell_cache(self) -> CellCache:
+        return CellCache(OVERPASS_CELL_CACHE_PATH, OVERPASS_CELL_CACHE_TTL)
+
+    # data access primitives, overridden by alternative backends (see osm_extract.py)
+
+    async def _query_relation_ways_bounds(self, relation_id: int) -> list[dict]:
+        timeout = 60
+        query = build_bb_query(relation_id, timeout)
+        r = await HTTP.post(OVERPASS_API_INTERPRETER, data={'data': query}, timeout=timeout * 2)
+        r.raise_for_status()
+        return (await offload(orjson.loads, r.content, size=len(r.content)))['elements']
+
+    async def _query_bbs(
         self,
-        session: str,  # cache busting  # noqa: ARG002
-        query: str,
-        http_timeout: float,
+        cell_bbs: Sequence[BoundingBox],
+        cell_bbs_expanded: Sequence[BoundingBox],
+        route_type: str,
     ) -> list[list[dict]]:
-        r = await HTTP.post(OVERPASS_API_INTERPRETER, data={'data': query}, timeout=http_timeout * 2)
-        r.raise_for_status()
-        elements: list[dict] = r.json()['elements']
+        timeout = 180
+        query = build_query(cell_bbs, cell_bbs_expanded, timeout, route_type)
+        return await self._query_cells_post(query, timeout)
+
+    async def _query_parents_elements(
+        self, way_ids_set: frozenset[int]
+    ) -> tuple[Sequence[OsmRelation], Sequence[OsmWay]]:
+        timeout = 60
+        query = build_parents_query(way_ids_set, timeout)
+        parser = OsmXmlParser()
+
+        # parse while downloading
+        async with HTTP.stream('POST', OVERPASS_API_INTERPRETER, data={'data': query}, timeout=timeout * 2) as r:
+            r.raise_for_status()
+            async for chunk in r.aiter_bytes():
+                await offload(parser.feed, chunk, size=len(chunk))
+
+        parser.close()
+        return parser.relations, parser.ways
+
+    @retry(
+        retry=retry_if_exception(_is_retryable),
+        wait=wait_exponential(),
+        stop=stop_after_attempt(3),
+        reraise=True,
+    )
+    async def _query_cells_post(self, query: str, http_timeout: float) -> list[list[dict]]:
+        async with self._query_semaphore:
+            r = await HTTP.post(OVERPASS_API_INTERPRETER, data={'data': query}, timeout=http_timeout * 2)
+            r.raise_for_status()
+        elements: list[dict] = (await offload(orjson.loads, r.content, size=len(r.content)))['elements']
         return split_by_count(elements)
 
-    async def _query_relation_history(
+    async def _query_cells(
         self,
         relation_id: int,
-        download_hist: DownloadHistory,
+        cells: Sequence[Cell],
         route_type: str,
-    ) -> tuple[list[list[dict]], BoundingBoxCollection]:
-        if not download_hist.history or not all(download_hist.history):
-            raise ValueError('No grid cells to download')
-
-        all_elements_split = None
-        all_bbs = []
+        optional_cells: Collection[Cell] = (),
+    ) -> dict[Cell, list[list[dict]]]:
+        rects = plan_cells_rects(cells, optional_cells)
+        covered_cells = tuple(
+            dict.fromkeys(Cell(x, y) for x0, y0, x1, y1 in rects for x in range(x0, x1 + 1) for y in range(y0, y1 + 1))
+        )
+        cell_bbs = tuple(BoundingBox.from_grid_cell(*r) for r in rects)
+        cell_bbs_expand = tuple(bb.extend(unit_degrees=DOWNLOAD_RELATION_GRID_CELL_EXPAND) for bb in cell_bbs)
+        chunks = split_bbs_into_chunks(cell_bbs, cell_bbs_expand, OVERPASS_QUERY_CHUNKS)
 
-        for cells in download_hist.history:
-            hor_bbs_t = optimize_cells_and_get_bbs(cells, start_horizontal=True)
-            ver_bbs_t = optimize_cells_and_get_bbs(cells, start_horizontal=False)
+        print(
+            f'[OVERPASS] Downloading {len(cells)} cells (+{len(covered_cells) - len(cells)} cached) '
+            f'as {len(cell_bbs)} boxes in {len(chunks)} chunks for relation {relation_id}'
+        )
 
-            # pick more optimal cells
-            cell_bbs_t = hor_bbs_t if len(hor_bbs_t) <= len(ver_bbs_t) else ver_bbs_t
-            cell_bbs, cell_bbs_expand = cell_bbs_t
-            all_bbs.extend(cell_bbs)
+        async with asyncio.TaskGroup() as tg:
+            tasks = [
+                tg.create_task(self._query_bbs(chunk_bbs, chunk_bbs_expand, route_type))
+                for chunk_bbs, chunk_bbs_expand in chunks
+            ]
 
-            print(f'[OVERPASS] Downloading {len(cell_bbs)} cells for relation {relation_id}')
+        elements_split = merge_elements_splits(task.result() for task in tasks)
+        # cached cells spanned by the boxes are refreshed as well
+        return split_elements_by_cell(elements_split, covered_cells)
 
-            timeout = 180
-            query = build_query(cell_bbs, cell_bbs_expand, timeout, route_type)
-            elements_split = await self._query_relation_history_post(download_hist.session, query, timeout)
+    async def _query_cells_cached(
+        self,
+        relation_id: int,
+        cells: Sequence[Cell],
+        route_type: str,
+        max_age: float | None,
+    ) -> list[list[dict]]:
+        cells_splits = await asyncio.to_thread(self._cell_cache.get_many, route_type, cells, max_age)
 
-            if all_elements_split is None:
-                all_elements_split = elements_split
-            else:
-                for i, elements in enumerate(elements_split):
-                    all_elements_split[i].extend(elements)
+        if missing_cells := tuple(cell for cell in cells if cell not in cells_splits):
+            new_cells_splits = await self._query_cells(relation_id, missing_cells, route_type, cells_splits.keys())
+            # store before any processing, elements are modified in-place later on
+            await asyncio.to_thread(self._cell_cache.put_many, route_type, new_cells_splits)
+            cells_splits.update(new_cells_splits)
+        else:
+            new_cells_splits = {}
 
-        bbc = BoundingBoxCollection(all_bbs)
+        print(f'[OVERPASS] Using {len(cells) - len(new_cells_splits)} cached cells for relation {relation_id}')
 
-        return all_elements_split, bbc
+        return merge_elements_splits(cells_splits[cell] for cell in cells)
 
     @cached(TTLCache(maxsize=128, ttl=60))
     async def query_relation(
@@ -489,21 +930,18 @@ class Overpass:
         download_hist: DownloadHistory | None,
         download_targets: Sequence[Cell] | None,
         route_type: str,  # bus, tram...
+        max_age: float | None = None,  # cell cache, None for default
     ) -> tuple[
         BoundingBox,
         DownloadHistory,
         dict[ElementId, tuple[Cell, ...]],
         dict[ElementId, FetchRelationElement],
+        dict[ElementId, FetchRelationElement] | None,
         dict[int, list[ElementId]],
         list[FetchRelationBusStopCollection],
     ]:
         if download_targets is None:
-            timeout = 60
-            query = build_bb_query(relation_id, timeout)
-            r = await HTTP.post(OVERPASS_API_INTERPRETER, data={'data': query}, timeout=timeout * 2)
-            r.raise_for_status()
-
-            elements: list[dict] = r.json()['elements']
+            elements = await self._query_relation_ways_bounds(relation_id)
             if not elements:
                 raise HTTPException(status.HTTP_400_BAD_REQUEST, 'Relation is empty, which is not supported')
 
@@ -531,15 +969,40 @@ class Overpass:
 
         if download_hist is None:
             download_hist = DownloadHistory(session=DownloadHistory.make_session(), history=(union_grid_cells,))
-        elif union_grid_cells:
-            download_hist = replace(download_hist, history=(*download_hist.history, union_grid_cells))
+            merge_state = None
+        else:
+            merge_state = self._merge_states.get(download_hist.session)
+            if merge_state is not None and merge_state.key != (relation_id, route_type, download_hist.history):
+                merge_state = None
 
-        elements_split, bbc = await self._query_relation_history(relation_id, download_hist, route_type)
+            if union_grid_cells:
+                download_hist = replace(download_hist, history=(*download_hist.history, union_grid_cells))
+
+        if not download_hist.history or not all(download_hist.history):
+            raise ValueError('No grid cells to download')
+
+        cells = tuple(dict.fromkeys(chain.from_iterable(download_hist.history)))
+
+        if merge_state is not None:
+            # only download the new cells, the rest is already known
+            known_cells = frozenset(chain.from_iterable(merge_state.key[2]))
+            elements_split = await offload(
+                orjson.loads, merge_state.elements_split, size=len(merge_state.elements_split)
+            )
+            if new_cells := tuple(cell for cell in cells if cell not in known_cells):
+                new_elements_split = await self._query_cells_cached(relation_id, new_cells, route_type, max_age)
+                elements_split = merge_elements_splits((elements_split, new_elements_split))
+            prev_ways = merge_state.ways
+        else:
+            elements_split = await self._query_cells_cached(relation_id, cells, route_type, max_age)
+            prev_ways = None
+
+        elements_split_json = await offload(orjson.dumps, elements_split)
+        bbc = BoundingBoxCollection(optimize_cells_and_get_bbs(cells)[0])
 
         maybe_road_elements = elements_split[0]
         maybe_road_elements = preprocess_elements(maybe_road_elements)
-        node_elements = elements_split[1]
-        node_elements = preprocess_elements(node_elements)
+        node_coords = NodeCoords.from_elements(elements_split[1])
         turn_in_place_elements = elements_split[2]
         turn_in_place_elements = preprocess_elements(turn_in_place_elements)
 
@@ -564,7 +1027,6 @@ class Overpass:
 
         road_elements = tuple(e for e in maybe_road_elements if is_routable(e['tags'], route_type))
 
-        nodes_map = {e['id']: e for e in node_elements}
         turn_in_place_nodes = {e['id'] for e in turn_in_place_elements}
 
         for e in road_elements:
@@ -572,21 +1034,27 @@ class Overpass:
             e['_oneway'] = is_oneway(e['tags'])
             e['_roundabout'] = is_roundabout(e['tags'])
 
-        road_elements, connected_ways_map, id_map = organize_ways(road_elements, turn_in_place_nodes)
+        with stage_time('organize_ways'):
+            split_ways, connected_ways_map, id_map = organize_ways(road_elements, turn_in_place_nodes)
+            ways_latLngs, ways_length, ways_midpoint = lookup_ways_geometry(
+                tuple(w.nodes for w in split_ways), node_coords
+            )
 
         ways = {
-            e['id']: FetchRelationElement(
-                id=e['id'],
-                member=e['_member'],
-                oneway=e['_oneway'],
-                roundabout=e['_roundabout'],
-                nodes=e['nodes'],
-                latLngs=[(nodes_map[n_id]['lat'], nodes_map[n_id]['lon']) for n_id in e['nodes']],
-                connectedTo=list(connected_ways_map[e['id']]),
-                turn_in_place_start=e['_turn_in_place_start'],
-                turn_in_place_end=e['_turn_in_place_end'],
+            w.id: FetchRelationElement(
+                id=w.id,
+                member=w.way['_member'],
+                oneway=w.way['_oneway'],
+                roundabout=w.way['_roundabout'],
+                nodes=w.nodes,
+                latLngs=latLngs,
+                connectedTo=list(connected_ways_map[w.id]),
+                turn_in_place_start=w.turn_in_place_start,
+                turn_in_place_end=w.turn_in_place_end,
+                length=length,
+                midpoint=midpoint,
             )
-            for e in road_elements
+            for w, latLngs, length, midpoint in zip(split_ways, ways_latLngs, ways_length, ways_midpoint, strict=True)
         }
 
         elements_ex = chain(stop_area_platform_elements, stop_area_stop_position_elements, bus_elements)
@@ -596,48 +1064,40 @@ class Overpass:
         elif route_type == 'tram':
             elements_ex = (e for e in elements_ex if is_tram_element(e['tags']))
 
-        stops = tuple(FetchRelationBusStop.from_data(e) for e in elements_ex)
-        bus_stop_collections = build_bus_stop_collections(stops)
-        bus_stop_collections = tuple(c for c in bus_stop_collections if bbc.contains(c.best.latLng))
+        with stage_time('bus_stop_collections'):
+            stops = tuple(FetchRelationBusStop.from_data(e) for e in elements_ex)
+            bus_stop_collections = build_bus_stop_collections(stops)
+            bus_stop_collections = tuple(c for c in bus_stop_collections if bbc.contains(c.best.latLng))
 
         global_bb = BoundingBox(*bbc.idx.bounds)
         download_triggers = get_download_triggers(bbc, union_grid_cells, ways)
 
-        return global_bb, download_hist, download_triggers, ways, id_map, bus_stop_collections
+        self._merge_states[download_hist.session] = _MergeState(
+            key=(relation_id, route_type, download_hist.history),
+            elements_split=elements_split_json,
+            ways=ways,
+        )
+
+        return global_bb, download_hist, download_triggers, ways, prev_ways, id_map, bus_stop_collections
 
     @cached(TTLCache(maxsize=128, ttl=60))
     async def query_parents(self, way_ids_set: frozenset[int]) -> QueryParentsResult:
-        timeout = 60
-        query = build_parents_query(way_ids_set, timeout)
-        r = await HTTP.post(OVERPASS_API_INTERPRETER, data={'data': query}, timeout=timeout * 2)
-        r.raise_for_status()
-
-        data: dict[str, list[dict]] = xmltodict.parse(
-            r.text,
-            postprocessor=postprocessor,
-            force_list=('relation', 'way', 'member', 'tag', 'nd'),
-        )['osm']
-
-        relations = data.get('relation', [])
+        relations, ways = await self._query_parents_elements(way_ids_set)
         id_relations_map = defaultdict(list)
 
         for relation in relations:
-            members = relation['member'] = relation.get('member', [])
-            # tags = relation['tag'] = relation.get('tag', [])
-
-            if len(members) <= 1:
+            if len(relation.members) <= 1:
                 continue
 
-            for member in members:
-                if member['@type'] == 'way' and member['@ref'] in way_ids_set:
-                    id_relations_map[member['@ref']].append(relation)
+            for member in relation.members:
+                if member.type == 'way' and member.ref in way_ids_set:
+                    id_relations_map[member.ref].append(relation)
 
         # unique relations
         for way_id, relations in id_relations_map.items():
-            id_relations_map[way_id] = list({r['@id']: r for r in relations}.values())
+            id_relations_map[way_id] = list({r.id: r for r in relations}.values())
 
-        ways = data.get('way', [])
-        ways_map = {w['@id']: w for w in ways}
+        ways_map = {w.id: w for w in ways}
 
         return QueryParentsResult(
             id_relations_map=id_relations_map,
@@ -0,0 +1,162 @@
+import struct
+from collections.abc import Sequence
+from dataclasses import replace
+from itertools import chain
+
+import numpy as np
+import orjson
+
+from models.fetch_relation import FetchRelation, FetchRelationElement
+from models.final_route import FinalRoute
+
+# compact binary alternative to the json responses, decoded by static/js/packed.js
+#
+# layout: magic, u32 header length, header json, then sections of u32 length + varints
+# the header holds the interned strings and the payload, with large collections
+# replaced by {"$<kind>": section index} markers
+PACKED_MEDIA_TYPE = 'application/vnd.relatify.packed'
+PACKED_MAGIC = b'RLP1'
+
+_COORD_SCALE = 10_000_000  # osm coordinate precision
+_LENGTH_SCALE = 1000  # millimetres
+
+_FLAG_MEMBER = 1 << 0
+_FLAG_ONEWAY = 1 << 1
+_FLAG_ROUNDABOUT = 1 << 2
+_FLAG_TURN_IN_PLACE_START = 1 << 3
+_FLAG_TURN_IN_PLACE_END = 1 << 4
+_FLAG_REVERSED_LATLNGS = 1 << 5
+
+
+def _zigzag(values: np.ndarray) -> np.ndarray:
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def _delta(values: np.ndarray) -> np.ndarray:
+    return np.diff(values, prepend=values[:1] * 0)
+
+
+def _fixed(values: np.ndarray, scale: int) -> np.ndarray:
+    return np.rint(values * scale).astype(np.int64)
+
+
+def _encode_varints(values: np.ndarray) -> bytes:
+    values = values.astype(np.uint64)
+    sizes = np.ones(len(values), np.intp)
+
+    for shift in range(7, 64, 7):
+        sizes += values >= np.uint64(1 << shift)
+
+    offsets = np.cumsum(sizes) - sizes
+    result = np.empty(sizes.sum(), np.uint8)
+
+    for i in range(sizes.max(initial=0)):
+        mask = sizes > i
+        byte = (values[mask] >> np.uint64(7 * i)) & np.uint64(0x7F)
+        more = (sizes[mask] > i + 1).astype(np.uint64) << np.uint64(7)
+        result[offsets[mask] + i] = byte | more
+
+    return result.tobytes()
+
+
+class _Packer:
+    def __init__(self):
+        self._strings: dict[str, int] = {}
+        self._sections: list[bytes] = []
+
+    def _intern(self, value: str) -> int:
+        return self._strings.setdefault(value, len(self._strings))
+
+    def _add_section(self, columns: Sequence[np.ndarray]) -> int:
+        self._sections.append(_encode_varints(np.concatenate([c.astype(np.uint64) for c in columns])))
+        return len(self._sections) - 1
+
+    def add_ways(self, ways: Sequence[FetchRelationElement], reversed_latLngs: Sequence[bool] = ()) -> int:
+        intern = self._intern
+        reversed_latLngs = reversed_latLngs or (False,) * len(ways)
+
+        ids = np.fromiter((intern(w.id) for w in ways), np.int64, len(ways))
+        flags = np.fromiter(
+            (
+                (_FLAG_MEMBER if w.member else 0)
+                | (_FLAG_ONEWAY if w.oneway else 0)
+                | (_FLAG_ROUNDABOUT if w.roundabout else 0)
+                | (_FLAG_TURN_IN_PLACE_START if w.turn_in_place_start else 0)
+                | (_FLAG_TURN_IN_PLACE_END if w.turn_in_place_end else 0)
+                | (_FLAG_REVERSED_LATLNGS if r else 0)
+                for w, r in zip(ways, reversed_latLngs, strict=True)
+            ),
+            np.int64,
+            len(ways),
+        )
+        nodes_counts = np.fromiter((len(w.nodes) for w in ways), np.int64, len(ways))
+        connected_counts = np.fromiter((len(w.connectedTo) for w in ways), np.int64, len(ways))
+        connected = np.fromiter((intern(c) for w in ways for c in w.connectedTo), np.int64, connected_counts.sum())
+        nodes = np.fromiter(chain.from_iterable(w.nodes for w in ways), np.int64, nodes_counts.sum())
+        latLngs = np.fromiter(
+            chain.from_iterable(chain.from_iterable(w.latLngs for w in ways)), np.float64, nodes_counts.sum() * 2
+        ).reshape(-1, 2)
+        lengths = np.fromiter((w.length for w in ways), np.float64, len(ways))
+        midpoints = np.fromiter(chain.from_iterable(w.midpoint for w in ways), np.float64, len(ways) * 2).reshape(-1, 2)
+
+        return self._add_section(
+            (
+                np.array((len(ways),)),
+                ids,
+                flags,
+                nodes_counts,
+                connected_counts,
+                connected,
+                _zigzag(_delta(nodes)),
+                _zigzag(_delta(_fixed(latLngs[:, 0], _COORD_SCALE))),
+                _zigzag(_delta(_fixed(latLngs[:, 1], _COORD_SCALE))),
+                _fixed(lengths, _LENGTH_SCALE),
+                _zigzag(_fixed(midpoints[:, 0], _COORD_SCALE)),
+                _zigzag(_fixed(midpoints[:, 1], _COORD_SCALE)),
+            )
+        )
+
+    def add_latLngs(self, latLngs: Sequence[tuple[float, float]]) -> int:
+        coords = np.array(latLngs, np.float64).reshape(-1, 2)
+        return self._add_section(
+            (
+                np.array((len(coords),)),
+                _zigzag(_delta(_fixed(coords[:, 0], _COORD_SCALE))),
+                _zigzag(_delta(_fixed(coords[:, 1], _COORD_SCALE))),
+            )
+        )
+
+    def finish(self, data: object) -> bytes:
+        header = orjson.dumps({'strings': tuple(self._strings), 'data': data}, option=orjson.OPT_STRICT_INTEGER)
+        parts = [PACKED_MAGIC, struct.pack('<I', len(header)), header]
+
+        for section in self._sections:
+            parts.append(struct.pack('<I', len(section)))
+            parts.append(section)
+
+        return b''.join(parts)
+
+
+def pack_fetch_relation(fetch_relation: FetchRelation) -> bytes:
+    packer = _Packer()
+    ways = packer.add_ways(tuple(fetch_relation.ways.values()))
+    return packer.finish(replace(fetch_relation, ways={'$waysById': ways}))
+
+
+def pack_final_route(route: FinalRoute) -> bytes:
+    packer = _Packer()
+    ways = packer.add_ways(
+        tuple(w.way for w in route.ways),
+        tuple(w.reversed_latLngs for w in route.ways),
+    )
+    latLngs = packer.add_latLngs(route.latLngs)
+    extra_ways = packer.add_ways(route.extraWaysToUpdate) if route.extraWaysToUpdate is not None else None
+    return packer.finish(
+        replace(
+            route,
+            ways={'$routeWays': ways},
+            latLngs={'$latLngs': latLngs},
+            extraWaysToUpdate={'$ways': extra_ways} if extra_ways is not None else None,
+        )
+    )
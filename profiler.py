@@ -0,0 +1,284 @@
+import asyncio
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from types import CodeType, FrameType
+from typing import Literal
+
+import orjson
+
+from config import PROFILE_PATH, PROFILE_SAMPLE_INTERVAL
+
+ProfileTarget = Literal['query', 'route']
+
+# (target, relation id): profiles left to take
+_TRIGGERS: dict[tuple[ProfileTarget, int], int] = {}
+
+_ACTIVE: ContextVar['Profile | None'] = ContextVar('profile', default=None)
+_ACTIVE_COUNT = 0
+_SAMPLER: '_LoopSampler | None' = None
+
+# stacks from the root, with the time spent in the last frame in nanoseconds
+Samples = Counter[tuple[str, ...]]
+
+
+def arm(target: ProfileTarget, relation_id: int, count: int) -> None:
+    """
+    Profile the next count calls of target for relation_id, or stop profiling it if count is 0.
+    """
+    if count > 0:
+        _TRIGGERS[target, relation_id] = count
+    else:
+        _TRIGGERS.pop((target, relation_id), None)
+
+
+def armed() -> list[dict]:
+    return [
+        {'target': target, 'relationId': relation_id, 'count': count}
+        for (target, relation_id), count in _TRIGGERS.items()
+    ]
+
+
+def _label(frame: FrameType, event: str, arg) -> str:
+    if event == 'call':
+        code = frame.f_code
+        return f'{code.co_qualname} ({Path(code.co_filename).name}:{code.co_firstlineno})'
+    return getattr(arg, '__qualname__', repr(arg))
+
+
+class _Tracer:
+    """
+    Follow the calls of one thread, attributing the time between the events to the current stack.
+
+    Unlike sampling, it also sees inside the Cython modules, which are compiled with profiling hooks.
+    The hook slows down every call of the thread severalfold, it is only installed in the offloaded threads
+    and worker processes of a profiled request, never on the event loop.
+    """
+
+    __slots__ = ('_labels', '_last', '_nodes', '_parents', '_stack', '_times')
+
+    def __init__(self):
+        self._labels: dict[object, str] = {}
+        self._nodes: dict[tuple[int, str], int] = {}  # (parent node, label) -> node
+        self._parents: list[tuple[int, str]] = []  # node -> (parent node, label)
+        self._times: list[int] = []  # node -> nanoseconds
+        self._stack: list[int] = []
+        self._last = 0
+
+    def __call__(self, frame: FrameType, event: str, arg) -> None:
+        now = time.perf_counter_ns()
+        stack = self._stack
+
+        # with an empty stack, the task is suspended and the time belongs to others
+        if stack:
+            self._times[stack[-1]] += now - self._last
+
+        if event in ('call', 'c_call'):
+            key = frame.f_code if event == 'call' else arg
+            if (label := self._labels.get(key)) is None:
+                label = self._labels[key] = _label(frame, event, arg)
+
+            parent = stack[-1] if stack else -1
+            if (node := self._nodes.get((parent, label))) is None:
+                node = self._nodes[parent, label] = len(self._parents)
+                self._parents.append((parent, label))
+                self._times.append(0)
+
+            stack.append(node)
+
+        # calls made before the tracer was installed are not on the stack
+        elif stack:
+            stack.pop()
+
+        self._last = time.perf_counter_ns()
+
+    def samples(self) -> Samples:
+        result: Samples = Counter()
+        paths: list[tuple[str, ...]] = []
+
+        # parents are always created before their children
+        for (parent, label), elapsed in zip(self._parents, self._times, strict=True):
+            path = (*paths[parent], label) if parent >= 0 else (label,)
+            paths.append(path)
+            if elapsed:
+                result[path] += elapsed
+
+        return result
+
+
+def trace[T](func: Callable[..., T], /, *args, **kwargs) -> tuple[T, Samples]:
+    """
+    Call func with the calls of the current thread traced.
+    """
+    tracer = _Tracer()
+    sys.setprofile(tracer)
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        sys.setprofile(None)
+    return result, tracer.samples()
+
+
+class _LoopSampler:
+    """
+    Sample the stack of the event loop thread from a timer thread, while its current task belongs to a profile.
+
+    Requests that are not profiled run at full speed, the cost is a stack walk per interval.
+    Time spent in Cython code is attributed to its Python caller.
+    """
+
+    __slots__ = ('_labels', '_loop', '_stop', '_thread_id')
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._thread_id = threading.get_ident()
+        self._labels: dict[CodeType, str] = {}
+        self._stop = threading.Event()
+        threading.Thread(target=self._run, name='profiler', daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _stack(self, frame: FrameType | None) -> tuple[str, ...]:
+        labels = []
+
+        while frame is not None:
+            code = frame.f_code
+            if (label := self._labels.get(code)) is None:
+                label = self._labels[code] = _label(frame, 'call', None)
+            labels.append(label)
+            frame = frame.f_back
+
+        return tuple(reversed(labels))
+
+    def _run(self) -> None:
+        last = time.perf_counter_ns()
+
+        while not self._stop.wait(PROFILE_SAMPLE_INTERVAL):
+            now = time.perf_counter_ns()
+            elapsed, last = now - last, now
+
+            # the task's context tells which profile (if any) the running code belongs to
+            task = asyncio.current_task(self._loop)
+            if task is None or (profile := task.get_context().get(_ACTIVE)) is None:
+                continue
+
+            frame = sys._current_frames().get(self._thread_id)  # noqa: SLF001
+            profile.add_sample(self._stack(frame), elapsed)
+
+
+class Profile:
+    def __init__(self, target: ProfileTarget, relation_id: int):
+        self.target = target
+        self.relation_id = relation_id
+        self._samples: Samples = Counter()
+        self._lock = threading.Lock()
+
+    def add_sample(self, stack: tuple[str, ...], elapsed: int) -> None:
+        with self._lock:
+            self._samples[stack] += elapsed
+
+    def add(self, samples: Samples, root: str) -> None:
+        """
+        Add the samples collected in another thread or process, under the root frame.
+        """
+        with self._lock:
+            for path, elapsed in samples.items():
+                self._samples[root, *path] += elapsed
+
+    def trace_thread[T](self, func: Callable[..., T], /, *args, **kwargs) -> T:
+        result, samples = trace(func, *args, **kwargs)
+        self.add(samples, f'[thread] {threading.current_thread().name}')
+        return result
+
+    def save(self) -> Path:
+        with self._lock:
+            samples = self._samples.copy()
+
+        path = Path(PROFILE_PATH)
+        path.mkdir(parents=True, exist_ok=True)
+        name = f'{self.target}-{self.relation_id}-{time.time_ns()}'
+
+        # flamegraph.pl and speedscope both read the collapsed stacks, in microseconds
+        (path / f'{name}.collapsed').write_text(
+            ''.join(f'{";".join(stack)} {elapsed // 1000}\n' for stack, elapsed in samples.items() if elapsed >= 1000)
+        )
+
+        frames: dict[str, int] = {}
+        speedscope_samples = [[frames.setdefault(label, len(frames)) for label in stack] for stack in samples]
+        weights = [elapsed / 1000 for elapsed in samples.values()]
+        (path / f'{name}.speedscope.json').write_bytes(
+            orjson.dumps(
+                {
+                    '$schema': 'https://www.speedscope.app/file-format-schema.json',
+                    'name': name,
+                    'exporter': 'osm-relatify',
+                    'shared': {'frames': [{'name': label} for label in frames]},
+                    'profiles': [
+                        {
+                            'type': 'sampled',
+                            'name': name,
+                            'unit': 'microseconds',
+                            'startValue': 0,
+                            'endValue': sum(weights),
+                            'samples': speedscope_samples,
+                            'weights': weights,
+                        }
+                    ],
+                }
+            )
+        )
+
+        return path / name
+
+
+def current_profile() -> Profile | None:
+    return _ACTIVE.get()
+
+
+def _claim(target: ProfileTarget, relation_id: int) -> bool:
+    key = (target, relation_id)
+    if (count := _TRIGGERS.get(key)) is None:
+        return False
+
+    if count > 1:
+        _TRIGGERS[key] = count - 1
+    else:
+        del _TRIGGERS[key]
+
+    return True
+
+
+@asynccontextmanager
+async def profile_relation(target: ProfileTarget, relation_id: int) -> AsyncIterator[None]:
+    """
+    Profile the body if a trigger is armed for the relation, including the offloaded work and the worker processes.
+    """
+    global _ACTIVE_COUNT, _SAMPLER
+
+    if not _TRIGGERS or not _claim(target, relation_id):
+        yield
+        return
+
+    profile = Profile(target, relation_id)
+    token = _ACTIVE.set(profile)
+    _ACTIVE_COUNT += 1
+    if _ACTIVE_COUNT == 1:
+        _SAMPLER = _LoopSampler(asyncio.get_running_loop())
+
+    try:
+        yield
+    finally:
+        _ACTIVE_COUNT -= 1
+        if _ACTIVE_COUNT == 0:
+            _SAMPLER.stop()
+            _SAMPLER = None
+        _ACTIVE.reset(token)
+
+        path = await asyncio.to_thread(profile.save)
+        print(f'[🔬] Profiled {target} of relation {relation_id}: {path}')
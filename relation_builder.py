@@ -1,22 +1,23 @@
 import asyncio
 from collections import defaultdict
-from collections.abc import Collection, Iterable, Sequence
+from collections.abc import Iterable, Sequence
 from dataclasses import replace
 from itertools import chain, cycle, islice, zip_longest
 from typing import NamedTuple
 
-import xmltodict
 from fastapi import HTTPException
 from sklearn.neighbors import BallTree
 from starlette import status
 
-from config import CHANGESET_ID_PLACEHOLDER, CREATED_BY
+from config import CHANGESET_ID_PLACEHOLDER
 from cython_lib.geoutils import haversine_distance, radians_tuple
 from models.element_id import ElementId, element_id, split_element_id
 from models.fetch_relation import FetchRelationBusStopCollection, FetchRelationElement
 from models.final_route import FinalRoute
 from models.relation_member import RelationMember
+from offload import offload
 from openstreetmap import OpenStreetMap
+from osm_xml import OsmMember, OsmRelation, OsmWay, iter_osm_change
 from overpass import Overpass, QueryParentsResult
 
 
@@ -247,25 +248,27 @@ def sort_and_upgrade_members(route: FinalRoute, relation_members: list[RelationM
     return replace(route, members=tuple(members))
 
 
-def _initialize_osm_change_structure() -> dict:
-    return {
-        'osmChange': {
-            '@version': 0.6,
-            '@generator': CREATED_BY,
-            'create': {'way': []},
-            'modify': {'way': [], 'relation': []},
+# TODO: support restriction-type relations
+async def _current_parents(
+    osm: OpenStreetMap, parents: QueryParentsResult, *, ignore_relation_id: int, fresh: bool
+) -> QueryParentsResult:
+    # the parents may come from a lagging backend or a local extract, the change must apply to their current versions
+    relation_ids = {r.id for relations in parents.id_relations_map.values() for r in relations}
+    relation_ids.discard(ignore_relation_id)
+    current = {r.id: r for r in await osm.get_relations_xml(relation_ids, fresh=fresh)}
+
+    return parents._replace(
+        id_relations_map={
+            way_id: [
+                current[r.id]
+                for r in relations
+                if r.id in current and any(m.type == 'way' and m.ref == way_id for m in current[r.id].members)
+            ]
+            for way_id, relations in parents.id_relations_map.items()
         }
-    }
-
-
-def _set_changeset_placeholder(data: dict, include_changeset_id: bool) -> None:
-    if include_changeset_id:
-        data['@changeset'] = CHANGESET_ID_PLACEHOLDER
-    else:
-        data.pop('@changeset', None)
+    )
 
 
-# TODO: support restriction-type relations
 def _update_relations_after_split(
     ignore_relation_id: int,
     split_ways: frozenset[int],
@@ -274,60 +277,53 @@ def _update_relations_after_split(
     id_way_map: dict[ElementId, FetchRelationElement],
     element_id_unique_map: dict[ElementId, int],
     unique_native_id_map: dict[int, int],
-) -> Collection[dict]:
-    result: dict[int, dict] = {}
+) -> list[OsmRelation]:
+    # the parents are shared with the query cache, the members are updated in copies
+    result: dict[int, tuple[OsmRelation, list[OsmMember]]] = {}
 
     # iterate over the split ways
     for way_id in split_ways:
         element_ids = native_id_element_ids_map[way_id]
 
         # assert unique relations
-        assert len(parents.id_relations_map[way_id]) == len({r['@id'] for r in parents.id_relations_map[way_id]})
+        assert len(parents.id_relations_map[way_id]) == len({r.id for r in parents.id_relations_map[way_id]})
 
         # iterate over each related relation
         for relation in parents.id_relations_map[way_id]:
-            if relation['@id'] == ignore_relation_id:
+            if relation.id == ignore_relation_id:
                 continue
 
-            result[relation['@id']] = relation
+            if relation.id not in result:
+                result[relation.id] = (relation, list(relation.members))
+            members = result[relation.id][1]
 
             member_index = 0
-            while member_index < len(relation['member']):
-                member = relation['member'][member_index]
+            while member_index < len(members):
+                member = members[member_index]
 
-                if not (member['@ref'] == way_id and member['@type'] == 'way'):
+                if not (member.ref == way_id and member.type == 'way'):
                     member_index += 1
                     continue
 
-                way_role = relation['member'][member_index]['@role']
+                way_role = member.role
 
                 split_ways_in_order = sorted(element_ids.items(), key=lambda x: x[0])
                 first_way_nd = id_way_map[split_ways_in_order[0][1]].nodes[0]
                 last_way_nd = id_way_map[split_ways_in_order[-1][1]].nodes[-1]
                 is_reversed = False
 
-                if (
-                    member_index > 0
-                    and (before_entry := relation['member'][member_index - 1])
-                    and before_entry['@type'] == 'way'
-                ):
-                    before_way_id = before_entry['@ref']
-                    before_way_id = unique_native_id_map.get(before_way_id, before_way_id)
+                if member_index > 0 and (before_entry := members[member_index - 1]).type == 'way':
+                    before_way_id = unique_native_id_map.get(before_entry.ref, before_entry.ref)
                     before_way = parents.ways_map.get(before_way_id)
-                    if before_way and not before_way.get('nd'):
+                    if before_way is not None and not before_way.nodes:
                         before_way = None
                 else:
                     before_way = None
 
-                if (
-                    member_index + 1 < len(relation['member'])
-                    and (after_entry := relation['member'][member_index + 1])
-                    and after_entry['@type'] == 'way'
-                ):
-                    after_way_id = after_entry['@ref']
-                    after_way_id = unique_native_id_map.get(after_way_id, after_way_id)
+                if member_index + 1 < len(members) and (after_entry := members[member_index + 1]).type == 'way':
+                    after_way_id = unique_native_id_map.get(after_entry.ref, after_entry.ref)
                     after_way = parents.ways_map.get(after_way_id)
-                    if after_way and not after_way.get('nd'):
+                    if after_way is not None and not after_way.nodes:
                         after_way = None
                 else:
                     after_way = None
@@ -336,19 +332,19 @@ def _update_relations_after_split(
                     # reverse is only valid for non-circular ways, e.g. roundabouts
 
                     if before_way is not None:
-                        if any(before_way['nd'][check]['@ref'] == last_way_nd for check in (0, -1)):
+                        if any(before_way.nodes[check] == last_way_nd for check in (0, -1)):
                             split_ways_in_order.reverse()
                             first_way_nd, last_way_nd = last_way_nd, first_way_nd
                             is_reversed = True
 
                     elif after_way is not None:
-                        if any(after_way['nd'][check]['@ref'] == first_way_nd for check in (0, -1)):
+                        if any(after_way.nodes[check] == first_way_nd for check in (0, -1)):
                             split_ways_in_order.reverse()
                             first_way_nd, last_way_nd = last_way_nd, first_way_nd
                             is_reversed = True
 
                 # remove the original way from the relation member list
-                relation['member'].pop(member_index)
+                members.pop(member_index)
 
                 # replace the original way in the relation member list with the split ways
                 safe_to_insert = before_way is None
@@ -364,18 +360,14 @@ def _update_relations_after_split(
 
                     if not safe_to_insert:
                         assert before_way is not None
-                        safe_to_insert = any(before_way['nd'][check]['@ref'] == first_element_nd for check in (0, -1))
+                        safe_to_insert = any(before_way.nodes[check] == first_element_nd for check in (0, -1))
 
                     if not safe_to_insert:
                         continue
 
-                    relation['member'].insert(
+                    members.insert(
                         member_index,
-                        {
-                            '@type': 'way',
-                            '@ref': element_id_unique_map.get(element_id, element_id),
-                            '@role': way_role,
-                        },
+                        OsmMember(type='way', ref=element_id_unique_map[element_id], role=way_role),
                     )
 
                     member_index += 1
@@ -386,32 +378,32 @@ def _update_relations_after_split(
                         break
 
                     # stop inserting if the next way is the after way
-                    if (after_way is not None) and any(
-                        after_way['nd'][check]['@ref'] == last_element_nd for check in (0, -1)
-                    ):
+                    if (after_way is not None) and any(after_way.nodes[check] == last_element_nd for check in (0, -1)):
                         break
 
                 # fallback to dummy insert if none were inserted
                 if insert_count == 0:
-                    print(f'🚧 Warning: Could not insert split ways into relation {relation["@id"]} (way {way_id})')
+                    print(f'🚧 Warning: Could not insert split ways into relation {relation.id} (way {way_id})')
                     for _, element_id in split_ways_in_order:
-                        relation['member'].insert(
+                        members.insert(
                             member_index,
-                            {
-                                '@type': 'way',
-                                '@ref': element_id_unique_map.get(element_id, element_id),
-                                '@role': way_role,
-                            },
+                            OsmMember(type='way', ref=element_id_unique_map[element_id], role=way_role),
                         )
 
                         member_index += 1
                         insert_count += 1
 
-    return result.values()
+    return [replace(relation, members=tuple(members)) for relation, members in result.values()]
 
 
 async def build_osm_change(
-    relation_id: int, route: FinalRoute, include_changeset_id: bool, overpass: Overpass, osm: OpenStreetMap
+    relation_id: int,
+    route: FinalRoute,
+    include_changeset_id: bool,
+    overpass: Overpass,
+    osm: OpenStreetMap,
+    *,
+    fresh: bool = False,
 ) -> str:
     split_ways_mutable: set[int] = set()
     native_id_element_ids_map: dict[int, dict[int, ElementId]] = defaultdict(dict)
@@ -443,14 +435,14 @@ async def build_osm_change(
             raise AssertionError(f'Split ways are not complete: {", ".join(f"{k}={v}" for k, v in group.items())}')
 
     split_ways = frozenset(split_ways_mutable)
-    relation_task = asyncio.create_task(osm.get_relation(relation_id, json=False))
+    relation_task = asyncio.create_task(osm.get_relation_xml(relation_id, fresh=fresh))
 
-    result = _initialize_osm_change_structure()
+    create: list[OsmWay] = []
+    modify: list[OsmWay | OsmRelation] = []
 
     if split_ways:
         parents_task = asyncio.create_task(overpass.query_parents(split_ways))
-        ways_task = asyncio.create_task(osm.get_ways(map(str, split_ways), json=False))
-        ways = await ways_task
+        ways = await osm.get_ways_xml(split_ways, fresh=fresh)
 
         id_way_map = dict(
             chain(
@@ -460,80 +452,64 @@ async def build_osm_change(
         )
 
         # process fetched ways (split ways)
-        for way_data in ways:
-            way_id = int(way_data['@id'])
-            way_data.pop('@timestamp', None)
-            way_data.pop('@user', None)
-            way_data.pop('@uid', None)
-            _set_changeset_placeholder(way_data, include_changeset_id)
-
+        for way in ways:
             # perform splits
-            for extra_num, element_id in native_id_element_ids_map[way_id].items():
+            for extra_num, element_id in native_id_element_ids_map[way.id].items():
                 element_way = id_way_map[element_id]
-
-                new_data = way_data.copy()
-                new_data['nd'] = [{'@ref': node_id} for node_id in element_way.nodes]
+                nodes = tuple(element_way.nodes)
 
                 if extra_num == 1:
-                    action = 'modify'
-
                     # split conflict check
-                    way_data_nd = way_data.get('nd')
-                    if (
-                        way_data_nd
-                        and int(way_data_nd[0]['@ref']) == new_data['nd'][0]['@ref']
-                        and int(way_data_nd[-1]['@ref']) == new_data['nd'][-1]['@ref']
-                    ):
+                    if way.nodes and way.nodes[0] == nodes[0] and way.nodes[-1] == nodes[-1]:
                         raise HTTPException(
                             status.HTTP_409_CONFLICT,
-                            f'Conflict: Way {way_id} was modified. Go back and click the relation reload button.',
+                            f'Conflict: Way {way.id} was modified. Go back and click the relation reload button.',
                         )
-                else:
-                    action = 'create'
-                    new_data['@id'] = element_id_unique_map[element_id]
-                    new_data.pop('@version', None)
 
-                result['osmChange'][action]['way'].append(new_data)
+                    modify.append(replace(way, nodes=nodes))
+                else:
+                    create.append(replace(way, id=element_id_unique_map[element_id], version=None, nodes=nodes))
 
-        parents: QueryParentsResult = await parents_task
+        parents = await _current_parents(osm, await parents_task, ignore_relation_id=relation_id, fresh=fresh)
 
         # update relations
-        parent_relations = _update_relations_after_split(
-            ignore_relation_id=relation_id,
-            split_ways=split_ways,
-            parents=parents,
-            native_id_element_ids_map=native_id_element_ids_map,
-            id_way_map=id_way_map,
-            element_id_unique_map=element_id_unique_map,
-            unique_native_id_map=unique_native_id_map,
+        modify.extend(
+            _update_relations_after_split(
+                ignore_relation_id=relation_id,
+                split_ways=split_ways,
+                parents=parents,
+                native_id_element_ids_map=native_id_element_ids_map,
+                id_way_map=id_way_map,
+                element_id_unique_map=element_id_unique_map,
+                unique_native_id_map=unique_native_id_map,
+            )
         )
 
-        for parent_relation in parent_relations:
-            # strip unnecessary data
-            parent_relation.pop('@timestamp', None)
-            parent_relation.pop('@user', None)
-            parent_relation.pop('@uid', None)
-
-            # update relation data
-            _set_changeset_placeholder(parent_relation, include_changeset_id)
-
-            result['osmChange']['modify']['relation'].append(parent_relation)
-
-    relation_data = await relation_task
-
-    # strip unnecessary data
-    relation_data.pop('@timestamp', None)
-    relation_data.pop('@user', None)
-    relation_data.pop('@uid', None)
-
-    # update relation data
-    _set_changeset_placeholder(relation_data, include_changeset_id)
+    relation = await relation_task
+    modify.append(
+        replace(
+            relation,
+            members=tuple(
+                OsmMember(
+                    type=member.type,
+                    ref=element_id_unique_map[member.id] if member.id in element_id_unique_map else int(member.id),
+                    role=member.role,
+                )
+                for member in route.members
+            ),
+        )
+    )
 
-    relation_data['member'] = [
-        {'@type': member.type, '@ref': element_id_unique_map.get(member.id, member.id), '@role': member.role}
-        for member in route.members
-    ]
+    return await offload(
+        _join_osm_change,
+        create,
+        modify,
+        changeset=CHANGESET_ID_PLACEHOLDER if include_changeset_id else None,
+        pretty=not include_changeset_id,
+    )
 
-    result['osmChange']['modify']['relation'].append(relation_data)
 
-    return xmltodict.unparse(result, pretty=not include_changeset_id)
+def _join_osm_change(
+    create: list[OsmWay], modify: list[OsmWay | OsmRelation], *, changeset: str | None, pretty: bool
+) -> str:
+    return ''.join(iter_osm_change(create, modify, changeset=changeset, pretty=pretty))
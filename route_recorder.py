@@ -0,0 +1,66 @@
+import time
+from pathlib import Path
+
+import orjson
+
+from config import VERSION
+from cython_lib.route import SearchBudget, SearchStats
+from offload import offload
+
+
+class RouteRecorder:
+    """
+    Keep the requests of slow and timed out route calculations, for replaying them offline.
+
+    The recordings form a ring buffer of at most max_records entries, the oldest are removed first.
+    Each one is a .bin file with the request as received (usable as a route engine benchmark fixture)
+    and a .json file with the engine settings and statistics.
+    """
+
+    def __init__(self, path: str | Path, threshold: float, max_records: int):
+        self._path = Path(path)
+        self._threshold = threshold
+        self._max_records = max_records
+        self._path.mkdir(parents=True, exist_ok=True)
+
+    async def maybe_record(
+        self,
+        request: bytes,
+        relation_id: int,
+        *,
+        budget: SearchBudget,
+        iteration_rate: float,
+        n_processes: int,
+        stats: SearchStats,
+        elapsed: float,
+        timed_out: bool,
+    ) -> None:
+        if not timed_out and elapsed < self._threshold:
+            return
+
+        meta = {
+            'relationId': relation_id,
+            'version': VERSION,
+            'recordedAt': time.time(),
+            'elapsed': elapsed,
+            'timedOut': timed_out,
+            'iterationRate': iteration_rate,
+            'nProcesses': n_processes,
+            'budget': budget._asdict(),
+            'stats': stats,
+        }
+
+        path = await offload(self._write, request, meta)
+        print(f'[📼] Recorded {"timed out" if timed_out else "slow"} route calculation ({relation_id}): {path}')
+
+    def _write(self, request: bytes, meta: dict) -> Path:
+        # names sort by the recording time
+        name = f'{time.time_ns()}-{meta["relationId"]}'
+        (self._path / f'{name}.bin').write_bytes(request)
+        (self._path / f'{name}.json').write_bytes(orjson.dumps(meta, option=orjson.OPT_INDENT_2))
+
+        for meta_path in sorted(self._path.glob('*.json'))[: -self._max_records]:
+            meta_path.with_suffix('.bin').unlink(missing_ok=True)
+            meta_path.unlink(missing_ok=True)
+
+        return self._path / name
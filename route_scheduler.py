@@ -0,0 +1,168 @@
+import asyncio
+from collections.abc import AsyncIterator, Awaitable, Callable
+from concurrent.futures import Executor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from itertools import count
+
+from fastapi import HTTPException, status
+
+from config import (
+    CALC_ROUTE_ITER_PER_WAY,
+    CALC_ROUTE_MAX_QUEUED,
+    CALC_ROUTE_MAX_QUEUED_PER_USER,
+    CALC_ROUTE_MAX_REQUESTS,
+    CALC_ROUTE_MAX_TIMEOUT,
+    CALC_ROUTE_MIN_TIMEOUT,
+    CALC_ROUTE_N_PROCESSES,
+    CALC_ROUTE_QUEUE_COST_DELAY,
+)
+from cython_lib.route import REFERENCE_ITERATION_RATE, SearchBudget, calibrate_iteration_rate
+
+_SEQUENCE = count()
+
+
+@dataclass(kw_only=True, slots=True, eq=False)
+class _Entry:
+    user_id: int
+    deadline: float
+    sequence: int = field(default_factory=lambda: next(_SEQUENCE))
+    granted: asyncio.Event = field(default_factory=asyncio.Event)
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+    position: int = 0
+
+
+class RouteScheduler:
+    """
+    Admission control for route calculations.
+
+    At most max_running calculations hold a slot at once. Waiting requests are ordered
+    by the number of calculations their user is already running, then by a virtual deadline:
+    the arrival time delayed proportionally to the relation size, so small relations go first
+    without starving the large ones.
+    """
+
+    def __init__(
+        self,
+        max_running: int = CALC_ROUTE_MAX_REQUESTS,
+        max_queued: int = CALC_ROUTE_MAX_QUEUED,
+        max_queued_per_user: int = CALC_ROUTE_MAX_QUEUED_PER_USER,
+    ):
+        self._max_running = max_running
+        self._max_queued = max_queued
+        self._max_queued_per_user = max_queued_per_user
+        self._running: dict[int, int] = {}
+        self._running_count = 0
+        self._queue: list[_Entry] = []
+        self.iteration_rate: float = REFERENCE_ITERATION_RATE
+
+    @property
+    def running(self) -> int:
+        return self._running_count
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    async def calibrate(self, executor: Executor) -> None:
+        """
+        Measure the iteration rate on the worker processes, which run the bulk of the search.
+        """
+        loop = asyncio.get_running_loop()
+        self.iteration_rate = await loop.run_in_executor(executor, calibrate_iteration_rate)
+        print(f'🏎️ Route search calibrated at {self.iteration_rate:.0f} iterations/s')
+
+    def budget(self, cost: int, n_processes: int = CALC_ROUTE_N_PROCESSES) -> SearchBudget:
+        """
+        Get the search budget for a relation of cost ways, after it was admitted.
+        """
+        timeout = cost * CALC_ROUTE_ITER_PER_WAY / (self.iteration_rate * n_processes)
+        load = (self._running_count + len(self._queue)) / self._max_running
+        timeout = min(max(timeout / max(load, 1), CALC_ROUTE_MIN_TIMEOUT), CALC_ROUTE_MAX_TIMEOUT)
+        return SearchBudget.create(self.iteration_rate, timeout)
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        user_id: int,
+        cost: int,
+        on_position: Callable[[int], Awaitable[None]] | None = None,
+    ) -> AsyncIterator[None]:
+        """
+        Wait for a calculation slot; cost is the relation size in ways.
+
+        on_position is awaited with the 1-based queue position whenever it changes.
+        """
+        if self._running_count < self._max_running and not self._queue:
+            self._acquire(user_id)
+        else:
+            await self._wait(user_id, cost, on_position)
+
+        try:
+            yield
+        finally:
+            self._release(user_id)
+
+    async def _wait(self, user_id: int, cost: int, on_position: Callable[[int], Awaitable[None]] | None) -> None:
+        if len(self._queue) >= self._max_queued:
+            raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, 'Route calculation queue is full')
+
+        if sum(entry.user_id == user_id for entry in self._queue) >= self._max_queued_per_user:
+            raise HTTPException(status.HTTP_429_TOO_MANY_REQUESTS, 'Too many queued route calculations')
+
+        loop = asyncio.get_running_loop()
+        entry = _Entry(user_id=user_id, deadline=loop.time() + cost * CALC_ROUTE_QUEUE_COST_DELAY)
+        self._queue.append(entry)
+        self._update_positions()
+
+        try:
+            while not entry.granted.is_set():
+                # cleared before the send, so a grant or a new position during it is not lost
+                entry.changed.clear()
+
+                if on_position is not None:
+                    await on_position(entry.position)
+                    if entry.granted.is_set():
+                        break
+
+                await entry.changed.wait()
+
+        except BaseException:
+            if entry.granted.is_set():
+                # the slot was handed over, but the waiter is gone
+                self._release(user_id)
+            else:
+                self._queue.remove(entry)
+                self._update_positions()
+            raise
+
+    def _acquire(self, user_id: int) -> None:
+        self._running[user_id] = self._running.get(user_id, 0) + 1
+        self._running_count += 1
+
+    def _release(self, user_id: int) -> None:
+        if (running := self._running[user_id] - 1) > 0:
+            self._running[user_id] = running
+        else:
+            del self._running[user_id]
+
+        self._running_count -= 1
+
+        if self._queue and self._running_count < self._max_running:
+            entry = min(self._queue, key=self._priority)
+            self._queue.remove(entry)
+            self._acquire(entry.user_id)
+            entry.granted.set()
+            entry.changed.set()
+            self._update_positions()
+
+    def _priority(self, entry: _Entry) -> tuple[int, float, int]:
+        return self._running.get(entry.user_id, 0), entry.deadline, entry.sequence
+
+    def _update_positions(self) -> None:
+        self._queue.sort(key=self._priority)
+
+        for position, entry in enumerate(self._queue, 1):
+            if entry.position != position:
+                entry.position = position
+                entry.changed.set()
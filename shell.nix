@@ -33,6 +33,7 @@ let
     (writeShellScriptBin "cython-build" "cd cython_lib && python setup.py build_ext --inplace")
     (writeShellScriptBin "cython-clean" "rm -rf cython_lib/build/ cython_lib/*{.c,.html,.so}")
     # -- Misc
+    (writeShellScriptBin "osm-extract" "python osm_extract.py \"$@\"")
     (writeShellScriptBin "run" ''
       python -m gunicorn main:app \
         --worker-class uvicorn.workers.UvicornWorker \
@@ -1,5 +1,6 @@
 import { hideDownloadBar, showDownloadBar } from "./map.js"
 import { processFetchRelationData, relationId } from "./menu.js"
+import { PACKED_MEDIA_TYPE, parseResponse } from "./packed.js"
 import { deflateCompress } from "./utils.js"
 
 export let downloadHistoryData = null
@@ -63,6 +64,7 @@ export const processDownloadTriggers = async (_retrying = false) => {
     fetch("/query", {
         method: "POST",
         headers: {
+            Accept: PACKED_MEDIA_TYPE,
             "Content-Encoding": "deflate",
             "Content-Type": "application/json",
         },
@@ -79,7 +81,7 @@ export const processDownloadTriggers = async (_retrying = false) => {
                 throw new Error("HTTP error")
             }
 
-            return resp.json()
+            return parseResponse(resp)
         })
         .then((data) => {
             processFetchRelationData(data)
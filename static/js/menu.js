@@ -2,6 +2,7 @@ import { busStopData, processBusStopData } from "./busStopsLayer.js"
 import { downloadHistoryData, processRelationDownloadTriggers } from "./downloadTriggers.js"
 import { map } from "./map.js"
 import { showMessage } from "./messageBox.js"
+import { PACKED_MEDIA_TYPE, parseResponse } from "./packed.js"
 import { createElementFromHTML, deflateCompress, getBusCollectionName } from "./utils.js"
 import { processRelationEndpointData } from "./waysEndpoint.js"
 import { processRelationWaysData, removeMembersList, waysData } from "./waysLayer.js"
@@ -64,6 +65,7 @@ loadRelationForm.addEventListener("submit", (e) => {
     fetch("/query", {
         method: "POST",
         headers: {
+            Accept: PACKED_MEDIA_TYPE,
             "Content-Type": "application/json",
         },
         body: JSON.stringify({
@@ -76,7 +78,7 @@ loadRelationForm.addEventListener("submit", (e) => {
                 return
             }
 
-            return resp.json()
+            return parseResponse(resp)
         })
         .then((data) => {
             if (!data) return
@@ -227,6 +229,7 @@ editReloadBtn.onclick = async () => {
     fetch("/query", {
         method: "POST",
         headers: {
+            Accept: PACKED_MEDIA_TYPE,
             "Content-Encoding": "deflate",
             "Content-Type": "application/json",
         },
@@ -243,7 +246,7 @@ editReloadBtn.onclick = async () => {
                 return
             }
 
-            return resp.json()
+            return parseResponse(resp)
         })
         .then((data) => {
             processFetchRelationData(data)
@@ -273,6 +276,30 @@ const styleStopName = (name) => {
     })
 }
 
+export const processRouteError = (message) => {
+    editSubmitBtn.classList.add("d-none")
+
+    editWarnings.innerHTML = ""
+    const warning = createElementFromHTML(`
+    <div class="warning warning-HIGH">
+        <div class="warning-message"></div>
+    </div>`)
+    warning.querySelector(".warning-message").textContent = message
+    editWarnings.appendChild(warning)
+}
+
+export const processRouteQueuePosition = (position) => {
+    editSubmitBtn.classList.add("d-none")
+
+    editWarnings.innerHTML = ""
+    editWarnings.appendChild(
+        createElementFromHTML(`
+    <div class="warning warning-LOW">
+        <div class="warning-message">Waiting for route calculation (position ${position} in queue)</div>
+    </div>`),
+    )
+}
+
 export const processRouteStops = (data) => {
     routeSummary.innerHTML = ""
 
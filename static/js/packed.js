@@ -0,0 +1,161 @@
+// decoder for the compact binary responses, see packed_format.py
+export const PACKED_MEDIA_TYPE = "application/vnd.relatify.packed"
+
+const PACKED_MAGIC = "RLP1"
+const COORD_SCALE = 10_000_000
+const LENGTH_SCALE = 1000
+
+const FLAG_MEMBER = 1 << 0
+const FLAG_ONEWAY = 1 << 1
+const FLAG_ROUNDABOUT = 1 << 2
+const FLAG_TURN_IN_PLACE_START = 1 << 3
+const FLAG_TURN_IN_PLACE_END = 1 << 4
+const FLAG_REVERSED_LATLNGS = 1 << 5
+
+class VarintReader {
+    constructor(bytes) {
+        this.bytes = bytes
+        this.position = 0
+    }
+
+    // numbers are exact up to 2^53, which covers osm ids and fixed-point coordinates
+    read() {
+        let result = 0
+        let multiplier = 1
+        let byte
+
+        do {
+            byte = this.bytes[this.position++]
+            result += (byte & 0x7f) * multiplier
+            multiplier *= 128
+        } while (byte & 0x80)
+
+        return result
+    }
+
+    readSigned() {
+        const value = this.read()
+        return value % 2 === 1 ? -(value + 1) / 2 : value / 2
+    }
+
+    readArray(count) {
+        const result = new Array(count)
+        for (let i = 0; i < count; i++) result[i] = this.read()
+        return result
+    }
+
+    readDeltas(count) {
+        const result = new Array(count)
+        let value = 0
+        for (let i = 0; i < count; i++) {
+            value += this.readSigned()
+            result[i] = value
+        }
+        return result
+    }
+}
+
+const decodeWays = (reader, strings) => {
+    const count = reader.read()
+    const ids = reader.readArray(count)
+    const flags = reader.readArray(count)
+    const nodesCounts = reader.readArray(count)
+    const connectedCounts = reader.readArray(count)
+    const connected = reader.readArray(connectedCounts.reduce((a, b) => a + b, 0))
+    const totalNodes = nodesCounts.reduce((a, b) => a + b, 0)
+    const nodes = reader.readDeltas(totalNodes)
+    const lats = reader.readDeltas(totalNodes)
+    const lngs = reader.readDeltas(totalNodes)
+    const lengths = reader.readArray(count)
+    const midpoints = new Array(count)
+    for (let i = 0; i < count; i++) midpoints[i] = [reader.readSigned() / COORD_SCALE, 0]
+    for (let i = 0; i < count; i++) midpoints[i][1] = reader.readSigned() / COORD_SCALE
+
+    const result = new Array(count)
+    let nodesOffset = 0
+    let connectedOffset = 0
+
+    for (let i = 0; i < count; i++) {
+        const nodesEnd = nodesOffset + nodesCounts[i]
+        const connectedEnd = connectedOffset + connectedCounts[i]
+        const latLngs = new Array(nodesCounts[i])
+
+        for (let j = nodesOffset; j < nodesEnd; j++)
+            latLngs[j - nodesOffset] = [lats[j] / COORD_SCALE, lngs[j] / COORD_SCALE]
+
+        result[i] = {
+            way: {
+                id: strings[ids[i]],
+                member: Boolean(flags[i] & FLAG_MEMBER),
+                oneway: Boolean(flags[i] & FLAG_ONEWAY),
+                roundabout: Boolean(flags[i] & FLAG_ROUNDABOUT),
+                nodes: nodes.slice(nodesOffset, nodesEnd),
+                latLngs: latLngs,
+                connectedTo: connected.slice(connectedOffset, connectedEnd).map((j) => strings[j]),
+                turn_in_place_start: Boolean(flags[i] & FLAG_TURN_IN_PLACE_START),
+                turn_in_place_end: Boolean(flags[i] & FLAG_TURN_IN_PLACE_END),
+                length: lengths[i] / LENGTH_SCALE,
+                midpoint: midpoints[i],
+            },
+            reversed_latLngs: Boolean(flags[i] & FLAG_REVERSED_LATLNGS),
+        }
+
+        nodesOffset = nodesEnd
+        connectedOffset = connectedEnd
+    }
+
+    return result
+}
+
+const decodeLatLngs = (reader) => {
+    const count = reader.read()
+    const lats = reader.readDeltas(count)
+    const lngs = reader.readDeltas(count)
+    return lats.map((lat, i) => [lat / COORD_SCALE, lngs[i] / COORD_SCALE])
+}
+
+const resolveMarkers = (value, sections, strings) => {
+    if (Array.isArray(value)) return value.map((item) => resolveMarkers(item, sections, strings))
+    if (value === null || typeof value !== "object") return value
+
+    if ("$waysById" in value) {
+        const result = {}
+        for (const { way } of decodeWays(sections[value.$waysById], strings)) result[way.id] = way
+        return result
+    }
+    if ("$ways" in value) return decodeWays(sections[value.$ways], strings).map(({ way }) => way)
+    if ("$routeWays" in value) return decodeWays(sections[value.$routeWays], strings)
+    if ("$latLngs" in value) return decodeLatLngs(sections[value.$latLngs])
+
+    const result = {}
+    for (const [key, item] of Object.entries(value)) result[key] = resolveMarkers(item, sections, strings)
+    return result
+}
+
+export const unpack = (buffer) => {
+    const bytes = new Uint8Array(buffer)
+    const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength)
+    const decoder = new TextDecoder()
+
+    if (decoder.decode(bytes.subarray(0, 4)) !== PACKED_MAGIC) throw new Error("Invalid packed data")
+
+    const headerLength = view.getUint32(4, true)
+    let position = 8 + headerLength
+    const header = JSON.parse(decoder.decode(bytes.subarray(8, position)))
+    const sections = []
+
+    while (position < bytes.length) {
+        const sectionLength = view.getUint32(position, true)
+        position += 4
+        sections.push(new VarintReader(bytes.subarray(position, position + sectionLength)))
+        position += sectionLength
+    }
+
+    return resolveMarkers(header.data, sections, header.strings)
+}
+
+// parse a fetch response, accepting both packed and json content
+export const parseResponse = async (resp) => {
+    if (resp.headers.get("Content-Type") === PACKED_MEDIA_TYPE) return unpack(await resp.arrayBuffer())
+    return await resp.json()
+}
@@ -64,6 +64,12 @@ export const deflateCompress = async (data) => {
 }
 
 export const deflateDecompress = async (data) => {
+    const decoder = new TextDecoder()
+    const json = decoder.decode(await deflateDecompressBytes(data))
+    return JSON.parse(json)
+}
+
+export const deflateDecompressBytes = async (data) => {
     const decompressionStream = new DecompressionStream("deflate-raw")
 
     const writer = decompressionStream.writable.getWriter()
@@ -92,9 +98,7 @@ export const deflateDecompress = async (data) => {
         position += chunk.length
     }
 
-    const decoder = new TextDecoder()
-    const json = decoder.decode(concatenatedChunks)
-    return JSON.parse(json)
+    return concatenatedChunks
 }
 
 export const getBusCollectionName = (collection) => {
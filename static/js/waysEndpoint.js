@@ -11,12 +11,15 @@ export let stopWay = null
 export function processRelationEndpointData(fetchData) {
     if (fetchData) {
         if (fetchData.fetchMerge) {
-            if (startWay && !fetchData.ways[startWay.id]) {
+            const isRemoved = (way) =>
+                fetchData.fetchDiff ? fetchData.removedWays.includes(way.id) : !fetchData.ways[way.id]
+
+            if (startWay && isRemoved(startWay)) {
                 setStartMarker(null)
                 clearPopup()
             }
 
-            if (stopWay && !fetchData.ways[stopWay.id]) {
+            if (stopWay && isRemoved(stopWay)) {
                 setStopMarker(null)
                 clearPopup()
             }
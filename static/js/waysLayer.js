@@ -30,13 +30,19 @@ export function processRelationWaysData(fetchData) {
                 }
             }
 
-            waysData = fetchData.ways
-
-            for (const way of Object.values(waysData)) {
+            for (const way of Object.values(fetchData.ways)) {
                 const memberCandidates = [memberMap.get(way.id), memberMap.get(way.id.split("_")[0])]
 
                 way.member = memberCandidates.find((m) => m !== undefined) || false
             }
+
+            if (fetchData.fetchDiff) {
+                for (const wayId of fetchData.removedWays) delete waysData[wayId]
+
+                Object.assign(waysData, fetchData.ways)
+            } else {
+                waysData = fetchData.ways
+            }
         } else {
             waysData = fetchData.ways
         }
@@ -1,7 +1,15 @@
 import { clearAntPath, processRouteAntPath } from "./antPathLayer.js"
 import { busStopData } from "./busStopsLayer.js"
-import { processRouteStops, processRouteWarnings, relationId, relationTags } from "./menu.js"
-import { deflateCompress, deflateDecompress } from "./utils.js"
+import {
+    processRouteError,
+    processRouteQueuePosition,
+    processRouteStops,
+    processRouteWarnings,
+    relationId,
+    relationTags,
+} from "./menu.js"
+import { unpack } from "./packed.js"
+import { deflateCompress, deflateDecompressBytes } from "./utils.js"
 import { startWay, stopWay } from "./waysEndpoint.js"
 import { waysData } from "./waysLayer.js"
 
@@ -76,7 +84,19 @@ const onopen = async () => {
 }
 
 const onmessage = async (e) => {
-    const data = await deflateDecompress(e.data)
+    // text frames are status updates, binary frames are routes
+    if (typeof e.data === "string") {
+        const status = JSON.parse(e.data)
+        if (status.queuePosition) processRouteQueuePosition(status.queuePosition)
+        if (status.error) {
+            processRouteError(status.error)
+            awaitingResponse = false
+            await onopen()
+        }
+        return
+    }
+
+    const data = unpack(await deflateDecompressBytes(e.data))
 
     processRouteData(data)
     processRouteAntPath(data)
@@ -104,7 +124,7 @@ const onclose = async (e) => {
 }
 
 let ws = new WebSocket(
-    `${document.location.protocol === "https:" ? "wss" : "ws"}://${document.location.host}/ws/calc_bus_route`,
+    `${document.location.protocol === "https:" ? "wss" : "ws"}://${document.location.host}/ws/calc_bus_route?format=packed`,
 )
 ws.binaryType = "arraybuffer"
 ws.onopen = onopen
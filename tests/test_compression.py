@@ -0,0 +1,90 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+import zstandard
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from compression import (
+    CompressionDictionary,
+    DecompressedSizeError,
+    brotli_compress,
+    brotli_decompress,
+    dcz_compress,
+    dcz_header,
+    deflate_compress,
+    deflate_decompress,
+    zstd_compress,
+    zstd_compressobj,
+    zstd_decompress,
+)
+from config import REQUEST_MAX_SIZE
+from deflate_middleware import DeflateRoute
+
+_CODECS = {
+    'deflate': (deflate_compress, deflate_decompress),
+    'br': (brotli_compress, brotli_decompress),
+    'zstd': (zstd_compress, zstd_decompress),
+}
+
+
+@pytest.mark.parametrize('encoding', _CODECS)
+def test_decompress_max_size(encoding: str):
+    compress, decompress = _CODECS[encoding]
+    data = bytes(1000)
+    compressed = compress(data)
+
+    assert decompress(compressed, max_size=1000) == data
+    with pytest.raises(DecompressedSizeError):
+        decompress(compressed, max_size=999)
+
+
+def test_zstd_streamed_frame_max_size():
+    # no content size in the frame header
+    compressor = zstd_compressobj()
+    compressed = compressor.compress(bytes(1000)) + compressor.flush()
+
+    assert zstd_decompress(compressed, max_size=1000) == bytes(1000)
+    with pytest.raises(DecompressedSizeError):
+        zstd_decompress(compressed, max_size=999)
+
+
+def test_zstd_compress_threads(tmp_path: Path):
+    path = tmp_path / 'dictionary'
+    path.write_bytes(b'{"id": "way/1", "latLng": [52.1, 21.5]}' * 100)
+    dictionary = CompressionDictionary.load(path)
+    rng = random.Random(0)  # noqa: S311
+    payloads = [rng.randbytes(256) * rng.randrange(100, 2000) for _ in range(64)]
+
+    def round_trip(data: bytes) -> bool:
+        compressed = dcz_compress(data, dictionary)[len(dcz_header(dictionary)) :]
+        decompressor = zstandard.ZstdDecompressor(dict_data=dictionary.zstd)
+        return zstd_decompress(zstd_compress(data)) == data and decompressor.decompress(compressed) == data
+
+    with ThreadPoolExecutor(8) as executor:
+        assert all(executor.map(round_trip, payloads))
+
+
+@pytest.fixture(scope='module')
+def client() -> TestClient:
+    app = FastAPI()
+    app.router.route_class = DeflateRoute
+
+    @app.post('/echo')
+    async def echo(request: Request) -> int:
+        return len(await request.body())
+
+    return TestClient(app)
+
+
+@pytest.mark.parametrize('encoding', _CODECS)
+def test_request_too_large(client: TestClient, encoding: str):
+    compress, _ = _CODECS[encoding]
+
+    r = client.post('/echo', content=compress(bytes(1000)), headers={'Content-Encoding': encoding})
+    assert r.json() == 1000
+
+    r = client.post('/echo', content=compress(bytes(REQUEST_MAX_SIZE + 1)), headers={'Content-Encoding': encoding})
+    assert r.status_code == 413
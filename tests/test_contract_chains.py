@@ -0,0 +1,73 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from benchmarks.fixtures import SCENARIOS
+from cython_lib import route
+from cython_lib.route import REFERENCE_ITERATION_RATE, SearchBudget, calc_bus_route, contract_chains
+from models.element_id import ElementId
+from models.fetch_relation import FetchRelationElement
+
+
+def _way(way_id: str, nodes: list[int], connected_to: list[str]) -> FetchRelationElement:
+    return FetchRelationElement(
+        id=ElementId(way_id),
+        member=True,
+        oneway=False,
+        roundabout=False,
+        nodes=nodes,
+        latLngs=[(52.0, 21.0 + node * 0.001) for node in nodes],
+        connectedTo=[ElementId(w) for w in connected_to],
+        turn_in_place_start=False,
+        turn_in_place_end=False,
+    )
+
+
+def test_contracted_geometry():
+    # a straight road, the middle ways form a chain
+    ways = {
+        way.id: way
+        for way in (
+            _way('1', [0, 1], ['2']),
+            _way('2', [1, 2, 3], ['1', '3']),
+            _way('3', [3, 4], ['2', '4']),
+            _way('4', [4, 5, 6, 7], ['3', '5']),
+            _way('5', [7, 8], ['4']),
+        )
+    }
+
+    result_ways, chains, _ = contract_chains(ways, ElementId('1'), ElementId('5'), {})
+
+    assert [key.way_id for key in chains['2']] == ['2', '3', '4']
+    chain_way = result_ways['2']
+    assert chain_way.nodes == [1, 2, 3, 4, 5, 6, 7]
+    assert chain_way.length == pytest.approx(sum(ways[w].length for w in ('2', '3', '4')))
+    assert chain_way.midpoint == pytest.approx((52.0, 21.004))
+
+
+def _route_key(final_route) -> tuple:
+    return (
+        tuple((route_way.way.id, route_way.reversed_latLngs) for route_way in final_route.ways),
+        tuple(collection.best.id for collection in final_route.busStops),
+    )
+
+
+@pytest.mark.parametrize('name', ['small_urban', 'grid_city', 'roundabout_heavy'])
+def test_contracted_search_matches_uncontracted(name: str, monkeypatch: pytest.MonkeyPatch):
+    model = SCENARIOS[name]()
+    budget = SearchBudget.create(REFERENCE_ITERATION_RATE, timeout=float('inf'))
+
+    async def search():
+        with ThreadPoolExecutor(2) as executor:
+            final_route = await calc_bus_route(
+                model.ways, model.startWay, model.stopWay, model.busStops, model.tags, executor, 2, budget
+            )
+        return _route_key(final_route)
+
+    contracted = asyncio.run(search())
+
+    monkeypatch.setattr(route, 'contract_chains', lambda ways, _start, _end, bus_map: (ways, {}, bus_map))
+    uncontracted = asyncio.run(search())
+
+    assert contracted == uncontracted
@@ -0,0 +1,104 @@
+from dataclasses import dataclass, field
+from enum import Enum
+
+import pytest
+
+from dataclass_decoder import DecodeError, compile_decoder
+from models.element_id import ElementId
+
+
+class _Color(Enum):
+    RED = 'red'
+
+
+@dataclass(frozen=True, kw_only=True)
+class _Item:
+    id: ElementId
+    latLng: tuple[float, float]
+    tags: dict[str, str]
+    color: _Color
+    length: float = 0
+    note: str | None = None
+    ids: list[int] = field(default_factory=list)
+    parts: tuple[int, ...] = ()
+
+
+_CAST = (ElementId, tuple, _Color)
+_ITEM = {'id': '1', 'latLng': [52.1, 21.5], 'tags': {'name': 'A'}, 'color': 'red'}
+
+_ACCEPTED = [
+    (_ITEM, _Item(id='1', latLng=(52.1, 21.5), tags={'name': 'A'}, color=_Color.RED)),
+    # cast to str and tuple
+    (
+        {**_ITEM, 'id': 5, 'parts': [1, 2]},
+        _Item(id='5', latLng=(52.1, 21.5), tags={'name': 'A'}, color=_Color.RED, parts=(1, 2)),
+    ),
+    # integral floats, as serialized by the browsers
+    (
+        {**_ITEM, 'latLng': [52, 21], 'length': 3},
+        _Item(id='1', latLng=(52, 21), tags={'name': 'A'}, color=_Color.RED, length=3),
+    ),
+    # ElementId is str, so all strings are cast
+    (
+        {**_ITEM, 'tags': {'name': 1}},
+        _Item(id='1', latLng=(52.1, 21.5), tags={'name': '1'}, color=_Color.RED),
+    ),
+    (
+        {**_ITEM, 'note': None, 'ids': [1, 2]},
+        _Item(id='1', latLng=(52.1, 21.5), tags={'name': 'A'}, color=_Color.RED, ids=[1, 2]),
+    ),
+]
+
+_REJECTED = [
+    ({**_ITEM, 'extra': 1}, 'unexpected _Item fields'),
+    ({k: v for k, v in _ITEM.items() if k != 'tags'}, 'missing _Item fields'),
+    ({**_ITEM, 'tags': ['name']}, 'tags: expected object'),
+    ({**_ITEM, 'latLng': [52.1]}, 'latLng: expected array of 2 items'),
+    ({**_ITEM, 'latLng': [52.1, '21.5']}, 'latLng.1: expected float'),
+    ({**_ITEM, 'length': '3'}, 'length: expected float'),
+    ({**_ITEM, 'color': 'blue'}, 'color: cannot cast'),
+    ({**_ITEM, 'ids': [1, 'a']}, 'ids.[]: expected int'),
+    ([], 'expected _Item object'),
+]
+
+
+@pytest.mark.parametrize(('value', 'expected'), _ACCEPTED)
+def test_accepted(value: dict, expected: _Item):
+    result = compile_decoder(_Item, cast=_CAST)(value)
+    assert result == expected
+    assert isinstance(result.latLng, tuple)
+
+
+@pytest.mark.parametrize(('value', 'message'), _REJECTED)
+def test_rejected(value, message: str):
+    with pytest.raises(DecodeError, match=message.replace('[', r'\[').replace(']', r'\]')):
+        compile_decoder(_Item, cast=_CAST)(value)
+
+
+def test_not_cast():
+    # json has no tuples and enums, without casting they are rejected
+    decode = compile_decoder(_Item)
+
+    with pytest.raises(DecodeError, match='latLng'):
+        decode(_ITEM)
+    with pytest.raises(DecodeError, match='color: expected _Color, got str'):
+        decode({**_ITEM, 'latLng': (52.1, 21.5)})
+
+
+# dacite fails with an AttributeError on non-objects
+@pytest.mark.parametrize('value', [value for value, _ in (*_ACCEPTED, *_REJECTED) if isinstance(value, dict)])
+def test_matches_dacite(value: dict):
+    dacite = pytest.importorskip('dacite')
+    config = dacite.Config(cast=list(_CAST), strict=True)
+
+    try:
+        expected = dacite.from_dict(_Item, value, config)
+    except (dacite.DaciteError, TypeError, ValueError):
+        expected = None
+
+    try:
+        result = compile_decoder(_Item, cast=_CAST)(value)
+    except DecodeError:
+        result = None
+
+    assert result == expected
@@ -0,0 +1,36 @@
+import random
+
+import numpy as np
+import pytest
+
+from models.fetch_relation import _calculate_length_and_midpoint, calculate_ways_length_and_midpoint
+
+
+@pytest.mark.parametrize(
+    'latLngs',
+    [
+        [(52.0, 21.0)],
+        [(52.0, 21.0), (52.0, 21.0)],
+        [(52.0, 21.0), (52.0, 21.0), (52.0, 21.001)],
+        [(52.0, 21.0), (52.0, 21.001), (52.0, 21.001)],
+    ],
+)
+def test_zero_length_segments(latLngs: list[tuple[float, float]]):
+    length, midpoint = _calculate_length_and_midpoint(latLngs)
+    assert length >= 0
+    assert len(midpoint) == 2
+
+
+def test_matches_vectorized():
+    rng = random.Random(0)  # noqa: S311
+    ways = [
+        [(52 + rng.randrange(3) * 0.001, 21 + rng.randrange(3) * 0.001) for _ in range(rng.randrange(2, 6))]
+        for _ in range(200)
+    ]
+
+    lengths, midpoints = calculate_ways_length_and_midpoint(
+        np.array([latLng for way in ways for latLng in way]), np.array([len(way) for way in ways])
+    )
+
+    for way, length, midpoint in zip(ways, lengths, midpoints, strict=True):
+        assert _calculate_length_and_midpoint(way) == (pytest.approx(length), pytest.approx(midpoint))
@@ -0,0 +1,55 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+from httpx import AsyncClient, ConnectError, MockTransport, Request, Response
+
+from http_replay import ReplayTransport
+
+
+def _network(requests: list[Request]) -> MockTransport:
+    def handler(request: Request) -> Response:
+        requests.append(request)
+        return Response(200, json={'authorization': request.headers.get('Authorization')})
+
+    return MockTransport(handler)
+
+
+def _get(transport: ReplayTransport, headers: dict | None = None, path: str = '/data') -> Response:
+    async def main():
+        async with AsyncClient(transport=transport) as client:
+            return await client.get(f'https://api.example.org{path}', headers=headers)
+
+    return asyncio.run(main())
+
+
+def test_record_and_replay(tmp_path: Path):
+    requests = []
+    _get(ReplayTransport(tmp_path, record=True, transport=_network(requests)))
+    assert len(requests) == 1
+
+    r = _get(ReplayTransport(tmp_path, transport=_network(requests)))
+    assert r.json() == {'authorization': None}
+    assert len(requests) == 1
+
+
+def test_authenticated_bypass(tmp_path: Path):
+    requests = []
+    headers = {'Authorization': 'Bearer secret'}
+
+    _get(ReplayTransport(tmp_path, record=True, transport=_network(requests)), headers)
+    assert not any(tmp_path.iterdir())
+
+    r = _get(ReplayTransport(tmp_path, transport=_network(requests)), headers)
+    assert r.json() == {'authorization': 'Bearer secret'}
+    assert len(requests) == 2
+
+    with pytest.raises(ConnectError):
+        _get(ReplayTransport(tmp_path, transport=_network(requests)))
+
+
+def test_token_exchange_bypass(tmp_path: Path):
+    requests = []
+    _get(ReplayTransport(tmp_path, record=True, transport=_network(requests)), path='/oauth2/token')
+    assert not any(tmp_path.iterdir())
+    assert len(requests) == 1
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from overpass import NodeCoords
+
+
+def test_lookup():
+    node_coords = NodeCoords.from_elements(
+        [{'id': 3, 'lat': 3.0, 'lon': 30.0}, {'id': 1, 'lat': 1.0, 'lon': 10.0}, {'id': 2, 'lat': 2.0, 'lon': 20.0}]
+    )
+
+    assert node_coords.lookup(np.array([2, 3, 1, 2])).tolist() == [[2, 20], [3, 30], [1, 10], [2, 20]]
+    assert node_coords.lookup(np.array([], np.int64)).shape == (0, 2)
+
+    assert node_coords.find(np.array([0, 1, 3, 4])).tolist() == [-1, 0, 2, -1]
+    assert node_coords.order[node_coords.index(np.array([3, 1]))].tolist() == [0, 1]
+
+    for missing in (0, 4):
+        with pytest.raises(KeyError, match=f'Node {missing} not found'):
+            node_coords.lookup(np.array([1, missing]))
+
+
+def test_lookup_empty_map():
+    node_coords = NodeCoords.from_elements([])
+
+    assert node_coords.lookup(np.array([], np.int64)).shape == (0, 2)
+    assert node_coords.find(np.array([5])).tolist() == [-1]
+    with pytest.raises(KeyError, match='Node 5 not found'):
+        node_coords.lookup(np.array([5]))
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+from httpx import AsyncClient, HTTPStatusError, MockTransport, Request, Response
+
+import openstreetmap
+from openstreetmap import OpenStreetMap
+
+
+def _api(requests: list[Request], release: asyncio.Event, failing: frozenset[int] = frozenset()) -> MockTransport:
+    async def handler(request: Request) -> Response:
+        requests.append(request)
+        ids = tuple(map(int, request.url.params['ways'].split(',')))
+        if failing.intersection(ids):
+            return Response(500)
+
+        await release.wait()
+        return Response(200, json={'elements': [{'type': 'way', 'id': i, 'version': 1, 'nodes': []} for i in ids]})
+
+    return MockTransport(handler)
+
+
+def _patch_api(monkeypatch: pytest.MonkeyPatch, transport: MockTransport) -> None:
+    monkeypatch.setattr(
+        openstreetmap,
+        'get_http_client',
+        lambda base_url, **_: AsyncClient(base_url=base_url, transport=transport),
+    )
+
+
+def test_cancelled_caller(monkeypatch: pytest.MonkeyPatch):
+    async def main():
+        requests = []
+        release = asyncio.Event()
+        _patch_api(monkeypatch, _api(requests, release))
+
+        async with OpenStreetMap() as osm:
+            a = asyncio.create_task(osm.get_ways([1]))
+            await asyncio.sleep(0.01)
+            b = asyncio.create_task(osm.get_ways([1]))
+            await asyncio.sleep(0.01)
+
+            a.cancel()
+            await asyncio.sleep(0.01)
+            release.set()
+
+            assert (await b)[0]['id'] == 1
+            assert a.cancelled()
+            assert len(requests) == 1
+
+    asyncio.run(main())
+
+
+def test_failed_chunk(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(openstreetmap, 'OSM_ELEMENTS_CHUNK_SIZE', 1)
+
+    async def main():
+        requests = []
+        release = asyncio.Event()
+        _patch_api(monkeypatch, _api(requests, release, failing=frozenset((2,))))
+
+        async with OpenStreetMap() as osm:
+            # b joins the fetch of a, before the chunk of 2 fails
+            a = asyncio.create_task(osm.get_ways([1, 2]))
+            b = asyncio.create_task(osm.get_ways([1]))
+            await asyncio.sleep(0.01)
+            release.set()
+
+            assert (await b)[0]['id'] == 1
+            with pytest.raises(HTTPStatusError):
+                await a
+            assert len(requests) == 2
+
+    asyncio.run(main())
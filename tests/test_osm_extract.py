@@ -0,0 +1,110 @@
+import asyncio
+import sqlite3
+from contextlib import closing
+from dataclasses import replace
+from pathlib import Path
+
+import orjson
+import pytest
+
+from models.bounding_box import BoundingBox
+from osm_extract import LocalOverpass, OsmExtract, apply_changes, import_extract
+from osm_xml import parse_osm_xml
+from overpass import split_by_count
+
+pytest.importorskip('osmium')
+
+_FIXTURES = Path(__file__).parent / 'fixtures'
+
+
+def _overpass_bbs() -> list[list[dict]]:
+    return split_by_count(orjson.loads((_FIXTURES / 'extract_bbs.json').read_bytes())['elements'])
+
+
+# the same data, as returned by the overpass queries
+class _OverpassFixture(LocalOverpass):
+    async def _query_relation_ways_bounds(self, relation_id: int) -> list[dict]:
+        assert relation_id == 100
+        return [
+            {'type': 'way', 'id': 10, 'bounds': {'minlat': 52.23, 'minlon': 21.01, 'maxlat': 52.23, 'maxlon': 21.011}},
+            {
+                'type': 'way',
+                'id': 11,
+                'bounds': {'minlat': 52.23, 'minlon': 21.011, 'maxlat': 52.231, 'maxlon': 21.011},
+            },
+        ]
+
+    async def _query_bbs(self, cell_bbs, cell_bbs_expanded, route_type):  # noqa: ARG002
+        return _overpass_bbs()
+
+    async def _query_parents_elements(self, way_ids_set):  # noqa: ARG002
+        parser = parse_osm_xml((_FIXTURES / 'extract_parents.osm').read_bytes())
+        return parser.relations, parser.ways
+
+
+@pytest.fixture(scope='module')
+def extract_path(tmp_path_factory) -> Path:
+    path = tmp_path_factory.mktemp('extract') / 'extract.db'
+    import_extract(path, str(_FIXTURES / 'extract.osm'), None)
+    apply_changes(path, str(_FIXTURES / 'extract.osc'))
+    return path
+
+
+def _normalize_relation(result: tuple) -> tuple:
+    global_bb, download_hist, download_triggers, ways, _, id_map, bus_stop_collections = result
+    return (
+        global_bb,
+        download_hist.history,
+        {way_id: set(cells) for way_id, cells in download_triggers.items()},
+        # lengths are summed in element order
+        {
+            way_id: replace(way, connectedTo=sorted(way.connectedTo), length=round(way.length, 6))
+            for way_id, way in ways.items()
+        },
+        id_map,
+        sorted(bus_stop_collections, key=lambda c: c.best.nice_id),
+    )
+
+
+def test_query_bbs(extract_path: Path):
+    bb = BoundingBox(minlat=52.22, minlon=21.0, maxlat=52.24, maxlon=21.02)
+    local_bbs = OsmExtract(str(extract_path)).query_bbs((bb,), (bb,), 'bus')
+
+    def key(e: dict):
+        return e['type'], e['id']
+
+    assert [sorted(s, key=key) for s in local_bbs] == [sorted(s, key=key) for s in _overpass_bbs()]
+
+
+def test_query_relation(extract_path: Path):
+    async def main():
+        args = (100, None, None, 'bus')
+        expected = await _OverpassFixture(str(extract_path)).query_relation(*args)
+        result = await LocalOverpass(str(extract_path)).query_relation(*args)
+        return expected, result
+
+    expected, result = asyncio.run(main())
+    assert _normalize_relation(result) == _normalize_relation(expected)
+    assert result[3].keys() == {'10', '11', '12', '13'}
+
+
+def test_query_parents(extract_path: Path):
+    async def main():
+        way_ids_set = frozenset((10, 11))
+        expected = await _OverpassFixture(str(extract_path)).query_parents(way_ids_set)
+        result = await LocalOverpass(str(extract_path)).query_parents(way_ids_set)
+        return expected, result
+
+    expected, result = asyncio.run(main())
+    assert result == expected
+    assert result.id_relations_map[11][1].version == 2
+
+
+def test_super_relation_bounds(extract_path: Path):
+    with closing(sqlite3.connect(extract_path)) as conn:
+        bounds = conn.execute('SELECT minlat, maxlat, minlon, maxlon FROM relation WHERE id = 103').fetchone()
+        indexed = conn.execute('SELECT count(*) FROM relation_bb WHERE id = 103').fetchone()[0]
+
+    # union of the route relations, after moving node 5
+    assert bounds == (52.23, 52.2322, 21.01, 21.0125)
+    assert indexed == 1
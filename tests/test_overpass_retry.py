@@ -0,0 +1,28 @@
+import asyncio
+
+import pytest
+from httpx import AsyncClient, HTTPStatusError, MockTransport, Request, Response
+from tenacity import wait_none
+
+import overpass
+from overpass import Overpass
+
+
+@pytest.mark.parametrize(('status_code', 'attempts'), [(429, 3), (500, 3), (504, 3), (400, 1), (404, 1)])
+def test_query_cells_retry(monkeypatch: pytest.MonkeyPatch, status_code: int, attempts: int):
+    requests = []
+
+    def handler(request: Request) -> Response:
+        requests.append(request)
+        return Response(status_code)
+
+    monkeypatch.setattr(Overpass._query_cells_post.retry, 'wait', wait_none())  # noqa: SLF001
+
+    async def main():
+        async with AsyncClient(transport=MockTransport(handler)) as client:
+            monkeypatch.setattr(overpass, 'HTTP', client)
+            with pytest.raises(HTTPStatusError):
+                await Overpass()._query_cells_post('[out:json];', 10)  # noqa: SLF001
+
+    asyncio.run(main())
+    assert len(requests) == attempts
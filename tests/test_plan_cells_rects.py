@@ -0,0 +1,44 @@
+import random
+
+import pytest
+
+from config import DOWNLOAD_RELATION_GRID_PLAN_MAX_CELLS
+from models.download_history import Cell
+from overpass import plan_cells_rects
+
+
+def _assert_cover(cells: set[Cell], rects: list[tuple[int, int, int, int]], optional: set[Cell] = frozenset()):
+    covered = set()
+
+    for x0, y0, x1, y1 in rects:
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                assert Cell(x, y) in cells or Cell(x, y) in optional
+                covered.add(Cell(x, y))
+
+    assert cells <= covered
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_random_cover(seed: int):
+    rng = random.Random(seed)  # noqa: S311
+    cells = {Cell(rng.randrange(12), rng.randrange(12)) for _ in range(rng.randrange(1, 60))}
+    optional = {Cell(rng.randrange(12), rng.randrange(12)) for _ in range(rng.randrange(30))} - cells
+    _assert_cover(cells, plan_cells_rects(cells, optional), optional)
+
+
+def test_full_rectangle():
+    cells = {Cell(x, y) for x in range(5) for y in range(3)}
+    assert plan_cells_rects(cells) == [(0, 0, 4, 2)]
+
+
+def test_diagonal_corridor():
+    cells = {Cell(i, i + k) for i in range(300) for k in range(3)}
+    _assert_cover(cells, plan_cells_rects(cells))
+
+
+def test_large_area_row_runs():
+    cells = {Cell(x, y) for x in range(DOWNLOAD_RELATION_GRID_PLAN_MAX_CELLS) for y in range(2) if x % 3}
+    rects = plan_cells_rects(cells)
+    _assert_cover(cells, rects)
+    assert all(y0 == y1 for _, y0, _, y1 in rects)
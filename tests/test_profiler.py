@@ -0,0 +1,52 @@
+import asyncio
+import time
+from pathlib import Path
+
+import pytest
+
+import profiler
+from offload import offload
+from profiler import arm, profile_relation
+
+
+def _profiled_work() -> None:
+    end = time.perf_counter() + 0.1
+    while time.perf_counter() < end:
+        pass
+
+
+def _other_work() -> None:
+    end = time.perf_counter() + 0.1
+    while time.perf_counter() < end:
+        pass
+
+
+def _offloaded_work() -> int:
+    return sum(range(100_000))
+
+
+def test_profile_relation(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(profiler, 'PROFILE_PATH', str(tmp_path))
+
+    async def profiled() -> None:
+        async with profile_relation('query', 1):
+            _profiled_work()
+            await asyncio.sleep(0.05)  # lets the other task run
+            await offload(_offloaded_work)
+
+    async def other() -> None:
+        await asyncio.sleep(0.01)
+        _other_work()
+
+    async def main():
+        arm('query', 1, 1)
+        await asyncio.gather(profiled(), other())
+        assert profiler._SAMPLER is None  # noqa: SLF001
+
+    asyncio.run(main())
+
+    (path,) = tmp_path.glob('*.collapsed')
+    collapsed = path.read_text()
+    assert '_profiled_work' in collapsed
+    assert '_offloaded_work' in collapsed
+    assert '_other_work' not in collapsed
@@ -0,0 +1,97 @@
+import asyncio
+from dataclasses import replace
+
+import orjson
+
+from models.download_history import Cell, DownloadHistory
+from overpass import Overpass, merge_elements_splits, split_elements_by_cell
+
+_LAT = 52.235
+_CELLS = tuple(Cell(x, 5223) for x in range(2100, 2104))
+
+
+def _elements_split() -> list[list[dict]]:
+    # a road through all cells, with a stop area in every cell
+    nodes = [{'type': 'node', 'id': i, 'lat': _LAT, 'lon': 21.0025 + i * 0.0025} for i in range(15)]
+    ways = [
+        {'type': 'way', 'id': 100 + i, 'nodes': [i, i + 1, i + 2], 'tags': {'highway': 'secondary'}}
+        for i in range(0, 14, 2)
+    ]
+    platforms = []
+    stops = []
+    stop_areas = []
+
+    for i, cell in enumerate(_CELLS):
+        lon = (cell.x + 0.5) * 0.01
+        platforms.append(
+            {
+                'type': 'way',
+                'id': 200 + i,
+                'center': {'lat': _LAT + 0.0001, 'lon': lon},
+                'tags': {'highway': 'platform', 'public_transport': 'platform'},
+            }
+        )
+        stops.append(
+            {'type': 'node', 'id': 300 + i, 'lat': _LAT, 'lon': lon, 'tags': {'public_transport': 'stop_position'}}
+        )
+        stop_areas.append(
+            {
+                'type': 'relation',
+                'id': 400 + i,
+                'members': [
+                    {'type': 'way', 'ref': 200 + i, 'role': 'platform'},
+                    {'type': 'node', 'ref': 300 + i, 'role': 'stop'},
+                ],
+                'tags': {'public_transport': 'stop_area', 'name': f'Stop {i}'},
+            }
+        )
+
+    return [ways, nodes, [], [], stop_areas, platforms, stops]
+
+
+class _CellsOverpass(Overpass):
+    def __init__(self):
+        super().__init__()
+        self._cells_splits = {
+            cell: orjson.dumps(split) for cell, split in split_elements_by_cell(_elements_split(), _CELLS).items()
+        }
+
+    async def _query_cells_cached(self, relation_id, cells, route_type, max_age):  # noqa: ARG002
+        # fresh elements, as loaded from the cell cache
+        return merge_elements_splits(orjson.loads(self._cells_splits[cell]) for cell in cells)
+
+
+def _normalize(ways: dict) -> dict:
+    return {way_id: replace(way, connectedTo=sorted(way.connectedTo)) for way_id, way in ways.items()}
+
+
+def test_consecutive_diffs_match_full_fetch():
+    async def main():
+        overpass = _CellsOverpass()
+        hist = DownloadHistory(session=DownloadHistory.make_session(), history=())
+
+        for i, cells in enumerate((_CELLS[:1], _CELLS[1:2], _CELLS[2:])):
+            _, hist, _, ways, prev_ways, _, stops = await overpass.query_relation(1, hist, cells, 'bus')
+            assert (prev_ways is not None) == (i > 0)
+
+        full_hist = replace(hist, session=DownloadHistory.make_session(), history=hist.history[:-1])
+        _, _, _, full_ways, full_prev_ways, _, full_stops = await overpass.query_relation(
+            1, full_hist, _CELLS[2:], 'bus'
+        )
+        assert full_prev_ways is None
+        return ways, stops, full_ways, full_stops
+
+    ways, stops, full_ways, full_stops = asyncio.run(main())
+    assert _normalize(ways) == _normalize(full_ways)
+    assert len(stops) == len(_CELLS)
+    assert stops == full_stops
+
+
+def test_split_elements_by_cell():
+    elements_split = _elements_split()
+    elements_split[2] = [{'type': 'node', 'id': 1, 'tags': {'highway': 'turning_circle'}}, {'type': 'node', 'id': 999}]
+    cells_splits = split_elements_by_cell(elements_split, _CELLS)
+
+    for cell, (ways, nodes, turn_in_place, *_) in cells_splits.items():
+        assert sorted(e['id'] for e in nodes) == sorted({node_id for way in ways for node_id in way['nodes']})
+        assert [e['id'] for e in turn_in_place] == ([1] if cell == _CELLS[0] else [])
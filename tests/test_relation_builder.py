@@ -0,0 +1,37 @@
+import asyncio
+from collections.abc import Iterable
+
+from osm_xml import OsmMember, OsmRelation
+from overpass import QueryParentsResult
+from relation_builder import _current_parents
+
+
+class _OpenStreetMap:
+    def __init__(self, relations: Iterable[OsmRelation]):
+        self.relations = {r.id: r for r in relations}
+        self.requested: set[int] = set()
+
+    async def get_relations_xml(self, relation_ids: Iterable[int], *, fresh: bool) -> list[OsmRelation]:
+        assert fresh
+        self.requested.update(relation_ids)
+        return [self.relations[relation_id] for relation_id in self.requested if relation_id in self.relations]
+
+
+def _relation(relation_id: int, version: int, way_ids: Iterable[int]) -> OsmRelation:
+    return OsmRelation(
+        id=relation_id, version=version, members=tuple(OsmMember(type='way', ref=ref, role='') for ref in way_ids)
+    )
+
+
+def test_current_parents():
+    # versions from a local extract, the api has moved on
+    extract_parents = QueryParentsResult(
+        id_relations_map={1: [_relation(5, 1, (1, 2)), _relation(10, 1, (1, 2)), _relation(11, 1, (1, 3))]},
+        ways_map={},
+    )
+    osm = _OpenStreetMap([_relation(10, 3, (1, 2, 4)), _relation(11, 2, (3,))])
+
+    parents = asyncio.run(_current_parents(osm, extract_parents, ignore_relation_id=5, fresh=True))  # type: ignore
+
+    assert osm.requested == {10, 11}
+    assert parents.id_relations_map == {1: [_relation(10, 3, (1, 2, 4))]}
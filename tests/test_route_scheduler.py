@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from route_scheduler import RouteScheduler
+
+
+async def _hold(scheduler: RouteScheduler, user_id: int, release: asyncio.Event) -> None:
+    async with scheduler.slot(user_id, 1):
+        await release.wait()
+
+
+def test_grant_during_position_update():
+    async def main():
+        scheduler = RouteScheduler(max_running=1, max_queued=10, max_queued_per_user=10)
+        release = asyncio.Event()
+        sending = asyncio.Event()
+        positions = []
+
+        async def slow_on_position(position: int) -> None:
+            positions.append(position)
+            sending.set()
+            await asyncio.sleep(0.05)
+
+        holder = asyncio.create_task(_hold(scheduler, 1, release))
+        await asyncio.sleep(0)
+
+        async def waiter() -> None:
+            async with scheduler.slot(2, 1, slow_on_position):
+                pass
+
+        waiter_task = asyncio.create_task(waiter())
+        await sending.wait()
+
+        # the slot is handed over while the position is being sent
+        release.set()
+        await holder
+        await asyncio.wait_for(waiter_task, timeout=1)
+
+        assert positions == [1]
+        assert scheduler.running == 0
+        assert scheduler.queued == 0
+
+    asyncio.run(main())
+
+
+def test_position_change_during_position_update():
+    async def main():
+        scheduler = RouteScheduler(max_running=1, max_queued=10, max_queued_per_user=10)
+        release = asyncio.Event()
+        first_sending = asyncio.Event()
+        positions = []
+
+        async def slow_on_position(position: int) -> None:
+            positions.append(position)
+            first_sending.set()
+            await asyncio.sleep(0.05)
+
+        holder = asyncio.create_task(_hold(scheduler, 1, release))
+        await asyncio.sleep(0)
+
+        # a large relation queued first, then a small one from another user overtakes it
+        async def waiter(user_id: int, cost: int, on_position=None) -> None:
+            async with scheduler.slot(user_id, cost, on_position):
+                await release.wait()
+
+        large = asyncio.create_task(waiter(2, 100_000, slow_on_position))
+        await first_sending.wait()
+        small = asyncio.create_task(waiter(3, 1))
+        await asyncio.sleep(0.1)
+
+        # the update moving the large relation to position 2 arrived during the send
+        assert positions == [1, 2]
+
+        release.set()
+        await asyncio.wait_for(asyncio.gather(holder, large, small), timeout=1)
+
+    asyncio.run(main())
+
+
+def test_queue_limits():
+    async def main():
+        scheduler = RouteScheduler(max_running=1, max_queued=2, max_queued_per_user=1)
+        release = asyncio.Event()
+        holder = asyncio.create_task(_hold(scheduler, 1, release))
+        await asyncio.sleep(0)
+
+        queued = asyncio.create_task(_hold(scheduler, 2, release))
+        await asyncio.sleep(0)
+
+        with pytest.raises(HTTPException) as e:
+            async with scheduler.slot(2, 1):
+                pass
+        assert e.value.status_code == 429
+
+        other = asyncio.create_task(_hold(scheduler, 3, release))
+        await asyncio.sleep(0)
+
+        with pytest.raises(HTTPException) as e:
+            async with scheduler.slot(4, 1):
+                pass
+        assert e.value.status_code == 503
+
+        release.set()
+        await asyncio.gather(holder, queued, other)
+        assert scheduler.running == 0
+        assert scheduler.queued == 0
+
+    asyncio.run(main())
@@ -6,6 +6,7 @@ from fastapi.websockets import WebSocket
 from httpx import HTTPStatusError
 from tenacity import retry, stop_after_attempt, wait_exponential
 
+from config import ADMIN_USER_IDS
 from openstreetmap import OpenStreetMap
 
 _USER_CACHE = TTLCache(maxsize=1024, ttl=7200)  # 2 hours
@@ -50,6 +51,12 @@ async def require_user_details(user=Depends(fetch_user_details)) -> dict:
     return user
 
 
+async def require_admin_user(user=Depends(require_user_details)) -> dict:
+    if user['id'] not in ADMIN_USER_IDS:
+        raise HTTPException(status.HTTP_403_FORBIDDEN, detail='Forbidden')
+    return user
+
+
 def require_user_access_token(request: Request) -> str:
     try:
         return request.cookies['access_token']
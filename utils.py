@@ -1,12 +1,11 @@
 import os
 import re
 import ssl
-import time
-from contextlib import contextmanager
 
-from httpx import AsyncClient
+from httpx import AsyncClient, AsyncHTTPTransport
 
-from config import USER_AGENT
+from config import HTTP_REPLAY_PATH, HTTP_REPLAY_RECORD, USER_AGENT
+from http_replay import ReplayTransport
 
 _SSL_CONTEXT = ssl.create_default_context(cafile=os.environ['SSL_CERT_FILE'])
 
@@ -14,41 +13,27 @@ _SSL_CONTEXT = ssl.create_default_context(cafile=os.environ['SSL_CERT_FILE'])
 def get_http_client(base_url: str = '', *, headers: dict | None = None) -> AsyncClient:
     if headers is None:
         headers = {}
+    if HTTP_REPLAY_PATH is not None:
+        transport = ReplayTransport(
+            HTTP_REPLAY_PATH,
+            record=HTTP_REPLAY_RECORD,
+            transport=AsyncHTTPTransport(verify=_SSL_CONTEXT),
+        )
+    else:
+        transport = None
     return AsyncClient(
         base_url=base_url,
         follow_redirects=True,
         timeout=30,
         headers={'User-Agent': USER_AGENT, **headers},
         verify=_SSL_CONTEXT,
+        transport=transport,
     )
 
 
 HTTP = get_http_client()
 
 
-@contextmanager
-def print_run_time(message: str | list):
-    start_time = time.monotonic()
-    try:
-        yield
-    finally:
-        end_time = time.monotonic()
-        elapsed_time = end_time - start_time
-
-        # support message by reference
-        if isinstance(message, list):
-            message = message[0]
-
-        print(f'[⏱️] {message} took {elapsed_time:.3f}s')
-
-
-def ensure_list(obj: dict | list[dict]) -> list[dict]:
-    if isinstance(obj, list):
-        return obj
-    else:
-        return [obj]
-
-
 def normalize_name(
     name: str,
     *,